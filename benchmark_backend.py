@@ -0,0 +1,114 @@
+import argparse
+import statistics
+import time
+
+import torch
+from torch import nn
+
+from laplace.curvature import AsdlGGN, LoraGGN
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Per-batch overhead of creating the curvature backend and its hooks")
+    parser.add_argument("--backend", type=str, default='lora', choices=['lora', 'asdl'],
+                        help="LoraGGN with hook-based Kronecker factors or AsdlGGN with asdl fisher makers.")
+    parser.add_argument("--hessian", type=str, default='kron', choices=['kron', 'diag', 'jacobians'])
+    parser.add_argument("--n_layers", type=int, default=12)
+    parser.add_argument("--hidden_size", type=int, default=256)
+    parser.add_argument("--lora_r", type=int, default=8)
+    parser.add_argument("--seq_len", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--num_classes", type=int, default=4)
+    parser.add_argument("--n_batches", type=int, default=50)
+    parser.add_argument("--n_warmup", type=int, default=5)
+    parser.add_argument("--device", type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    return parser.parse_args()
+
+
+class LoraLinear(nn.Module):
+    def __init__(self, in_features, out_features, r):
+        super().__init__()
+        self.base_layer = nn.Linear(in_features, out_features)
+        self.base_layer.requires_grad_(False)
+        self.lora_A = nn.ModuleDict({'default': nn.Linear(in_features, r, bias=False)})
+        self.lora_B = nn.ModuleDict({'default': nn.Linear(r, out_features, bias=False)})
+
+    def forward(self, x):
+        return self.base_layer(x) + self.lora_B['default'](self.lora_A['default'](x))
+
+
+class Model(nn.Module):
+    """Stack of query/value LoRA projections with a classification head on the last token."""
+    def __init__(self, args):
+        super().__init__()
+        d = args.hidden_size
+        self.q_proj = nn.ModuleList([LoraLinear(d, d, args.lora_r) for _ in range(args.n_layers)])
+        self.v_proj = nn.ModuleList([LoraLinear(d, d, args.lora_r) for _ in range(args.n_layers)])
+        self.head = nn.Linear(d, args.num_classes)
+
+    def forward(self, input_ids, labels=None):
+        h = input_ids
+        for q, v in zip(self.q_proj, self.v_proj):
+            h = h + torch.tanh(q(h)) * v(h)
+        return self.head(h[:, -1])
+
+
+def timed(backend_fn, batch, hessian, N, device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    backend = backend_fn()
+    if hessian == 'jacobians':
+        backend.jacobians(batch)
+    else:
+        getattr(backend, hessian)(batch, N=N)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    model = Model(args).to(device)
+    model.output_size = args.num_classes
+    backend_cls = LoraGGN if args.backend == 'lora' else AsdlGGN
+
+    batches = [{'input_ids': torch.randn(args.batch_size, args.seq_len, args.hidden_size, device=device),
+                'labels': torch.randint(args.num_classes, (args.batch_size,), device=device)}
+               for _ in range(args.n_warmup + args.n_batches)]
+    N = args.batch_size * len(batches)
+
+    def fresh():
+        # a new backend per batch whose hooks are registered and removed every time
+        backend = backend_cls(model, 'classification')
+        fresh.backends.append(backend)
+        if len(fresh.backends) > 1:
+            fresh.backends.pop(0).close()
+        return backend
+    fresh.backends = list()
+
+    persistent_backend = backend_cls(model, 'classification')
+
+    # alternate between both variants such that they see the same load of the machine
+    variants = {'fresh': fresh, 'persistent': lambda: persistent_backend}
+    times = {name: list() for name in variants}
+    for i, batch in enumerate(batches):
+        for name, backend_fn in variants.items():
+            t = timed(backend_fn, batch, args.hessian, N, device)
+            if i >= args.n_warmup:
+                times[name].append(t)
+    results = dict()
+    for name in variants:
+        results[name] = statistics.median(times[name])
+        print(f'{name:>10}: {1e3 * results[name]:.3f} ms per batch (median)')
+    for backend in fresh.backends + [persistent_backend]:
+        backend.close()
+    overhead = results['fresh'] - results['persistent']
+    print(f'overhead removed: {1e3 * overhead:.3f} ms per batch '
+          f'({100 * overhead / results["fresh"]:.1f}%)')
+
+
+if __name__ == "__main__":
+    main()
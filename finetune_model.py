@@ -354,12 +354,7 @@ def main():
     padding = "max_length" if args.pad_to_max_length else False
 
     with accelerator.main_process_first():
-        processed_datasets = raw_datasets.map(
-        lambda examples: preprocessing.preprocess_function(examples,tokenizer,args,padding),
-        batched=True,
-        remove_columns=raw_datasets["train"].column_names,
-        desc="Running tokenizer on dataset",
-        )
+        processed_datasets = preprocessing.tokenize_datasets(raw_datasets, tokenizer, args, padding)
 
     train_dataset = processed_datasets["train"]
     processed_dataset = processed_datasets["validation_matched" if args.task_name == "mnli" else "validation"]
@@ -7,10 +7,12 @@
 REGRESSION = 'regression'
 CLASSIFICATION = 'classification'
 
-from laplace.baselaplace import BaseLaplace, ParametricLaplace, KronLaplace, DiagLaplace, LowRankLaplace
+from laplace.baselaplace import BaseLaplace, ParametricLaplace, KronLaplace, DiagLaplace, LowRankLaplace, \
+    FunctionalLaplace, SoDLaplace
 from laplace.laplace import Laplace
 
 __all__ = ['Laplace',  # direct access to all Laplace classes via unified interface
            'BaseLaplace', 'ParametricLaplace',  # base-class and its (first-level) subclasses
            'KronLaplace', 'DiagLaplace', 'LowRankLaplace',  # all-weights
+           'FunctionalLaplace', 'SoDLaplace',  # function space
            ]  # methods
@@ -1,18 +1,23 @@
 from math import sqrt, pi, log
+import logging
 import numpy as np
 import torch
-from torch.nn.utils import parameters_to_vector, vector_to_parameters
+from torch.nn.utils import parameters_to_vector
 from torch.distributions import MultivariateNormal
 
 from laplace.utils import (parameters_per_layer, invsqrt_precision, 
-                           get_nll, validate, Kron, normal_samples)
+                           get_nll, validate, Kron, KronDecomposed, SketchedFactor, normal_samples, JacobianStore,
+                           SampledLinears,
+                           mc_softmax_predictive, save_tensors, load_tensors,
+                           is_distributed, local_batches, all_reduce_tensors, subset_loader,
+                           RandomSubsetSelection, MaxVarianceSubsetSelection)
 from laplace.curvature import AsdlGGN, AsdlHessian
 from tqdm import tqdm
 import time
-import random
 
 __all__ = ['BaseLaplace', 'ParametricLaplace',
-           'FullLaplace', 'KronLaplace', 'DiagLaplace', 'LowRankLaplace']
+           'FullLaplace', 'KronLaplace', 'DiagLaplace', 'LowRankLaplace',
+           'FunctionalLaplace', 'SoDLaplace']
 
 
 
@@ -83,6 +88,7 @@ class BaseLaplace:
         if backend is None:
             backend = AsdlGGN
         self._backend = None
+        self._backend_config = None
         self._backend_cls = backend
         self._backend_kwargs = dict() if backend_kwargs is None else backend_kwargs
 
@@ -93,8 +99,34 @@ class BaseLaplace:
 
     @property
     def backend(self):
-        return self._backend_cls(self.model, self.likelihood,
+        """Curvature backend that is created once and reused for all batches of `fit`
+        and the predictives such that hooks and buffers are only set up once.
+        It is created again if the model, the likelihood, or the backend arguments change.
+
+        Returns
+        -------
+        backend : laplace.curvature.CurvatureInterface
+        """
+        config = (self.model, self.likelihood, self._backend_cls, dict(self._backend_kwargs))
+        if self._backend is None or not self._same_backend_config(config):
+            self.close()
+            self._backend = self._backend_cls(self.model, self.likelihood,
                                               **self._backend_kwargs)
+            self._backend_config = config
+        return self._backend
+
+    def _same_backend_config(self, config):
+        model, likelihood, backend_cls, kwargs = self._backend_config
+        return (model is config[0] and likelihood == config[1] and backend_cls is config[2]
+                and kwargs.keys() == config[3].keys()
+                and all(v is config[3][k] for k, v in kwargs.items()))
+
+    def close(self):
+        """Remove the hooks of the backend from the model and release its buffers."""
+        if self._backend is not None:
+            self._backend.close()
+        self._backend = None
+        self._backend_config = None
 
     def _curv_closure(self, batch, N):
         raise NotImplementedError
@@ -103,7 +135,36 @@ class BaseLaplace:
         raise NotImplementedError
 
     def log_marginal_likelihood(self, prior_precision=None, sigma_noise=None):
-        raise NotImplementedError
+        """Compute the Laplace approximation to the log marginal likelihood subject
+        to specific Hessian approximations that subclasses implement.
+        Requires that the Laplace approximation has been fit before.
+        The resulting torch.Tensor is differentiable in `prior_precision` and
+        `sigma_noise` if these have gradients enabled.
+        By passing `prior_precision` or `sigma_noise`, the current value is
+        overwritten. This is useful for iterating on the log marginal likelihood.
+
+        Parameters
+        ----------
+        prior_precision : torch.Tensor, optional
+            prior precision if should be changed from current `prior_precision` value
+        sigma_noise : [type], optional
+            observation noise standard deviation if should be changed
+
+        Returns
+        -------
+        log_marglik : torch.Tensor
+        """
+        # update prior precision (useful when iterating on marglik)
+        if prior_precision is not None:
+            self.prior_precision = prior_precision
+
+        # update sigma_noise (useful when iterating on marglik)
+        if sigma_noise is not None:
+            if self.likelihood != 'regression':
+                raise ValueError('Can only change sigma_noise for regression.')
+            self.sigma_noise = sigma_noise
+
+        return self.log_likelihood - 0.5 * (self.log_det_ratio + self.scatter)
 
     @property
     def log_likelihood(self):
@@ -125,7 +186,204 @@ class BaseLaplace:
             # for classification Xent == log Cat
             return factor * self.loss
 
-    def __call__(self, x, pred_type, link_approx, n_samples):
+    @property
+    def scatter(self):
+        """Computes the _scatter_, a term of the log marginal likelihood that
+        corresponds to L-2 regularization:
+        `scatter` = \\((\\theta_{MAP} - \\mu_0)^{T} P_0 (\\theta_{MAP} - \\mu_0) \\).
+
+        Returns
+        -------
+        [type]
+            [description]
+        """
+        delta = (self.mean - self.prior_mean).to(self.prior_precision_diag.dtype)
+        # print('delta shape', delta.shape, self.prior_precision_diag.shape)
+        # print('delta dtype', delta.dtype, self.prior_precision_diag.dtype)
+        return (delta * self.prior_precision_diag) @ delta
+
+    @property
+    def log_det_ratio(self):
+        raise NotImplementedError
+
+    def __call__(self, batch, pred_type='glm', link_approx='probit', n_samples=100, 
+                 diagonal_output=False, generator=None, chunk_size=None):
+        """Compute the posterior predictive on input data `x`.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            `(batch_size, input_shape)`
+
+        pred_type : {'glm', 'glm_jvp', 'nn'}, default='glm'
+            type of posterior predictive, linearized GLM predictive or neural
+            network sampling predictive. The GLM predictive is consistent with
+            the curvature approximations used here. `'glm_jvp'` samples the
+            linearized GLM predictive with Jacobian-vector products instead of
+            the Jacobians, see `predictive_samples`.
+
+        link_approx : {'mc', 'probit', 'bridge', 'bridge_norm'}
+            how to approximate the classification link function for the `'glm'`.
+            For `pred_type='nn'` and `pred_type='glm_jvp'`, only 'mc' is possible. 
+
+        n_samples : int
+            number of samples for `link_approx='mc'`.
+
+        diagonal_output : bool
+            whether to use a diagonalized posterior predictive on the outputs.
+            Only works for `pred_type='glm'` and `link_approx='mc'`.
+
+        generator : torch.Generator, optional
+            random number generator to control the samples (if sampling used)
+
+        chunk_size : int, default=None
+            number of samples of `pred_type='glm_jvp'` or `pred_type='nn'` that are
+            computed at once; if None, `predictive_chunk_size` samples when the full
+            model is evaluated per sample and all samples for last-layer Laplace
+
+        Returns
+        -------
+        predictive: torch.Tensor or Tuple[torch.Tensor]
+            For `likelihood='classification'`, a torch.Tensor is returned with
+            a distribution over classes (similar to a Softmax).
+            For `likelihood='regression'`, a tuple of torch.Tensor is returned
+            with the mean and the predictive variance.
+        """
+        f_mu = self.model(**batch)
+
+        setattr(self.model, 'output_size', self.n_outputs)
+
+        if pred_type not in ['glm', 'glm_jvp', 'nn']:
+            raise ValueError('Only glm, glm_jvp, and nn supported as prediction types.')
+
+        if link_approx not in ['mc', 'probit', 'bridge', 'bridge_norm']:
+            raise ValueError(f'Unsupported link approximation {link_approx}.')
+
+        if pred_type in ['glm_jvp', 'nn'] and link_approx != 'mc':
+            raise ValueError(f'Only mc link approximation is supported for {pred_type} prediction type.')
+        
+        if generator is not None:
+            if not isinstance(generator, torch.Generator) or generator.device != batch['labels'].device:
+                raise ValueError('Invalid random generator (check type and device).')
+
+        if pred_type == 'glm':
+            f_mu, f_var = self._glm_predictive_distribution(batch)
+            # regression
+            if self.likelihood == 'regression':
+                return f_mu, f_var
+            # classification
+            if link_approx == 'mc':
+                return self.predictive_samples(batch, pred_type='glm', n_samples=n_samples, 
+                                               diagonal_output=diagonal_output).mean(dim=0)
+            elif link_approx == 'probit':
+                kappa = 1 / torch.sqrt(1. + np.pi / 8 * f_var.diagonal(dim1=1, dim2=2))
+                # print(torch.sqrt(f_var.diagonal(dim1=1, dim2=2)))
+                return torch.softmax(kappa * f_mu, dim=-1)
+                # return torch.softmax(f_mu, dim=-1)
+            elif 'bridge' in link_approx:
+                # zero mean correction
+                f_mu -= (f_var.sum(-1) * f_mu.sum(-1).reshape(-1, 1) /
+                         f_var.sum(dim=(1, 2)).reshape(-1, 1))
+                f_var -= (torch.einsum('bi,bj->bij', f_var.sum(-1), f_var.sum(-2)) /
+                          f_var.sum(dim=(1, 2)).reshape(-1, 1, 1))
+                # Laplace Bridge
+                _, K = f_mu.size(0), f_mu.size(-1)
+                f_var_diag = torch.diagonal(f_var, dim1=1, dim2=2)
+                # optional: variance correction
+                if link_approx == 'bridge_norm':
+                    f_var_diag_mean = f_var_diag.mean(dim=1)
+                    f_var_diag_mean /= torch.as_tensor([K/2], device=self._device).sqrt()
+                    f_mu /= f_var_diag_mean.sqrt().unsqueeze(-1)
+                    f_var_diag /= f_var_diag_mean.unsqueeze(-1)
+                sum_exp = torch.exp(-f_mu).sum(dim=1).unsqueeze(-1)
+                alpha = (1 - 2/K + f_mu.exp() / K**2 * sum_exp) / f_var_diag
+                return torch.nan_to_num(alpha / alpha.sum(dim=1).unsqueeze(-1), nan=1.0)
+        else:
+            samples = self.predictive_samples(batch, pred_type=pred_type, n_samples=n_samples,
+                                              chunk_size=chunk_size)
+            if self.likelihood == 'regression':
+                return samples.mean(dim=0), samples.var(dim=0)
+            return samples.mean(dim=0)
+
+    def predictive_samples(self, x, pred_type='glm', n_samples=100, 
+                           diagonal_output=False, generator=None, chunk_size=None):
+        """Sample from the posterior predictive on input data `x`.
+        Can be used, for example, for Thompson sampling.
+
+        For `pred_type='glm_jvp'`, parameter samples
+        \\(\\theta \\sim \\mathcal{N}(\\theta_{MAP}, P^{-1})\\) from `sample` are pushed
+        through the linearized model as
+        \\(f(x;\\theta_{MAP}) + \\mathcal{J}(\\theta - \\theta_{MAP})\\)
+        with forward-mode Jacobian-vector products, vectorized over the samples.
+        This has the same distribution as `pred_type='glm'`, but neither the Jacobians
+        nor the output covariance are formed, which takes one backward pass per
+        output otherwise. The memory is that of `chunk_size` samples of the parameters
+        and activations, independent of the number of outputs.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            input data `(batch_size, input_shape)`
+
+        pred_type : {'glm', 'glm_jvp', 'nn'}, default='glm'
+            type of posterior predictive, linearized GLM predictive or neural
+            network sampling predictive. The GLM predictive is consistent with
+            the curvature approximations used here. For `pred_type='nn'`, the
+            samples of models whose posterior is over `torch.nn.Linear` modules
+            only, such as LoRA adapters, are evaluated in one forward pass per chunk
+            with `laplace.utils.SampledLinears`.
+
+        n_samples : int
+            number of samples
+
+        diagonal_output : bool
+            whether to use a diagonalized glm posterior predictive on the outputs.
+            Only applies when `pred_type='glm'`.
+
+        generator : torch.Generator, optional
+            random number generator to control the samples (if sampling used)
+
+        chunk_size : int, default=None
+            number of samples of `pred_type='glm_jvp'` or `pred_type='nn'` that are
+            computed at once; if None, `predictive_chunk_size` samples when the full
+            model is evaluated per sample and all samples for last-layer Laplace
+
+        Returns
+        -------
+        samples : torch.Tensor
+            samples `(n_samples, batch_size, output_shape)`
+        """
+        if pred_type not in ['glm', 'glm_jvp', 'nn']:
+            raise ValueError('Only glm, glm_jvp, and nn supported as prediction types.')
+
+        if pred_type == 'glm':
+            f_mu, f_var = self._glm_predictive_distribution(x)
+            print('f_mu shape', f_mu.shape)
+            print('f_var shape', f_var.shape)
+            assert f_var.shape == torch.Size([f_mu.shape[0], f_mu.shape[1], f_mu.shape[1]])
+            if diagonal_output:
+                f_var = torch.diagonal(f_var, dim1=1, dim2=2)
+            f_samples = normal_samples(f_mu, f_var, n_samples, generator)
+            if self.likelihood == 'regression':
+                return f_samples
+            return torch.softmax(f_samples, dim=-1)
+
+        elif pred_type == 'glm_jvp':
+            f_samples = self._jvp_predictive_samples(x, n_samples, chunk_size)
+            if self.likelihood == 'regression':
+                return f_samples
+            return torch.softmax(f_samples, dim=-1)
+
+        else:  # 'nn'
+            return self._nn_predictive_samples(x, n_samples, chunk_size)
+
+    def _glm_predictive_distribution(self, batch):
+        raise NotImplementedError
+
+    def _jvp_predictive_samples(self, batch, n_samples=100, chunk_size=None):
+        raise NotImplementedError
+
+    def _nn_predictive_samples(self, batch, n_samples=100, chunk_size=None):
         raise NotImplementedError
 
     def predictive(self, x, pred_type, link_approx, n_samples):
@@ -155,22 +413,32 @@ class BaseLaplace:
         elif len(self.prior_precision) == self.n_params:  # diagonal
             return self.prior_precision
 
-        elif len(self.prior_precision) == self.n_layers:  # per layer
-            n_params_per_layer = parameters_per_layer(self.model)
-            return torch.cat([prior * torch.ones(n_params, device=self._device) for prior, n_params
-                              in zip(self.prior_precision, n_params_per_layer)])
-        elif len(self.prior_precision) > 1 and len(self.prior_precision) < self.n_layers:
-            n_params_per_layer = parameters_per_layer(self.model)
-            num_last = len(self.prior_precision) - 1
-            prior_prec_diag = []
-            for n_params in n_params_per_layer[:-num_last]:
-                prior_prec_diag.append(self.prior_precision[0] * torch.ones(n_params, device=self._device))
-            for prior, n_params in zip(self.prior_precision[-num_last:], n_params_per_layer[-num_last:]):
-                prior_prec_diag.append(prior * torch.ones(n_params, device=self._device))
-            return torch.cat(prior_prec_diag)
+        elif 1 < len(self.prior_precision) <= self.n_layers:  # per layer
+            n_params_per_layer = torch.tensor(parameters_per_layer(self.model), device=self._device)
+            return self._layer_prior_precision().repeat_interleave(n_params_per_layer)
         else:
             raise ValueError('Mismatch of prior and model. Diagonal, scalar, or per-layer prior.')
 
+    def _layer_prior_precision(self):
+        """Prior precision per layer `(n_layers)` from a scalar or per-layer prior precision,
+        or from a shorter one whose first value is shared by all but the last
+        `len(prior_precision) - 1` layers.
+
+        Returns
+        -------
+        prior_precision : torch.Tensor
+        """
+        prior_precision = self.prior_precision
+        if len(prior_precision) == 1:
+            return prior_precision.expand(self.n_layers)
+        elif len(prior_precision) == self.n_layers:
+            return prior_precision
+        elif len(prior_precision) < self.n_layers:
+            num_last = len(prior_precision) - 1
+            return torch.cat([prior_precision[:1].expand(self.n_layers - num_last), prior_precision[1:]])
+        else:
+            raise ValueError('Mismatch of prior and model. Scalar or per-layer prior.')
+
     @property
     def prior_mean(self):
         return self._prior_mean
@@ -215,20 +483,27 @@ class BaseLaplace:
 
     def optimize_prior_precision_base(self, pred_type, method='marglik', n_steps=100, lr=1e-1,
                                       init_prior_prec=1., val_loader=None, loss=get_nll,
-                                      link_approx='probit', n_samples=100, verbose=False):
+                                      link_approx='probit', n_samples=100, verbose=False,
+                                      store_dir=None, store_dtype=torch.float32,
+                                      mc_samples=100000, mc_sampling='normal'):
         """Optimize the prior precision post-hoc using the `method`
         specified by the user.
 
         Parameters
         ----------
-        pred_type : {'glm', 'nn', 'gp'}, default='glm'
+        pred_type : {'glm', 'glm_jvp', 'nn', 'gp'}, default='glm'
             type of posterior predictive, linearized GLM predictive or neural
             network sampling predictive or Gaussian Process (GP) inference.
             The GLM predictive is consistent with the curvature approximations used here.
-        method : {'marglik', 'CV'}, default='marglik'
+            `'glm_jvp'` samples the GLM predictive with Jacobian-vector products.
+        method : {'marglik', 'mackay', 'val_gd'}, default='marglik'
             specifies how the prior precision should be optimized.
+            `'mackay'` maximizes the marginal likelihood for scalar or per-layer priors with
+            MacKay's fixed-point updates on precomputed Hessian eigenvalues and falls back
+            to `'marglik'` if these are not available.
         n_steps : int, default=100
-            the number of gradient descent steps to take.
+            the number of gradient descent steps to take or the maximum number of
+            fixed-point iterations for `'mackay'`.
         lr : float, default=1e-1
             the learning rate to use for gradient descent.
         init_prior_prec : float, default=1.0
@@ -239,12 +514,22 @@ class BaseLaplace:
             loss function to use for CV.
         link_approx : {'mc', 'probit', 'bridge'}, default='probit'
             how to approximate the classification link function for the `'glm'`.
-            For `pred_type='nn'`, only `'mc'` is possible.
+            For `pred_type='nn'` and `pred_type='glm_jvp'`, only `'mc'` is possible.
         n_samples : int, default=100
             number of samples for `link_approx='mc'`.
         verbose : bool, default=False
             if true, the optimized prior precision will be printed
             (can be a large tensor if the prior has a diagonal covariance).
+        store_dir : str, default=None
+            directory for the on-disk store of validation Jacobians used by `'val_gd'`;
+            a temporary directory if `None`.
+        store_dtype : torch.dtype, default=torch.float32
+            storage type of the validation Jacobians, `torch.float32` or `torch.float16`.
+        mc_samples : int, default=100000
+            number of samples of the Monte Carlo softmax predictive used by `'val_gd'`.
+        mc_sampling : {'normal', 'antithetic', 'qmc'}, default='normal'
+            sampling scheme of the Monte Carlo softmax predictive used by `'val_gd'`,
+            see `laplace.utils.mc_softmax_predictive`.
         """
 
         if method == 'marglik':
@@ -265,65 +550,117 @@ class BaseLaplace:
             torch.cuda.empty_cache()
 
 
+        elif method == 'mackay':
+            self._optimize_prior_precision_mackay(n_steps)
+            if verbose:
+                print(f'Optimized prior precision is {self.prior_precision}.')
+
         elif method == 'val_gd':
             # batched gradient descent optimizing prior precision to maximize validation log-likelihood
             if val_loader is None:
                 raise ValueError('val_gd requires a validation set DataLoader')
-            def divide_into_batches(data, batch_size):
-                return [data[i:i + batch_size] for i in range(0, len(data), batch_size)]
-
-            data_list = []
-            for batch in tqdm(val_loader):
-                try:
-                    batch.to(self._device)
-                except:
-                    batch = {k: v.to(self._device) for k, v in batch.items()}
-                Js, f_mu = self.backend.jacobians(batch)
-                for j, f, t in zip(Js, f_mu, batch['labels']):
-                    data_list.append((j.detach().cpu(), f.detach().cpu(), t))
-
-            batch_size = val_loader.batch_size
-            if batch_size is None:
-                batch_size = 32
-
-            log_prior_prec = self.prior_precision.log()
-            log_prior_prec.requires_grad = True
-            optimizer = torch.optim.Adam([log_prior_prec], lr=lr)
 
-            samples = 100000
-            grad_step = 0
-            while grad_step <= n_steps:
-                nll_total = 0
-                random.shuffle(data_list)
-                shuffled_batches = divide_into_batches(data_list, batch_size)
-
-                for batch in shuffled_batches:
-                    Js, f_mu, target = zip(*batch)
-                    Js = torch.stack(Js).to(self._device)
-                    f_mu = torch.stack(f_mu).to(self._device)
-                    target = torch.tensor(target).to(self._device)
-                    
-                    optimizer.zero_grad()
-                    self.prior_precision = log_prior_prec.exp()
-
-                    f_var = self.functional_variance(Js.to(self._device))
-                    f_mu = f_mu.expand(samples, -1, -1).to(self._device)
-                    f_var = f_var.expand(samples, -1, -1, -1)
-                    eps = torch.randn_like(f_mu).unsqueeze(-1).to(f_mu.dtype).to(self._device)
-                    probs = torch.softmax(f_mu + (torch.linalg.cholesky(f_var + torch.eye(f_var.shape[-1]).to(f_var.device)*1e-6).to(f_mu.dtype) @ eps).squeeze(-1), dim=-1).mean(0)
-                    nll = -torch.log(probs[torch.arange(probs.shape[0]), target]).sum()
-                    nll.backward()
-                    optimizer.step()
-                    nll_total += nll.detach().item()
-                    grad_step += 1
-                    if grad_step > n_steps:
-                        break
-                print(nll_total, log_prior_prec.exp().detach())
-
-            self.prior_precision = log_prior_prec.detach().clone().exp()
-            del data_list, shuffled_batches
+            store = JacobianStore(path=store_dir, dtype=store_dtype)
+            try:
+                for batch in tqdm(val_loader):
+                    try:
+                        batch.to(self._device)
+                    except:
+                        batch = {k: v.to(self._device) for k, v in batch.items()}
+                    Js, f_mu = self.backend.jacobians(batch)
+                    # precompute statistics once so that each step avoids the parameter dimension
+                    store.append(self._functional_variance_stats(Js), f_mu, batch['labels'])
+                    del Js, f_mu
+
+                batch_size = val_loader.batch_size
+                if batch_size is None:
+                    batch_size = 32
+
+                log_prior_prec = self.prior_precision.log()
+                log_prior_prec.requires_grad = True
+                optimizer = torch.optim.Adam([log_prior_prec], lr=lr)
+
+                grad_step = 0
+                while grad_step <= n_steps:
+                    nll_total = 0
+                    for stats, f_mu, target in store.batches(batch_size, shuffle=True, device=self._device):
+                        optimizer.zero_grad()
+                        self.prior_precision = log_prior_prec.exp()
+
+                        f_var = self._functional_variance_from_stats(stats)
+                        probs = mc_softmax_predictive(f_mu, f_var, n_samples=mc_samples, sampling=mc_sampling)
+                        nll = -torch.log(probs[torch.arange(probs.shape[0]), target]).sum()
+                        nll.backward()
+                        optimizer.step()
+                        nll_total += nll.detach().item()
+                        grad_step += 1
+                        if grad_step > n_steps:
+                            break
+                    print(nll_total, log_prior_prec.exp().detach())
+
+                self.prior_precision = log_prior_prec.detach().clone().exp()
+            finally:
+                store.close()
         
         
+    def _prior_eigenvalues(self):
+        """Eigenvalues of the scaled log likelihood Hessian `H * _H_factor`, one tensor
+        per group of parameters sharing a prior precision, in the order of the parameters,
+        or a tuple `(eigenvalues, multiplicities)` for repeated eigenvalues.
+        `None` if not available in closed form.
+        """
+        return None
+
+    def _optimize_prior_precision_mackay(self, n_steps=100, tol=1e-6):
+        """Maximize the marginal likelihood w.r.t. a scalar or per-layer prior precision
+        using MacKay's fixed-point updates
+        \\(\\delta_l \\leftarrow \\gamma_l / \\|\\theta_l - \\mu_0\\|^2\\) with the effective
+        number of parameters \\(\\gamma_l = \\sum_i \\lambda_i / (\\lambda_i + \\delta_l)\\).
+
+        Parameters
+        ----------
+        n_steps : int, default=100
+            maximum number of iterations
+        tol : float, default=1e-6
+            relative tolerance on the prior precision for convergence
+        """
+        eigenvalues = self._prior_eigenvalues()
+        if eigenvalues is None or len(self.prior_precision) not in [1, len(eigenvalues)]:
+            logging.info('Closed-form prior optimization not available, falling back to marglik.')
+            self.optimize_prior_precision_base(pred_type='glm', method='marglik', n_steps=n_steps)
+            return
+
+        with torch.no_grad():
+            eigenvalues = [l if isinstance(l, tuple) else (l, torch.ones_like(l)) for l in eigenvalues]
+            lambdas = torch.cat([l for l, _ in eigenvalues])
+            multiplicities = torch.cat([m for _, m in eigenvalues]).to(lambdas.dtype)
+            arange = torch.arange(len(eigenvalues), device=lambdas.device)
+            groups = torch.repeat_interleave(
+                arange, torch.tensor([len(l) for l, _ in eigenvalues], device=lambdas.device))
+            param_groups = torch.repeat_interleave(
+                arange, torch.tensor([int(m.sum()) for _, m in eigenvalues], device=lambdas.device))
+            delta = (self.mean - self.prior_mean).to(lambdas.dtype)
+            sq_norms = torch.zeros(len(eigenvalues), device=lambdas.device, dtype=lambdas.dtype)
+            sq_norms = sq_norms.index_add_(0, param_groups, delta.square())
+            sq_norms = sq_norms.clamp(min=torch.finfo(lambdas.dtype).eps)
+            prior_prec = self.prior_precision.detach().clone().to(lambdas.dtype)
+            scalar = len(prior_prec) == 1
+            for _ in range(n_steps):
+                deltas = prior_prec if scalar else prior_prec[groups]
+                gammas = torch.zeros_like(sq_norms).index_add_(
+                    0, groups, multiplicities * lambdas / (lambdas + deltas))
+                if scalar:
+                    prior_prec_new = (gammas.sum() / sq_norms.sum()).reshape(1)
+                else:
+                    prior_prec_new = gammas / sq_norms
+                # keep the prior proper if the Hessian vanishes for some group
+                prior_prec_new = prior_prec_new.clamp(min=torch.finfo(lambdas.dtype).eps)
+                converged = ((prior_prec_new - prior_prec).abs() <= tol * prior_prec).all()
+                prior_prec = prior_prec_new
+                if converged:
+                    break
+        self.prior_precision = prior_prec
+
     @property
     def sigma_noise(self):
         return self._sigma_noise
@@ -350,6 +687,19 @@ class BaseLaplace:
         sigma2 = self.sigma_noise.square()
         return 1 / sigma2 / self.temperature
 
+    @staticmethod
+    def _cache_state(obj):
+        """State of `obj` on which a cached quantity depends: tensors, also within tuples
+        and lists, by identity and version, which in-place operations increment, and
+        other values by value. The cache needs to keep a reference to `obj` so that the
+        identities are not reused.
+        """
+        if torch.is_tensor(obj):
+            return id(obj), obj._version
+        if isinstance(obj, (tuple, list)):
+            return tuple(BaseLaplace._cache_state(o) for o in obj)
+        return obj
+
 
 class ParametricLaplace(BaseLaplace):
     """
@@ -374,6 +724,8 @@ class ParametricLaplace(BaseLaplace):
     In particular, we assume a scalar, layer-wise, or diagonal prior precision so that in
     all cases \\(P_0 = \\textrm{diag}(p_0)\\) and the structure of \\(p_0\\) can be varied.
     """
+    # number of samples evaluated at once by the sampled predictives of the full model
+    predictive_chunk_size = 8
 
     def __init__(self, model, likelihood, sigma_noise=1., prior_precision=None,
                  prior_mean=0., temperature=1., backend=None, backend_kwargs=None):
@@ -387,28 +739,47 @@ class ParametricLaplace(BaseLaplace):
 
     def _init_H(self):
         raise NotImplementedError
+
+    def _reduce_H(self):
+        """Sum the Hessian approximation across processes in the distributed setting."""
+        all_reduce_tensors([self.H])
     
     def _check_H_init(self):
         if self.H is None:
             raise AttributeError('Laplace not fitted. Run fit() first.')
 
-    def fit(self, train_loader, override=True):
+    def fit(self, train_loader, override=True, shard=True):
         """Fit the local Laplace approximation at the parameters of the model.
+        If a `torch.distributed` process group is initialized, every process accumulates
+        the curvature of its share of the batches and the results are summed across
+        processes before they are used.
 
         Parameters
         ----------
         train_loader : torch.data.utils.DataLoader
             each iterate is a training batch (X, y);
-            `train_loader.dataset` needs to be set to access \\(N\\), size of the data set
+            `train_loader.dataset` needs to be set to access \\(N\\), size of the entire
+            data set across all processes
         override : bool, default=True
             whether to initialize H, loss, and n_data again; setting to False is useful for
             online learning settings to accumulate a sequential posterior approximation.
+        shard : bool, default=True
+            in the distributed setting, process every `world_size`-th batch on each process;
+            ignored if `train_loader` already yields different batches per process, i.e.,
+            it samples with a `DistributedSampler` or was prepared by `accelerate`.
         """
         if override:
             self._init_H()
             self.loss = 0
             self.n_data = 0
 
+        distributed = is_distributed()
+        if distributed and not override:
+            # only the contributions of this fit are reduced across processes
+            H_prev, loss_prev = self.H, self.loss
+            self._init_H()
+            self.loss = 0
+
         self.model.eval()
         # self.mean = parameters_to_vector(self.model.parameters()).detach()
         mean = []
@@ -421,7 +792,9 @@ class ParametricLaplace(BaseLaplace):
         
         print('parameters shape', self.mean.shape)
 
-        batch = next(iter(train_loader))
+        # keep the iterator alive while its batch is used, e.g. for cached features
+        first_batches = iter(train_loader)
+        batch = next(first_batches)
         try:
             batch = batch.to(self._device)
         except:
@@ -439,13 +812,12 @@ class ParametricLaplace(BaseLaplace):
 
         N = len(train_loader.dataset)
 
-        for batch in tqdm(train_loader):
+        for batch in tqdm(local_batches(train_loader, shard)):
             try:
                 batch.to(self._device)
             except:
                 batch = {k: v.to(self._device) for k, v in batch.items()}
 
-            self._backend = None
             self.model.zero_grad()
 
             loss_batch, H_batch,f = self._curv_closure(batch, N)
@@ -454,27 +826,20 @@ class ParametricLaplace(BaseLaplace):
 
             del loss_batch, H_batch
 
+        if distributed:
+            if not torch.is_tensor(self.loss):  # no batches on this process
+                self.loss = torch.tensor(float(self.loss), device=self._device)
+            all_reduce_tensors([self.loss])
+            self._reduce_H()
+            if not override:
+                self.H = H_prev + self.H
+                self.loss = loss_prev + self.loss
+
         self.n_data += N
 
         print('H len', self.H.__len__())
 
 
-    @property
-    def scatter(self):
-        """Computes the _scatter_, a term of the log marginal likelihood that
-        corresponds to L-2 regularization:
-        `scatter` = \\((\\theta_{MAP} - \\mu_0)^{T} P_0 (\\theta_{MAP} - \\mu_0) \\).
-
-        Returns
-        -------
-        [type]
-            [description]
-        """
-        delta = (self.mean - self.prior_mean).to(self.prior_precision_diag.dtype)
-        # print('delta shape', delta.shape, self.prior_precision_diag.shape)
-        # print('delta dtype', delta.dtype, self.prior_precision_diag.dtype)
-        return (delta * self.prior_precision_diag) @ delta
-
     @property
     def log_det_prior_precision(self):
         """Compute log determinant of the prior precision
@@ -541,177 +906,6 @@ class ParametricLaplace(BaseLaplace):
         log_prob -= self.square_norm(value) / 2
         return log_prob
 
-    def log_marginal_likelihood(self, prior_precision=None, sigma_noise=None):
-        """Compute the Laplace approximation to the log marginal likelihood subject
-        to specific Hessian approximations that subclasses implement.
-        Requires that the Laplace approximation has been fit before.
-        The resulting torch.Tensor is differentiable in `prior_precision` and
-        `sigma_noise` if these have gradients enabled.
-        By passing `prior_precision` or `sigma_noise`, the current value is
-        overwritten. This is useful for iterating on the log marginal likelihood.
-
-        Parameters
-        ----------
-        prior_precision : torch.Tensor, optional
-            prior precision if should be changed from current `prior_precision` value
-        sigma_noise : [type], optional
-            observation noise standard deviation if should be changed
-
-        Returns
-        -------
-        log_marglik : torch.Tensor
-        """
-        # update prior precision (useful when iterating on marglik)
-        if prior_precision is not None:
-            self.prior_precision = prior_precision
-
-        # update sigma_noise (useful when iterating on marglik)
-        if sigma_noise is not None:
-            if self.likelihood != 'regression':
-                raise ValueError('Can only change sigma_noise for regression.')
-            self.sigma_noise = sigma_noise
-
-        return self.log_likelihood - 0.5 * (self.log_det_ratio + self.scatter)
-
-    def __call__(self, batch, pred_type='glm', link_approx='probit', n_samples=100, 
-                 diagonal_output=False, generator=None):
-        """Compute the posterior predictive on input data `x`.
-
-        Parameters
-        ----------
-        x : torch.Tensor
-            `(batch_size, input_shape)`
-
-        pred_type : {'glm', 'nn'}, default='glm'
-            type of posterior predictive, linearized GLM predictive or neural
-            network sampling predictive. The GLM predictive is consistent with
-            the curvature approximations used here.
-
-        link_approx : {'mc', 'probit', 'bridge', 'bridge_norm'}
-            how to approximate the classification link function for the `'glm'`.
-            For `pred_type='nn'`, only 'mc' is possible. 
-
-        n_samples : int
-            number of samples for `link_approx='mc'`.
-
-        diagonal_output : bool
-            whether to use a diagonalized posterior predictive on the outputs.
-            Only works for `pred_type='glm'` and `link_approx='mc'`.
-
-        generator : torch.Generator, optional
-            random number generator to control the samples (if sampling used)
-
-        Returns
-        -------
-        predictive: torch.Tensor or Tuple[torch.Tensor]
-            For `likelihood='classification'`, a torch.Tensor is returned with
-            a distribution over classes (similar to a Softmax).
-            For `likelihood='regression'`, a tuple of torch.Tensor is returned
-            with the mean and the predictive variance.
-        """
-        f_mu = self.model(**batch)
-
-        setattr(self.model, 'output_size', self.n_outputs)
-
-        if pred_type not in ['glm', 'nn']:
-            raise ValueError('Only glm and nn supported as prediction types.')
-
-        if link_approx not in ['mc', 'probit', 'bridge', 'bridge_norm']:
-            raise ValueError(f'Unsupported link approximation {link_approx}.')
-
-        if pred_type == 'nn' and link_approx != 'mc':
-            raise ValueError('Only mc link approximation is supported for nn prediction type.')
-        
-        if generator is not None:
-            if not isinstance(generator, torch.Generator) or generator.device != batch['labels'].device:
-                raise ValueError('Invalid random generator (check type and device).')
-
-        if pred_type == 'glm':
-            f_mu, f_var = self._glm_predictive_distribution(batch)
-            # regression
-            if self.likelihood == 'regression':
-                return f_mu, f_var
-            # classification
-            if link_approx == 'mc':
-                return self.predictive_samples(batch, pred_type='glm', n_samples=n_samples, 
-                                               diagonal_output=diagonal_output).mean(dim=0)
-            elif link_approx == 'probit':
-                kappa = 1 / torch.sqrt(1. + np.pi / 8 * f_var.diagonal(dim1=1, dim2=2))
-                # print(torch.sqrt(f_var.diagonal(dim1=1, dim2=2)))
-                return torch.softmax(kappa * f_mu, dim=-1)
-                # return torch.softmax(f_mu, dim=-1)
-            elif 'bridge' in link_approx:
-                # zero mean correction
-                f_mu -= (f_var.sum(-1) * f_mu.sum(-1).reshape(-1, 1) /
-                         f_var.sum(dim=(1, 2)).reshape(-1, 1))
-                f_var -= (torch.einsum('bi,bj->bij', f_var.sum(-1), f_var.sum(-2)) /
-                          f_var.sum(dim=(1, 2)).reshape(-1, 1, 1))
-                # Laplace Bridge
-                _, K = f_mu.size(0), f_mu.size(-1)
-                f_var_diag = torch.diagonal(f_var, dim1=1, dim2=2)
-                # optional: variance correction
-                if link_approx == 'bridge_norm':
-                    f_var_diag_mean = f_var_diag.mean(dim=1)
-                    f_var_diag_mean /= torch.as_tensor([K/2], device=self._device).sqrt()
-                    f_mu /= f_var_diag_mean.sqrt().unsqueeze(-1)
-                    f_var_diag /= f_var_diag_mean.unsqueeze(-1)
-                sum_exp = torch.exp(-f_mu).sum(dim=1).unsqueeze(-1)
-                alpha = (1 - 2/K + f_mu.exp() / K**2 * sum_exp) / f_var_diag
-                return torch.nan_to_num(alpha / alpha.sum(dim=1).unsqueeze(-1), nan=1.0)
-        else:
-            samples = self._nn_predictive_samples(x, n_samples)
-            if self.likelihood == 'regression':
-                return samples.mean(dim=0), samples.var(dim=0)
-            return samples.mean(dim=0)
-
-    def predictive_samples(self, x, pred_type='glm', n_samples=100, 
-                           diagonal_output=False, generator=None):
-        """Sample from the posterior predictive on input data `x`.
-        Can be used, for example, for Thompson sampling.
-
-        Parameters
-        ----------
-        x : torch.Tensor
-            input data `(batch_size, input_shape)`
-
-        pred_type : {'glm', 'nn'}, default='glm'
-            type of posterior predictive, linearized GLM predictive or neural
-            network sampling predictive. The GLM predictive is consistent with
-            the curvature approximations used here.
-
-        n_samples : int
-            number of samples
-
-        diagonal_output : bool
-            whether to use a diagonalized glm posterior predictive on the outputs.
-            Only applies when `pred_type='glm'`.
-
-        generator : torch.Generator, optional
-            random number generator to control the samples (if sampling used)
-
-        Returns
-        -------
-        samples : torch.Tensor
-            samples `(n_samples, batch_size, output_shape)`
-        """
-        if pred_type not in ['glm', 'nn']:
-            raise ValueError('Only glm and nn supported as prediction types.')
-
-        if pred_type == 'glm':
-            f_mu, f_var = self._glm_predictive_distribution(x)
-            print('f_mu shape', f_mu.shape)
-            print('f_var shape', f_var.shape)
-            assert f_var.shape == torch.Size([f_mu.shape[0], f_mu.shape[1], f_mu.shape[1]])
-            if diagonal_output:
-                f_var = torch.diagonal(f_var, dim1=1, dim2=2)
-            f_samples = normal_samples(f_mu, f_var, n_samples, generator)
-            if self.likelihood == 'regression':
-                return f_samples
-            return torch.softmax(f_samples, dim=-1)
-
-        else:  # 'nn'
-            return self._nn_predictive_samples(x, n_samples)
-
     @torch.enable_grad()
     def _glm_predictive_distribution(self, batch):
         Js, f_mu = self.backend.jacobians(batch)
@@ -722,13 +916,67 @@ class ParametricLaplace(BaseLaplace):
         #print('f_var shape', f_var.shape)
         return f_mu.detach(), f_var.detach()
 
-    def _nn_predictive_samples(self, X, n_samples=100):
+    def _posterior_parameters(self):
+        # the parameters of the posterior in the order of `self.mean`
+        params = {name: p for name, p in self.model.named_parameters()
+                  if p.requires_grad and 'modules_to_save' not in name}
+        if sum(p.numel() for p in params.values()) != self.n_params:
+            raise ValueError('The parameters of the model do not match the posterior.')
+        return params
+
+    def _jvp_predictive_samples(self, batch, n_samples=100, chunk_size=None):
+        params = self._posterior_parameters()
+        chunk_size = self.predictive_chunk_size if chunk_size is None else chunk_size
+        return self._linearized_samples(self.model, params, (), batch, n_samples, chunk_size).detach()
+
+    def _linearized_samples(self, module, params, args, kwargs, n_samples, chunk_size):
+        # f(x; theta_MAP) + J (theta - theta_MAP) for samples theta of the posterior,
+        # where J (theta - theta_MAP) is a Jacobian-vector product of `module`
+        names = list(params)
+        primals = {name: params[name].detach() for name in names}
+        if sum(p.numel() for p in primals.values()) != self.n_params:
+            raise ValueError('The parameters of the model do not match the posterior.')
+
+        def f(params):
+            return torch.func.functional_call(module, params, args, kwargs)
+
+        def jvp(tangents):
+            return torch.func.jvp(f, (primals,), (tangents,))
+
+        chunk_size = n_samples if chunk_size is None else chunk_size
         fs = list()
-        for sample in self.sample(n_samples):
-            vector_to_parameters(sample, self.model.parameters())
-            fs.append(self.model(X.to(self._device)).detach())
-        vector_to_parameters(self.mean, self.model.parameters())
-        fs = torch.stack(fs)
+        for start in range(0, n_samples, chunk_size):
+            deltas = self.sample(min(chunk_size, n_samples - start)) - self.mean
+            deltas = deltas.split([p.numel() for p in primals.values()], dim=1)
+            tangents = {name: delta.reshape(-1, *primals[name].shape).to(primals[name].dtype)
+                        for name, delta in zip(names, deltas)}
+            f_mu, f_delta = torch.func.vmap(jvp, out_dims=(None, 0))(tangents)
+            fs.append(f_mu + f_delta)
+        return torch.cat(fs)
+
+    @torch.no_grad()
+    def _nn_predictive_samples(self, batch, n_samples=100, chunk_size=None):
+        params = self._posterior_parameters()
+        engine = SampledLinears(self.model, params)
+        if engine.supported:
+            # all samples of a chunk in one forward pass
+            chunk_size = self.predictive_chunk_size if chunk_size is None else chunk_size
+            fs = list()
+            for start in range(0, n_samples, chunk_size):
+                deltas = self.sample(min(chunk_size, n_samples - start)) - self.mean
+                fs.append(engine(deltas, **batch))
+            fs = torch.cat(fs)
+        else:
+            # one forward pass per sample with the parameters of the posterior set in place
+            sizes = [p.numel() for p in params.values()]
+            fs = list()
+            for sample in self.sample(n_samples):
+                for p, value in zip(params.values(), sample.split(sizes)):
+                    p.copy_(value.view_as(p))
+                fs.append(self.model(**batch))
+            for p, value in zip(params.values(), self.mean.split(sizes)):
+                p.copy_(value.view_as(p))
+            fs = torch.stack(fs)
         if self.likelihood == 'classification':
             fs = torch.softmax(fs, dim=-1)
         return fs
@@ -755,6 +1003,16 @@ class ParametricLaplace(BaseLaplace):
         """
         raise NotImplementedError
 
+    def _functional_variance_stats(self, Js):
+        """Per-example statistics of the Jacobians `Js` from which the functional
+        variance can be computed repeatedly for changing prior precision, see
+        `_functional_variance_from_stats`. By default, the Jacobians themselves.
+        """
+        return Js
+
+    def _functional_variance_from_stats(self, stats):
+        return self.functional_variance(stats)
+
     def sample(self, n_samples=100):
         """Sample from the Laplace posterior approximation, i.e.,
         \\( \\theta \\sim \\mathcal{N}(\\theta_{MAP}, P^{-1})\\).
@@ -768,14 +1026,95 @@ class ParametricLaplace(BaseLaplace):
 
     def optimize_prior_precision(self, method='marglik', pred_type='glm', n_steps=100, lr=1e-1,
                                  init_prior_prec=1., val_loader=None, loss=get_nll,
-                                 link_approx='probit', n_samples=100, verbose=False):
-        assert pred_type in ['glm', 'nn']
+                                 link_approx='probit', n_samples=100, verbose=False,
+                                 store_dir=None, store_dtype=torch.float32,
+                                 mc_samples=100000, mc_sampling='normal'):
+        assert pred_type in ['glm', 'glm_jvp', 'nn']
         self.optimize_prior_precision_base(pred_type, method, n_steps, lr,
                                            init_prior_prec, val_loader, loss,
                                            link_approx, n_samples,
-                                           verbose)
+                                           verbose, store_dir, store_dtype,
+                                           mc_samples, mc_sampling)
         return self.prior_precision
 
+    def _H_state_dict(self):
+        return {'H': self.H}
+
+    def _load_H_state_dict(self, state_dict):
+        self.H = state_dict['H'].to(self._device)
+
+    def state_dict(self) -> dict:
+        """Flat dictionary of the fitted Laplace approximation: posterior mean, Hessian
+        approximation, loss, number of data points, and prior.
+        Values are tensors or JSON-serializable so that it can be saved with
+        `laplace.utils.save_tensors`.
+
+        Returns
+        -------
+        state_dict : dict
+        """
+        self._check_H_init()
+        state_dict = {
+            'cls_name': self.__class__.__name__,
+            'likelihood': self.likelihood,
+            'mean': self.mean,
+            'loss': torch.as_tensor(self.loss).detach(),
+            'n_data': int(self.n_data),
+            'n_outputs': self.n_outputs,
+            'prior_mean': self.prior_mean,
+            'prior_precision': self.prior_precision,
+            'sigma_noise': self.sigma_noise,
+            'temperature': float(self.temperature),
+        }
+        state_dict.update(self._H_state_dict())
+        return state_dict
+
+    def load_state_dict(self, state_dict: dict):
+        """Restore a Laplace approximation from `state_dict()` without refitting.
+
+        Parameters
+        ----------
+        state_dict : dict
+        """
+        if state_dict['cls_name'] != self.__class__.__name__:
+            raise ValueError(f'Loading {state_dict["cls_name"]} into {self.__class__.__name__}.')
+        if state_dict['likelihood'] != self.likelihood:
+            raise ValueError('Different likelihoods detected!')
+        if len(state_dict['mean']) != self.n_params:
+            raise ValueError('Number of parameters does not match the model.')
+
+        self.mean = state_dict['mean'].to(self._device)
+        self.loss = state_dict['loss'].to(self._device)
+        self.n_data = state_dict['n_data']
+        self.n_outputs = state_dict['n_outputs']
+        setattr(self.model, 'output_size', self.n_outputs)
+        self.prior_mean = state_dict['prior_mean'].to(self._device)
+        self.prior_precision = state_dict['prior_precision'].to(self._device)
+        self.sigma_noise = state_dict['sigma_noise'].to(self._device)
+        self.temperature = state_dict['temperature']
+        self._load_H_state_dict(state_dict)
+
+    def save(self, path):
+        """Save the fitted Laplace approximation to `path`, in the safetensors format
+        if available, see `laplace.utils.save_tensors`.
+
+        Parameters
+        ----------
+        path : str
+        """
+        save_tensors(path, self.state_dict())
+
+    def load(self, path, mmap=True):
+        """Load a Laplace approximation saved with `save`.
+
+        Parameters
+        ----------
+        path : str
+        mmap : bool, default=True
+            memory-map the saved tensors instead of reading them into memory
+        """
+        self.load_state_dict(load_tensors(path, device=self._device, mmap=mmap))
+
     @property
     def posterior_precision(self):
         """Compute or return the posterior precision \\(P\\).
@@ -798,34 +1137,72 @@ class KronLaplace(ParametricLaplace):
     `KronDecomposed` is used to add the prior, a Hessian factor (e.g. temperature),
     and computing posterior covariances, marginal likelihood, etc.
     Damping can be enabled by setting `damping=True`.
+    With `jacobian_free=True`, the `'glm'` predictive computes the functional variance
+    one group of Kronecker factors at a time from module inputs and output gradients
+    instead of building the Jacobians of all parameters.
+    For `'val_gd'` prior optimization, the validation Jacobians are stored and the
+    functional variance is exact. With `n_eigen_groups`, they are instead projected onto
+    the eigenbases once and summarized over `n_eigen_groups` groups of eigenvalues per
+    layer, which needs much less storage but approximates the objective.
+    With `max_rank`, Kronecker factors of larger dimension are truncated to their top
+    eigenpairs and an isotropic remainder, see `Kron.decompose`.
+    The treatment of the token axis of sequence models, `'kfac-expand'` or `'kfac-reduce'`,
+    is set by the `kfac_conv` argument of the backend or per call of `fit`.
     """
     # key to map to correct subclass of BaseLaplace, (subset of weights, Hessian structure)
     _key = ('all', 'kron')
 
     def __init__(self, model, likelihood, sigma_noise=1., prior_precision=None,
                  prior_mean=0., temperature=1., backend=None, damping=False,
-                 **backend_kwargs):
+                 jacobian_free=False, max_rank=None, n_eigen_groups=None, **backend_kwargs):
         self.damping = damping
+        self.jacobian_free = jacobian_free
+        self.max_rank = max_rank
+        self.n_eigen_groups = n_eigen_groups
         print('INIT Kron Laplace')
         self.H_facs = None
+        self._kfac_conv = None
         super().__init__(model, likelihood, sigma_noise, prior_precision,
                          prior_mean, temperature, backend, **backend_kwargs)
 
     def _init_H(self):
         print('======_init_H======')
-        self.H = Kron.init_from_model(self.model, self._device)
+        backend = self.backend
+        if hasattr(backend, 'init_kron'):  # backend with its own layout of factors
+            self.H = backend.init_kron(self._device)
+        else:
+            self.H = Kron.init_from_model(self.model, self._device)
 
     def _curv_closure(self, batch, N):
-        return self.backend.kron(batch, N=N)
+        if self._kfac_conv is None:
+            return self.backend.kron(batch, N=N)
+        return self.backend.kron(batch, N=N, kfac_conv=self._kfac_conv)
+
+    def _reduce_H(self):
+        all_reduce_tensors([T for F, _ in self.H.unique_factors()
+                            for T in (F.tensors() if isinstance(F, SketchedFactor) else [F])])
 
     @staticmethod
     def _rescale_factors(kron, factor):
+        # factors can be shared by several groups
+        rescaled = set()
         for F in kron.kfacs:
-            if len(F) == 2:
+            if len(F) == 2 and id(F[1]) not in rescaled:
+                rescaled.add(id(F[1]))
                 F[1] *= factor
         return kron
 
-    def fit(self, train_loader, override=True):
+    def fit(self, train_loader, override=True, shard=True, kfac_conv=None):
+        """Fit the Kronecker factored Laplace approximation, see `ParametricLaplace.fit`.
+
+        Parameters
+        ----------
+        train_loader : torch.data.utils.DataLoader
+        override : bool, default=True
+        shard : bool, default=True
+        kfac_conv : {'kfac-expand', 'kfac-reduce'}, default=None
+            treatment of the token axis for this fit, the `kfac_conv` of the backend if None
+        """
         if override:
             self.H_facs = None
 
@@ -836,7 +1213,11 @@ class KronLaplace(ParametricLaplace):
             # discount previous Kronecker factors to sum up properly together with new ones
             self.H_facs = self._rescale_factors(self.H_facs, n_data_old / (n_data_old + n_data_new))
 
-        super().fit(train_loader, override=override)
+        self._kfac_conv = kfac_conv
+        try:
+            super().fit(train_loader, override=override, shard=shard)
+        finally:
+            self._kfac_conv = None
 
         if self.H_facs is None:
             self.H_facs = self.H
@@ -845,7 +1226,7 @@ class KronLaplace(ParametricLaplace):
             self.H = self._rescale_factors(self.H, n_data_new / (n_data_new + n_data_old))
             self.H_facs += self.H
         # Decompose to self.H for all required quantities but keep H_facs for further inference
-        self.H = self.H_facs.decompose(damping=self.damping)
+        self.H = self.H_facs.decompose(damping=self.damping, max_rank=self.max_rank)
     
     def fit_temp(self, train_loader, override=True, steps=1000):
         if override:
@@ -867,7 +1248,7 @@ class KronLaplace(ParametricLaplace):
             self.H = self._rescale_factors(self.H, n_data_new / (n_data_new + n_data_old))
             self.H_facs += self.H
         # Decompose to self.H for all required quantities but keep H_facs for further inference
-        self.H = self.H_facs.decompose(damping=self.damping)
+        self.H = self.H_facs.decompose(damping=self.damping, max_rank=self.max_rank)
 
     @property
     def posterior_precision(self):
@@ -878,7 +1259,13 @@ class KronLaplace(ParametricLaplace):
         precision : `laplace.utils.matrix.KronDecomposed`
         """
         self._check_H_init()
-        return self.H * self._H_factor + self.prior_precision
+        return self.H * self._H_factor + self._group_prior_precision()
+
+    def _group_prior_precision(self):
+        # scalar or one prior precision per group of Kronecker factors
+        if len(self.prior_precision) in [1, len(self.H)]:
+            return self.prior_precision
+        return self._layer_prior_precision()
 
     @property
     def log_det_posterior_precision(self):
@@ -895,6 +1282,51 @@ class KronLaplace(ParametricLaplace):
     def functional_variance(self, Js):
         return self.posterior_precision.inv_square_form(Js)
 
+    def _functional_variance_stats(self, Js):
+        if self.damping or self.n_eigen_groups is None:
+            return super()._functional_variance_stats(Js)
+        # eigenvalues of the scaled Hessian are fixed; only the prior precision changes
+        S, lambdas, _ = (self.H * self._H_factor).square_form_groups(Js, self.n_eigen_groups)
+        # pack as (batch, outputs * outputs + 1, groups) for storage
+        return torch.cat([S.flatten(1, 2), lambdas.unsqueeze(1)], dim=1)
+
+    def _functional_variance_from_stats(self, stats):
+        if self.damping or self.n_eigen_groups is None:
+            return super()._functional_variance_from_stats(stats)
+        K = int(round((stats.shape[1] - 1) ** 0.5))
+        S, lambdas = stats[:, :-1].unflatten(1, (K, K)), stats[:, -1]
+        layers = torch.arange(len(self.H), device=stats.device).repeat_interleave(self.n_eigen_groups)
+        deltas = torch.broadcast_to(self._group_prior_precision(), (len(self.H),))[layers]
+        return (S / (lambdas + deltas).unsqueeze(1).unsqueeze(1)).sum(-1)
+
+    def _H_state_dict(self):
+        state_dict = {f'H.{k}': v for k, v in self.H.state_dict().items()}
+        state_dict['H_type'] = type(self.H).__name__
+        H_facs = getattr(self, 'H_facs', None)
+        if H_facs is not None and H_facs is not self.H:
+            state_dict.update({f'H_facs.{k}': v for k, v in H_facs.state_dict().items()})
+        return state_dict
+
+    def _load_H_state_dict(self, state_dict):
+        H = {k[len('H.'):]: v for k, v in state_dict.items() if k.startswith('H.')}
+        H_cls = Kron if state_dict['H_type'] == 'Kron' else KronDecomposed
+        self.H = H_cls.from_state_dict(H)
+        H_facs = {k[len('H_facs.'):]: v for k, v in state_dict.items() if k.startswith('H_facs.')}
+        self.H_facs = Kron.from_state_dict(H_facs) if len(H_facs) > 0 else None
+
+    def _prior_eigenvalues(self):
+        if self.damping or type(self.H) is Kron:
+            return None
+        return (self.H * self._H_factor).spectra()
+
+    @torch.enable_grad()
+    def _glm_predictive_distribution(self, batch):
+        if not self.jacobian_free:
+            return super()._glm_predictive_distribution(batch)
+        factors, f_mu = self.backend.jacobian_factors(batch)
+        f_var = self.posterior_precision.inv_square_form_factors(factors)
+        return f_mu.detach(), f_var.detach()
+
     def sample(self, n_samples=100):
         samples = torch.randn(n_samples, self.n_params, device=self._device)
         samples = self.posterior_precision.bmm(samples, exponent=-0.5)
@@ -918,19 +1350,51 @@ class LowRankLaplace(ParametricLaplace):
     To sample, compute the functional variance, and log determinant, algebraic tricks 
     are usedto reduce the costs of inversion to the that of a \\(K \times K\\) matrix
     if we have a rank of K.
+    With the Woodbury identity, only the Cholesky factor of the \\(K \times K\\) matrix
+    \\(diag(l)^{-1} + V^T P_0^{-1} V\\) is needed, which is cached as long as the
+    prior, the Hessian, and its scaling are neither replaced nor modified in place.
+    All products with the \\(P \times K\\) eigenvectors are computed in chunks of
+    `chunk_size` parameters.
     
     See `BaseLaplace` for the full interface.
+
+    Parameters
+    ----------
+    chunk_size : int, default=65536
+        number of parameters per chunk
     """
     _key = ('all', 'lowrank')
     def __init__(self, model, likelihood, sigma_noise=1, prior_precision=None, prior_mean=0, 
-                 temperature=1, backend=AsdlHessian, backend_kwargs=None):
+                 temperature=1, backend=AsdlHessian, backend_kwargs=None, chunk_size=65536):
         super().__init__(model, likelihood, sigma_noise=sigma_noise, 
                          prior_precision=prior_precision, prior_mean=prior_mean, 
                          temperature=temperature, backend=backend, backend_kwargs=backend_kwargs)
+        self.chunk_size = chunk_size
+        self._woodbury_cache = None
     
     def _init_H(self):
         self.H = None
 
+    def _chunks(self):
+        return [slice(start, start + self.chunk_size) for start in range(0, self.n_params, self.chunk_size)]
+
+    @property
+    def _woodbury_factor(self):
+        """Lower Cholesky factor \\(C\\) of \\(C C^T = diag(l)^{-1} + V^T P_0^{-1} V\\),
+        such that \\(P^{-1} = P_0^{-1} - P_0^{-1} V (C C^T)^{-1} V^T P_0^{-1}\\).
+        """
+        key = (self.H, self.prior_precision, self.sigma_noise, self.temperature)
+        cached = self._woodbury_cache
+        if cached is not None and cached[1] == self._cache_state(key):
+            return cached[2]
+        (U, l), prior_prec_diag = self.posterior_precision
+        K = torch.diag(1 / l)
+        for s in self._chunks():
+            K = K + U[s].T @ (U[s] / prior_prec_diag[s].reshape(-1, 1))
+        C = torch.linalg.cholesky(K)
+        self._woodbury_cache = (key, self._cache_state(key), C)
+        return C
+
     @property
     def V(self):
         (U, l), prior_prec_diag = self.posterior_precision
@@ -938,29 +1402,45 @@ class LowRankLaplace(ParametricLaplace):
 
     @property
     def Kinv(self):
-        (U, l), _ = self.posterior_precision
-        return torch.inverse(torch.diag(1 / l) + U.T @ self.V)
+        return torch.cholesky_inverse(self._woodbury_factor)
 
-    def fit(self, train_loader, override=True):
+    def fit(self, train_loader, override=True, shard=True, **kwargs):
+        """Fit the low-rank Laplace approximation at the parameters of the model with
+        the streaming eigensolver `eig_lowrank` of the backend, which takes a few
+        passes over `train_loader`.
+
+        Parameters
+        ----------
+        train_loader : torch.data.utils.DataLoader
+            each iterate is a training batch with `labels`;
+            `train_loader.dataset` needs to be set to access \\(N\\), size of the data set
+        override : bool, default=True
+            only `True` is supported since the eigendecomposition is not additive
+        shard : bool, default=True
+            in the distributed setting, process every `world_size`-th batch on each process,
+            see `ParametricLaplace.fit`.
+        **kwargs
+            passed to `eig_lowrank` of the backend, e.g., `rank`, `n_iter`, or
+            `init_vectors=self.H[0]` to restart from the eigenvectors of an earlier fit
+        """
         # override fit since output of eighessian not additive across batch
         if not override:
             # LowRankLA cannot be updated since eigenvalue representation not additive
             raise ValueError('LowRank LA does not support updating.')
 
         self.model.eval()
-        self.mean = parameters_to_vector(self.model.parameters()).detach()
+        mean = [p.detach() for name, p in self.model.named_parameters()
+                if p.requires_grad and 'modules_to_save' not in name]
+        self.mean = parameters_to_vector(mean).detach()
 
-        X, _ = next(iter(train_loader))
+        batch = next(iter(train_loader))
+        batch = {k: v.to(self._device) for k, v in batch.items()}
         with torch.no_grad():
-            try:
-                out = self.model(X[:1].to(self._device))
-            except (TypeError, AttributeError):
-                out = self.model(X.to(self._device))
+            out = self.model(**batch)
         self.n_outputs = out.shape[-1]
-        print('n_output', self.n_outputs)
         setattr(self.model, 'output_size', self.n_outputs)
 
-        eigenvectors, eigenvalues, loss = self.backend.eig_lowrank(train_loader)
+        eigenvectors, eigenvalues, loss = self.backend.eig_lowrank(train_loader, shard=shard, **kwargs)
         self.H = (eigenvectors, eigenvalues)
         self.loss = loss
 
@@ -982,31 +1462,39 @@ class LowRankLaplace(ParametricLaplace):
         return (self.H[0], self._H_factor * self.H[1]), self.prior_precision_diag
 
     def functional_variance(self, Jacs):
-        prior_var = torch.einsum('ncp,nkp->nck', Jacs / self.prior_precision_diag, Jacs)
-        Jacs_V = torch.einsum('ncp,pl->ncl', Jacs, self.V)
-        info_gain = torch.einsum('ncl,nkl->nck', Jacs_V @ self.Kinv, Jacs_V)
+        (U, l), prior_prec_diag = self.posterior_precision
+        prior_var, Jacs_V = 0, 0
+        for s in self._chunks():
+            Jacs_s = Jacs[..., s] / prior_prec_diag[s]
+            prior_var = prior_var + torch.einsum('ncp,nkp->nck', Jacs_s, Jacs[..., s])
+            Jacs_V = Jacs_V + Jacs_s @ U[s]
+        # Jacs_V (C C^T)^{-1} Jacs_V^T = W^T W with W = C^{-1} Jacs_V^T
+        n, c, k = Jacs_V.shape
+        W = torch.linalg.solve_triangular(self._woodbury_factor, Jacs_V.reshape(n * c, k).T, upper=False)
+        W = W.T.reshape(n, c, k)
+        info_gain = torch.einsum('ncl,nkl->nck', W, W)
         return prior_var - info_gain
 
-    def sample(self, n_samples):
-        samples = torch.randn(self.n_params, n_samples)
-        d = self.prior_precision_diag
-        Vs = self.V * d.sqrt().reshape(-1, 1)
-        VtV = Vs.T @ Vs
-        Ik = torch.eye(len(VtV))
-        A = torch.linalg.cholesky(VtV)
-        B = torch.linalg.cholesky(VtV + Ik)
-        A_inv = torch.inverse(A)
-        C = torch.inverse(A_inv.T @ (B - Ik) @ A_inv)
-        Kern_inv = torch.inverse(torch.inverse(C) + Vs.T @ Vs)
-        dinv_sqrt = (d).sqrt().reshape(-1, 1)
-        prior_sample = dinv_sqrt * samples
-        gain_sample = dinv_sqrt * Vs @ Kern_inv @ (Vs.T @ samples)
-        return self.mean + (prior_sample - gain_sample).T
+    def sample(self, n_samples=100):
+        # P^{-1} (P_0^{1/2} z_1 + V diag(l)^{1/2} z_2) with standard normal z has covariance P^{-1}
+        # since P = P_0 + V diag(l) V^T; P^{-1} is applied with the Woodbury identity.
+        (U, l), prior_prec_diag = self.posterior_precision
+        samples = torch.randn(n_samples, self.n_params, device=self._device, dtype=U.dtype)
+        z = torch.randn(n_samples, len(l), device=self._device, dtype=U.dtype) * l.sqrt()
+        VtP0inv = 0
+        for s in self._chunks():
+            samples[:, s] = (samples[:, s] * prior_prec_diag[s].sqrt() + z @ U[s].T) / prior_prec_diag[s]
+            VtP0inv = VtP0inv + samples[:, s] @ U[s]
+        gain = torch.cholesky_solve(VtP0inv.T, self._woodbury_factor).T
+        for s in self._chunks():
+            samples[:, s] -= gain @ U[s].T / prior_prec_diag[s]
+        return self.mean.reshape(1, self.n_params) + samples
 
     @property
     def log_det_posterior_precision(self):
         (U, l), prior_prec_diag = self.posterior_precision
-        return l.log().sum() + prior_prec_diag.log().sum() - torch.logdet(self.Kinv)
+        C = self._woodbury_factor
+        return l.log().sum() + prior_prec_diag.log().sum() + 2 * C.diagonal().log().sum()
 
 
 class DiagLaplace(ParametricLaplace):
@@ -1062,6 +1550,12 @@ class DiagLaplace(ParametricLaplace):
     def log_det_posterior_precision(self):
         return self.posterior_precision.log().sum()
 
+    def _prior_eigenvalues(self):
+        H = self._H_factor * self.H
+        if len(self.prior_precision) == self.n_layers:
+            return list(H.split([int(n) for n in parameters_per_layer(self.model)]))
+        return [H]
+
     def square_norm(self, value):
         delta = value - self.mean
         return delta @ (delta * self.posterior_precision)
@@ -1077,8 +1571,253 @@ class DiagLaplace(ParametricLaplace):
 
 
 class FunctionalLaplace(BaseLaplace):
-    pass
+    """Laplace approximation in function space.
+    The linearized network with a Gaussian prior is a Gaussian process with the empirical
+    neural tangent kernel \\(\\kappa(x, x') = \\mathcal{J}(x) P_0^{-1} \\mathcal{J}(x')^T\\)
+    and its posterior only requires the \\((MC) \\times (MC)\\) kernel of the \\(M\\)
+    training examples with \\(C\\) outputs instead of the \\(P \\times P\\) posterior precision,
+    which is preferable if \\(P \\gg MC\\), e.g., for LoRA adapters.
+    With the factors \\(\\Lambda = R R^T\\) of the log likelihood Hessians w.r.t. the outputs
+    of the training data \\(X\\), the functional variance is
+    \\[
+        \\kappa(x, x) - \\kappa(x, X) R (I + R^T \\kappa(X, X) R)^{-1} R^T \\kappa(X, x).
+    \\]
+    The Jacobians of the training data are kept in a `laplace.utils.JacobianStore` in
+    `jacobian_store`; the kernel is built from it in blocks of `batch_size` examples and
+    the predictive only computes the rows \\(\\kappa(x, X)\\) of new inputs from it.
+    The Cholesky factor of \\(I + R^T \\kappa(X, X) R\\) is cached as long as the prior
+    and the scaling of the likelihood are neither replaced nor modified in place.
+    Only a scalar prior precision is supported, for which the kernel is computed once.
+
+    See `BaseLaplace` for the full interface.
+
+    Parameters
+    ----------
+    batch_size : int, default=32
+        number of training examples per block of the kernel
+    store_dir : str, default=None
+        directory of the Jacobian store, a temporary directory if None
+    store_dtype : torch.dtype, default=torch.float32
+        storage type of the Jacobians
+    """
+    _key = ('all', 'gp')
+
+    def __init__(self, model, likelihood, sigma_noise=1., prior_precision=1.,
+                 prior_mean=0., temperature=1., backend=None, backend_kwargs=None,
+                 batch_size=32, store_dir=None, store_dtype=torch.float32):
+        super().__init__(model, likelihood, sigma_noise, 1. if prior_precision is None else prior_precision,
+                         prior_mean, temperature, backend, backend_kwargs)
+        self.batch_size = batch_size
+        self.store_dir = store_dir
+        self.store_dtype = store_dtype
+        self.mean = self.prior_mean
+        self.jacobian_store = None
+        self.subset_indices = None
+        self._f = None
+        self._unit_kernel = None
+        self._cholesky_cache = None
+
+    def select_subset(self, train_loader):
+        """Indices of the examples of `train_loader.dataset` that the posterior is
+        conditioned on, all examples for `FunctionalLaplace`.
+
+        Parameters
+        ----------
+        train_loader : torch.data.utils.DataLoader
+
+        Returns
+        -------
+        indices : torch.LongTensor
+        """
+        return torch.arange(len(train_loader.dataset))
+
+    def fit(self, train_loader, override=True):
+        """Fit the functional Laplace approximation at the parameters of the model by
+        storing the Jacobians of the training examples chosen by `select_subset`.
+
+        Parameters
+        ----------
+        train_loader : torch.data.utils.DataLoader
+            each iterate is a training batch with `labels`
+        override : bool, default=True
+            only `True` is supported since the kernel is not additive
+        """
+        if not override:
+            raise ValueError('Functional Laplace does not support updating.')
+
+        self.model.eval()
+        mean = [p.detach() for name, p in self.model.named_parameters()
+                if p.requires_grad and 'modules_to_save' not in name]
+        self.mean = parameters_to_vector(mean).detach()
+
+        batch = next(iter(train_loader))
+        batch = {k: v.to(self._device) for k, v in batch.items()}
+        with torch.no_grad():
+            out = self.model(**batch)
+        self.n_outputs = out.shape[-1]
+        setattr(self.model, 'output_size', self.n_outputs)
+
+        self.subset_indices = self.select_subset(train_loader)
+        if self.jacobian_store is not None:
+            self.jacobian_store.close()
+        self.jacobian_store = JacobianStore(path=self.store_dir, dtype=self.store_dtype)
+        self.loss = 0.
+        f = list()
+        for batch in tqdm(subset_loader(train_loader, self.subset_indices)):
+            batch = {k: v.to(self._device) for k, v in batch.items()}
+            Js, f_batch = self.backend.jacobians(batch)
+            self.jacobian_store.append(Js, f_batch, batch['labels'])
+            self.loss += self.backend.factor * self.backend.lossfunc(f_batch, batch['labels']).detach()
+            f.append(f_batch.detach())
+            del Js
+        self._f = torch.cat(f)
+        self.n_data = len(self.subset_indices)
+        self._unit_kernel = None
+        self._cholesky_cache = None
+
+    def _check_fit(self):
+        if self.jacobian_store is None:
+            raise AttributeError('Laplace not fitted. Run fit() first.')
+
+    def _cross_kernel(self, Js):
+        """Kernel \\(\\mathcal{J}(x) \\mathcal{J}(X)^T\\) of `Js` `(n, C, P)` with the stored
+        Jacobians for unit prior precision, `(n, C, M, C)`.
+        """
+        blocks = [torch.einsum('ncp,mkp->ncmk', Js, J_block.to(Js.dtype))
+                  for J_block, _, _ in self.jacobian_store.batches(self.batch_size, shuffle=False,
+                                                                   device=Js.device)]
+        return torch.cat(blocks, dim=2)
+
+    @property
+    def kernel(self):
+        """Prior kernel of the training data \\(\\kappa(X, X)\\), `(M, C, M, C)`.
+        The kernel for unit prior precision is computed once per fit in blocks.
+
+        Returns
+        -------
+        kernel : torch.Tensor
+        """
+        self._check_fit()
+        if self._unit_kernel is None:
+            blocks = [self._cross_kernel(J_block) for J_block, _, _
+                      in self.jacobian_store.batches(self.batch_size, shuffle=False, device=self._device)]
+            self._unit_kernel = torch.cat(blocks)
+        return self._unit_kernel / self.prior_precision
+
+    @property
+    def _likelihood_factors(self):
+        """Factors \\(R_m\\) of the scaled log likelihood Hessians w.r.t. the outputs,
+        \\(R_m R_m^T = \\Lambda_m\\), `(M, C, C)`.
+        """
+        M, C = self._f.shape
+        if self.likelihood == 'regression':
+            R = torch.eye(C, device=self._device, dtype=self._f.dtype).expand(M, C, C)
+        else:
+            p = torch.softmax(self._f, dim=-1)
+            R = torch.diag_embed(p.sqrt()) - p.unsqueeze(-1) * p.sqrt().unsqueeze(-2)
+        return R * self._H_factor.sqrt()
+
+    @property
+    def _cholesky_factor(self):
+        """Lower Cholesky factor \\(L\\) of \\(L L^T = I + R^T \\kappa(X, X) R\\)."""
+        key = (self.prior_precision, self.sigma_noise, self.temperature)
+        cached = self._cholesky_cache
+        if cached is not None and cached[1] == self._cache_state(key):
+            return cached[2]
+        K = self.kernel
+        R = self._likelihood_factors.to(K.dtype)
+        M, C = self._f.shape
+        B = torch.einsum('mca,mcnd,ndb->manb', R, K, R).reshape(M * C, M * C)
+        L = torch.linalg.cholesky(B + torch.eye(M * C, device=B.device, dtype=B.dtype))
+        self._cholesky_cache = (key, self._cache_state(key), L)
+        return L
+
+    @property
+    def log_det_ratio(self):
+        """Compute the log determinant ratio, a part of the log marginal likelihood,
+        which equals \\(\\log \\det (I + R^T \\kappa(X, X) R)\\) in function space.
+
+        Returns
+        -------
+        log_det_ratio : torch.Tensor
+        """
+        return 2 * self._cholesky_factor.diagonal().log().sum()
+
+    @torch.enable_grad()
+    def _glm_predictive_distribution(self, batch):
+        self._check_fit()
+        Js, f_mu = self.backend.jacobians(batch)
+        Js = Js.detach()
+        prior_var = 1 / self.prior_precision.to(Js.dtype)
+        L = self._cholesky_factor.to(Js.dtype)
+        R = self._likelihood_factors.to(Js.dtype)
+        n, C = f_mu.shape
+        K_xX = self._cross_kernel(Js) * prior_var
+        G = torch.einsum('mka,ncmk->manc', R, K_xX).reshape(len(L), n * C)
+        V = torch.linalg.solve_triangular(L, G, upper=False).reshape(len(L), n, C)
+        f_var = torch.einsum('ncp,nkp->nck', Js, Js) * prior_var - torch.einsum('jnc,jnk->nck', V, V)
+        return f_mu.detach(), f_var.detach()
+
+    def _jvp_predictive_samples(self, batch, n_samples=100, chunk_size=None):
+        raise ValueError('Functional Laplace only supports the glm predictive.')
+
+    def _nn_predictive_samples(self, batch, n_samples=100, chunk_size=None):
+        raise ValueError('Functional Laplace only supports the glm predictive.')
+
+    def optimize_prior_precision(self, method='marglik', pred_type='glm', n_steps=100, lr=1e-1,
+                                 init_prior_prec=1., val_loader=None, loss=get_nll,
+                                 link_approx='probit', n_samples=100, verbose=False):
+        if method != 'marglik' or pred_type != 'glm':
+            raise ValueError('Functional Laplace only supports marglik with the glm predictive.')
+        self.optimize_prior_precision_base(pred_type, method, n_steps, lr, init_prior_prec,
+                                           val_loader, loss, link_approx, n_samples, verbose)
+        return self.prior_precision
+
+    @BaseLaplace.prior_precision.setter
+    def prior_precision(self, prior_precision):
+        # Extend setter from Laplace to restrict prior precision structure.
+        super(FunctionalLaplace, type(self)).prior_precision.fset(self, prior_precision)
+        if len(self.prior_precision) != 1:
+            raise ValueError('Prior precision for functional Laplace needs to be scalar.')
 
 
 class SoDLaplace(FunctionalLaplace):
-    pass
+    """Subset-of-data functional Laplace approximation, which conditions the Gaussian
+    process of `FunctionalLaplace` on `n_subset` training examples only, such that the
+    kernel is at most \\((n_{subset} C) \\times (n_{subset} C)\\).
+    The subset is chosen by a `laplace.utils.SubsetSelection`, either at random or
+    greedily by the largest prior variance given the examples selected so far.
+    The log likelihood and the marginal likelihood refer to the subset.
+
+    See `FunctionalLaplace` for the full interface.
+
+    Parameters
+    ----------
+    n_subset : int, default=1000
+        number of training examples in the subset
+    subset_selection : {'random', 'max_variance'} or laplace.utils.SubsetSelection, default='random'
+    seed : int, default=0
+        seed of the subset selection by name
+    """
+    _key = ('all', 'sod')
+    _subset_selections = {'random': RandomSubsetSelection, 'max_variance': MaxVarianceSubsetSelection}
+
+    def __init__(self, model, likelihood, sigma_noise=1., prior_precision=1.,
+                 prior_mean=0., temperature=1., backend=None, backend_kwargs=None,
+                 batch_size=32, store_dir=None, store_dtype=torch.float32,
+                 n_subset=1000, subset_selection='random', seed=0):
+        if isinstance(subset_selection, str) and subset_selection not in self._subset_selections:
+            raise ValueError(f'Invalid subset selection {subset_selection}.')
+        super().__init__(model, likelihood, sigma_noise, prior_precision, prior_mean, temperature,
+                         backend, backend_kwargs, batch_size, store_dir, store_dtype)
+        self.n_subset = n_subset
+        self.subset_selection = subset_selection
+        self.seed = seed
+
+    def select_subset(self, train_loader):
+        if len(train_loader.dataset) <= self.n_subset:
+            return super().select_subset(train_loader)
+        selection = self.subset_selection
+        if isinstance(selection, str):
+            selection = self._subset_selections[selection](self.n_subset, seed=self.seed)
+        return selection.select(self, train_loader)
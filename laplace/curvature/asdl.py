@@ -52,7 +52,157 @@ def batch_gradient(model, closure, input_shape,return_outputs=False):
         return grads
     
 asdl.batch_gradient = batch_gradient
-    
+
+
+class LinearCapture:
+    """Records inputs and outputs of all `torch.nn.Linear` modules with trainable
+    parameters during a forward pass. Per-sample gradients of these modules are
+    then obtained from the recorded activations and the gradients of the outputs,
+    which allows to compute the gradients of several model outputs after a single
+    forward pass. Activations are only recorded within the `with` block and released
+    when leaving it, so that the graph of the last batch is not kept alive.
+    A `persistent` capture registers its hooks once and keeps them across `with` blocks
+    until `close` is called, which avoids registering hooks for every batch.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+    modules : list[torch.nn.Module], default=None
+        modules to record, all modules with trainable parameters if None
+    persistent : bool, default=False
+        keep the hooks registered when leaving the `with` block
+    """
+    def __init__(self, model, modules=None, persistent=False):
+        if modules is None:
+            modules = [m for m in model.modules()
+                       if any(p.requires_grad for p in m.parameters(recurse=False))]
+        self.modules = modules
+        self.persistent = persistent
+        self.inputs = dict()
+        self.outputs = dict()
+        self._handles = list()
+        self._recording = False
+
+    @property
+    def supported(self):
+        return all(isinstance(m, torch.nn.Linear) for m in self.modules)
+
+    def _hook(self, module, input, output):
+        if self._recording:
+            self.inputs[module] = input[0].detach()
+            self.outputs[module] = output
+
+    def __enter__(self):
+        self.clear()
+        if len(self._handles) == 0:
+            self._handles = [m.register_forward_hook(self._hook) for m in self.modules]
+        self._recording = True
+        return self
+
+    def __exit__(self, *args):
+        self._recording = False
+        self.clear()
+        if not self.persistent:
+            self.close()
+
+    def clear(self):
+        """Release the recorded activations and outputs."""
+        self.inputs = dict()
+        self.outputs = dict()
+
+    def close(self):
+        """Remove the hooks from the modules."""
+        for handle in self._handles:
+            handle.remove()
+        self._handles = list()
+
+    def output_grads(self, f, grad_f, retain_graph=False, is_grads_batched=False):
+        """Gradients of `(f * grad_f).sum()` with respect to the recorded module outputs.
+        With `is_grads_batched=True`, `grad_f` has a leading dimension of cotangents that
+        are backpropagated together in one vectorized backward pass.
+
+        Returns
+        -------
+        grads : list[torch.Tensor]
+            one tensor per module in `self.modules` with the shape of the module output,
+            preceded by the cotangent dimension if `is_grads_batched`
+        """
+        modules = [m for m in self.modules if m in self.outputs]
+        grads = torch.autograd.grad(f, [self.outputs[m] for m in modules], grad_outputs=grad_f,
+                                    retain_graph=retain_graph, allow_unused=True,
+                                    is_grads_batched=is_grads_batched)
+        grads = {m: g for m, g in zip(modules, grads)}
+        return [grads.get(m) for m in self.modules]
+
+    def batch_grads(self, output_grads, N, n_cotangents=None):
+        """Per-sample parameter gradients `(N, parameters)` given the output gradients
+        of each module. Sequence dimensions are summed over as in `batch_gradient`.
+        With `n_cotangents`, the output gradients have a leading dimension of
+        `n_cotangents` as returned by `output_grads` with `is_grads_batched=True`,
+        and the gradients are `(N, n_cotangents, parameters)`.
+        """
+        C = 1 if n_cotangents is None else n_cotangents
+        grads = list()
+        for module, g in zip(self.modules, output_grads):
+            n_params = sum(p.numel() for p in module.parameters(recurse=False) if p.requires_grad)
+            if g is None:
+                grads.append(torch.zeros(N, C, n_params, device=module.weight.device,
+                                         dtype=module.weight.dtype))
+                continue
+            a = self.inputs[module]
+            a = a.reshape(N, -1, a.shape[-1])
+            g = g.reshape(C, N, -1, g.shape[-1])
+            if module.weight.requires_grad:
+                grads.append(torch.einsum('cnto,nti->ncoi', g, a.to(g.dtype)).reshape(N, C, -1))
+            if module.bias is not None and module.bias.requires_grad:
+                grads.append(g.sum(2).transpose(0, 1))
+        grads = torch.cat(grads, dim=-1)
+        return grads.squeeze(1) if n_cotangents is None else grads
+
+
+def batch_jacobian(model, closure, output_size, capture=None):
+    """Per-sample Jacobians of all `output_size` outputs of `closure` with a single
+    forward pass and a single vectorized backward pass of the one-hot cotangents of
+    all outputs (`is_grads_batched`). If the backward pass of `model` cannot be
+    vectorized, it falls back to one backward pass per output.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+    closure : callable
+        runs the forward pass of `model` and returns the outputs `(batch, outputs)`
+    output_size : int
+    capture : LinearCapture, default=None
+        capture of the modules of `model` to reuse, a new one is created if None
+
+    Returns
+    -------
+    Js : torch.Tensor
+        Jacobians `(batch, outputs, parameters)` or `None` if `model` has
+        trainable parameters outside of `torch.nn.Linear` modules
+    f : torch.Tensor
+        output function `(batch, outputs)`
+    """
+    capture = LinearCapture(model) if capture is None else capture
+    if not capture.supported:
+        return None, None
+    with capture:
+        f = closure()
+        N = f.shape[0]
+        grad_f = torch.eye(output_size, device=f.device, dtype=f.dtype)
+        grad_f = grad_f.unsqueeze(1).expand(output_size, *f.shape)
+        try:
+            # the graph is retained so that the fallback can still backpropagate
+            output_grads = capture.output_grads(f, grad_f, retain_graph=True, is_grads_batched=True)
+            Js = capture.batch_grads(output_grads, N, n_cotangents=output_size)
+        except RuntimeError:
+            Js = list()
+            for i in range(output_size):
+                output_grads = capture.output_grads(f, grad_f[i], retain_graph=i < output_size - 1)
+                Js.append(capture.batch_grads(output_grads, N))
+            Js = torch.stack(Js, dim=1)
+    return Js, f.detach()
+
 
 from laplace.curvature import CurvatureInterface, GGNInterface, EFInterface
 from laplace.utils import Kron, _is_batchnorm
@@ -62,19 +212,165 @@ EPS = 1e-6
 
 class AsdlInterface(CurvatureInterface):
     """Interface for asdfghjkl backend.
+    The fisher makers of asdfghjkl and the hooks of the `LinearCapture` are created
+    once and reused for all batches until `close` is called.
+    With `kfac_conv='kfac-reduce'`, the Kronecker factors of models whose trainable
+    parameters are all in `torch.nn.Linear` modules are computed with forward hooks
+    from the inputs averaged and the output gradients summed over the tokens of each
+    example, see `kron`.
     """
     def __init__(self, model, likelihood, last_layer=False, subnetwork_indices=None,
                  kfac_conv='kfac-expand'):
         super().__init__(model, likelihood, last_layer, subnetwork_indices)
+        self._check_kfac_conv(kfac_conv)
         self.kfac_conv = kfac_conv
+        self._capture = None
+        self._fisher_makers = dict()
+        self._modules = None
+        self._kron_capture = None
+
+    @staticmethod
+    def _check_kfac_conv(kfac_conv):
+        if kfac_conv not in ['kfac-expand', 'kfac-reduce']:
+            raise ValueError(f'Invalid kfac_conv {kfac_conv}.')
 
     @property
     def loss_type(self):
         return LOSS_MSE if self.likelihood == 'regression' else LOSS_CROSS_ENTROPY
 
+    @property
+    def capture(self):
+        """Persistent `LinearCapture` of the modules with trainable parameters;
+        its hooks are registered on first use and removed by `close`.
+        """
+        if self._capture is None:
+            self._capture = LinearCapture(self.model, persistent=True)
+        return self._capture
+
+    def _fisher_maker(self, fisher_shape):
+        if fisher_shape not in self._fisher_makers:
+            cfg = FisherConfig(fisher_type=self._ggn_type, loss_type=self.loss_type,
+                               fisher_shapes=[fisher_shape], data_size=1)
+            self._fisher_makers[fisher_shape] = get_fisher_maker(self.model, cfg)
+        return self._fisher_makers[fisher_shape]
+
+    def close(self):
+        for capture in [self._capture, self._kron_capture]:
+            if capture is not None:
+                capture.close()
+        self._capture, self._kron_capture = None, None
+        self._fisher_makers = dict()
+
+    @property
+    def _kron_modules(self):
+        # modules in the order of the parameters in `Kron.init_from_model`
+        if self._modules is None:
+            self._modules = [m for name, m in self.model.named_modules() if 'modules_to_save' not in name
+                             and any(p.requires_grad for p in m.parameters(recurse=False))]
+        return self._modules
+
+    @property
+    def _hooks_supported(self):
+        return not self.last_layer and all(isinstance(m, torch.nn.Linear) for m in self._kron_modules)
+
+    def _sketched(self, module, j):
+        # whether factor `j` of `module`, 0 for output gradients and 1 for inputs, is sketched
+        return False
+
+    def _factor(self, i, j, X=None, device=None, dense=False):
+        """Factor `j` of the `i`-th module from samples `X` `(samples, dim)`, zero if None."""
+        module = self._kron_modules[i]
+        dim = module.weight.shape[j]
+        if X is None:
+            device = module.weight.device if device is None else device
+            return torch.zeros(dim, dim, device=device)
+        X = X.to(torch.get_default_dtype())
+        return X.T @ X
+
+    def _cotangents(self, f, y):
+        # vectors v with sum_v v v^T equal to the Hessian of the loss w.r.t. `f`,
+        # a single sample of them, or the gradient of the loss for the empirical Fisher
+        eye = torch.eye(f.shape[-1], device=f.device, dtype=f.dtype)
+        if self.likelihood == 'regression':
+            if self._ggn_type == FISHER_EMP:
+                return [f - y.reshape(f.shape)]
+            if self._ggn_type == FISHER_MC:
+                return [torch.randn_like(f)]
+            return [eye[c].expand_as(f) for c in range(f.shape[-1])]
+        p = torch.softmax(f, dim=-1)
+        if self._ggn_type == FISHER_EMP:
+            return [p - eye[y]]
+        if self._ggn_type == FISHER_MC:
+            y = torch.multinomial(p.reshape(-1, p.shape[-1]), 1).reshape(p.shape[:-1])
+            return [p - eye[y]]
+        return [p[..., c:c+1].sqrt() * (eye[c] - p) for c in range(f.shape[-1])]
+
+    def _hook_kron(self, batch, N, reduce=False):
+        """Kronecker factors of the `torch.nn.Linear` modules from their inputs and
+        output gradients recorded with forward hooks, with the layout and scaling of the
+        factors of asdfghjkl. Every token is a sample of the factors (KFAC-expand), or,
+        with `reduce=True`, the inputs are averaged and the output gradients summed over
+        the tokens of each example before forming the outer products (KFAC-reduce).
+        Modules that read the identical input tensor share one input factor.
+
+        Returns
+        -------
+        f : torch.Tensor
+            output function `(batch, outputs)`
+        kron : laplace.utils.matrix.Kron
+        """
+        modules = self._kron_modules
+        if self._kron_capture is None:
+            self._kron_capture = LinearCapture(self.model, modules, persistent=True)
+        with self._kron_capture as capture:
+            f = self.model(**batch)
+            M = f.shape[0]
+
+            def samples(X, reduction):
+                X = X.reshape(M, -1, X.shape[-1])
+                if reduce:
+                    return getattr(X, reduction)(1)
+                return X.reshape(-1, X.shape[-1])
+
+            Gs, Gs_bias = [None] * len(modules), [None] * len(modules)
+            cotangents = self._cotangents(f.detach(), batch['labels'])
+            for c, v in enumerate(cotangents):
+                grads = capture.output_grads(f, v, retain_graph=c < len(cotangents) - 1)
+                for i, (module, g) in enumerate(zip(modules, grads)):
+                    if g is None:
+                        continue
+                    g = samples(g, 'sum')
+                    G = self._factor(i, 0, g)
+                    Gs[i] = G if Gs[i] is None else Gs[i].add_(G)
+                    if module.bias is not None and module.bias.requires_grad and self._sketched(module, 0):
+                        G = self._factor(i, 0, g, dense=True)
+                        Gs_bias[i] = G if Gs_bias[i] is None else Gs_bias[i].add_(G)
+
+            kfacs, inputs = list(), dict()
+            for i, module in enumerate(modules):
+                G = self._factor(i, 0) if Gs[i] is None else Gs[i]
+                if module.weight.requires_grad:
+                    a = capture.inputs.get(module)
+                    if a is None:
+                        A = self._factor(i, 1)
+                    else:
+                        # identical inputs are views with the same memory, shape, and strides
+                        key = (a.data_ptr(), a.shape, a.stride(), a.dtype, self._sketched(module, 1))
+                        if key not in inputs:
+                            inputs[key] = self._factor(i, 1, samples(a, 'mean')).mul_(1 / N)
+                        A = inputs[key]
+                    kfacs.append([G, A])
+                if module.bias is not None and module.bias.requires_grad:
+                    if self._sketched(module, 0):
+                        G = self._factor(i, 0, dense=True) if Gs_bias[i] is None else Gs_bias[i]
+                    kfacs.append([G])
+        return f.detach(), Kron(kfacs)
+
     def jacobians(self, batch):
-        """Compute Jacobians \\(\\nabla_\\theta f(x;\\theta)\\) at current parameter \\(\\theta\\)
-        using asdfghjkl's gradient per output dimension.
+        """Compute Jacobians \\(\\nabla_\\theta f(x;\\theta)\\) at current parameter \\(\\theta\\).
+        If all trainable parameters belong to `torch.nn.Linear` modules, the Jacobians
+        of all outputs are obtained from a single forward pass using `batch_jacobian`,
+        otherwise asdfghjkl's gradient is computed per output dimension.
 
         Parameters
         ----------
@@ -84,12 +380,84 @@ class AsdlInterface(CurvatureInterface):
         Returns
         -------
         Js : torch.Tensor
-            Jacobians `(batch, parameters, outputs)`
+            Jacobians `(batch, outputs, parameters)`
+        f : torch.Tensor
+            output function `(batch, outputs)`
+        """
+        Js, f = batch_jacobian(self.model, lambda: self.model(**batch), self.model.output_size,
+                               capture=self.capture)
+        if Js is None:
+            Js, f = self._jacobians_per_output(batch)
+        elif self.subnetwork_indices is not None:
+            Js = Js[:, :, self.subnetwork_indices]
+        return Js, f
+
+    def jacobian_factors(self, batch):
+        """Compute the Jacobians \\(\\nabla_\\theta f(x;\\theta)\\) in factored form per group
+        of Kronecker factors, i.e., per weight and bias of each `torch.nn.Linear` module.
+        The Jacobian of a weight is the outer product of output gradients and inputs
+        summed over the sequence dimension; it is kept in this factored form
+        whenever that is smaller than the Jacobian of the weight itself.
+        The output gradients of all outputs are computed with one batched backward pass
+        as in `batch_jacobian`, and the factors are built lazily one group at a time,
+        so that a consumer such as `KronDecomposed.inv_square_form_factors` reduces each
+        group before the next is built. This way, neither the Jacobian of all parameters
+        nor the Jacobians of all groups are materialized at once.
+
+        Parameters
+        ----------
+        batch : dict
+            input data on compatible device with model.
+
+        Returns
+        -------
+        factors : generator
+            one element per group of Kronecker factors, either a tuple `(G, A)` of output
+            gradients `(batch, outputs, tokens, p_in)` and inputs `(batch, tokens, p_out)`
+            or the Jacobian of the group `(batch, outputs, parameters of group)`
         f : torch.Tensor
             output function `(batch, outputs)`
         """
+        capture = self.capture
+        if not capture.supported or self.subnetwork_indices is not None:
+            raise ValueError('Jacobian factors require all trainable parameters '
+                             'to be in torch.nn.Linear modules.')
+        with capture:
+            f = self.model(**batch)
+            N, K = f.shape
+            inputs = [capture.inputs[module] for module in capture.modules]
+            grad_f = torch.eye(K, device=f.device, dtype=f.dtype).unsqueeze(1).expand(K, N, K)
+            try:
+                output_grads = capture.output_grads(f, grad_f, retain_graph=True, is_grads_batched=True)
+            except RuntimeError:
+                output_grads = [capture.output_grads(f, grad_f[i], retain_graph=i < K - 1) for i in range(K)]
+                output_grads = [None if gs[0] is None else torch.stack(gs)
+                                for gs in zip(*output_grads)]
+        return self._jacobian_factors(capture.modules, inputs, output_grads, N, K), f.detach()
+
+    @staticmethod
+    def _jacobian_factors(modules, inputs, output_grads, N, K):
+        for j, module in enumerate(modules):
+            a, g = inputs[j], output_grads[j]
+            inputs[j], output_grads[j] = None, None
+            a = a.reshape(N, -1, a.shape[-1])
+            T, p_out = a.shape[1:]
+            p_in = module.out_features
+            if g is None:
+                g = torch.zeros(N, K, T, p_in, device=a.device, dtype=a.dtype)
+            else:
+                g = g.reshape(K, N, T, p_in).transpose(0, 1)
+            if module.weight.requires_grad:
+                if K * T * p_in + T * p_out < K * p_in * p_out:
+                    yield g, a
+                else:
+                    yield torch.einsum('nkto,nti->nkoi', g, a.to(g.dtype)).reshape(N, K, -1)
+            if module.bias is not None and module.bias.requires_grad:
+                yield g.sum(2)
+            del a, g
+
+    def _jacobians_per_output(self, batch):
         x = batch['input_ids']
-        input_shape =  x.shape
 
         Js = list()
         for i in range(self.model.output_size):
@@ -179,18 +547,14 @@ class AsdlInterface(CurvatureInterface):
         if self.last_layer:
             _, X = self.model.forward_with_features(**batch)
 
-            cfg = FisherConfig(fisher_type=self._ggn_type, loss_type=self.loss_type,
-                            fisher_shapes=[SHAPE_DIAG], data_size=1)
-            fisher_maker = get_fisher_maker(self.model, cfg)
+            fisher_maker = self._fisher_maker(SHAPE_DIAG)
             if 'emp' in self._ggn_type:
                 dummy = fisher_maker.setup_model_call(self._model, X)
                 fisher_maker.setup_loss_call(self.lossfunc, dummy, y)
             else:
                 fisher_maker.setup_model_call(self._model, X)
         else:
-            cfg = FisherConfig(fisher_type=self._ggn_type, loss_type=self.loss_type,
-                            fisher_shapes=[SHAPE_DIAG], data_size=1)
-            fisher_maker = get_fisher_maker(self.model, cfg)
+            fisher_maker = self._fisher_maker(SHAPE_DIAG)
             if 'emp' in self._ggn_type:
                 dummy = fisher_maker.setup_model_call(self._model, **batch)
                 fisher_maker.setup_loss_call(self.lossfunc, dummy, y)
@@ -217,42 +581,64 @@ class AsdlInterface(CurvatureInterface):
             curv_factor = 1.0   # ASDL uses proper 1/2 * MSELoss
         return self.factor * loss, curv_factor * diag_ggn, f.detach()
  
-    def kron(self, batch, N, **kwargs):
-        y = batch['labels']
-        if self.last_layer:
-            _, X = self.model.forward_with_features(**batch)
+    def kron(self, batch, N, kfac_conv=None, **kwargs):
+        """Kronecker factored curvature of a batch, see `CurvatureInterface.kron`.
 
-            cfg = FisherConfig(fisher_type=self._ggn_type, loss_type=self.loss_type,
-                           fisher_shapes=[SHAPE_KRON], data_size=1)
-            # fisher_maker = get_fisher_maker(self.model, cfg, self.kfac_conv)
-            fisher_maker = get_fisher_maker(self.model, cfg)
-            if 'emp' in self._ggn_type:
-                dummy = fisher_maker.setup_model_call(self._model, X)
-                fisher_maker.setup_loss_call(self.lossfunc, dummy, y)
-            else:
-                fisher_maker.setup_model_call(self._model, X)
+        Parameters
+        ----------
+        batch : dict
+        N : int
+            number of data points that the factors of the inputs are scaled by
+        kfac_conv : {'kfac-expand', 'kfac-reduce'}, default=None
+            treat every token as a sample or aggregate over the tokens of each example;
+            `self.kfac_conv` if None
 
+        Returns
+        -------
+        loss : torch.Tensor
+        H : laplace.utils.matrix.Kron
+        f : torch.Tensor
+        """
+        kfac_conv = self.kfac_conv if kfac_conv is None else kfac_conv
+        self._check_kfac_conv(kfac_conv)
+        y = batch['labels']
+        if kfac_conv == 'kfac-reduce':
+            if not self._hooks_supported:
+                raise ValueError('kfac-reduce requires all trainable parameters '
+                                 'to be in torch.nn.Linear modules.')
+            f, kron = self._hook_kron(batch, N, reduce=True)
         else:
-            cfg = FisherConfig(fisher_type=self._ggn_type, loss_type=self.loss_type,
-                            fisher_shapes=[SHAPE_KRON], data_size=1)
-            # fisher_maker = get_fisher_maker(self.model, cfg, self.kfac_conv)
-            fisher_maker = get_fisher_maker(self.model, cfg)
-            if 'emp' in self._ggn_type:
-                dummy = fisher_maker.setup_model_call(self._model, **batch)
-                fisher_maker.setup_loss_call(self.lossfunc, dummy, y)
+            if self.last_layer:
+                _, X = self.model.forward_with_features(**batch)
+
+                fisher_maker = self._fisher_maker(SHAPE_KRON)
+                if 'emp' in self._ggn_type:
+                    dummy = fisher_maker.setup_model_call(self._model, X)
+                    fisher_maker.setup_loss_call(self.lossfunc, dummy, y)
+                else:
+                    fisher_maker.setup_model_call(self._model, X)
+
             else:
-                fisher_maker.setup_model_call(self._model, **batch)
+                fisher_maker = self._fisher_maker(SHAPE_KRON)
+                if 'emp' in self._ggn_type:
+                    dummy = fisher_maker.setup_model_call(self._model, **batch)
+                    fisher_maker.setup_loss_call(self.lossfunc, dummy, y)
+                else:
+                    fisher_maker.setup_model_call(self._model, **batch)
 
-        f, _ = fisher_maker.forward_and_backward()
+            f, _ = fisher_maker.forward_and_backward()
+            M = len(y)
+            kron = self._get_kron_factors(M)
+            kron = self._rescale_kron_factors(kron, N)
         loss = self.lossfunc(f.detach(), y)
-        M = len(y)
-        kron = self._get_kron_factors(M)
-        kron = self._rescale_kron_factors(kron, N)
         if type(self) is AsdlEF and self.likelihood == 'regression':
             curv_factor = 0.5  # correct scaling for diag ef
         else:
             curv_factor = 1.0   # ASDL uses proper 1/2 * MSELoss
-        return self.factor * loss, curv_factor * kron, f.detach()
+        if curv_factor != 1.0:
+            # not in-place since weight and bias groups share factors
+            kron = curv_factor * kron
+        return self.factor * loss, kron, f.detach()
 
 
 class AsdlHessian(AsdlInterface):
@@ -277,26 +663,40 @@ class AsdlHessian(AsdlInterface):
         loss = self.lossfunc(self.model(x), y).detach()
         return self.factor * loss, self.factor * H
 
-    def eig_lowrank(self, data_loader):
-        # TODO: need to implement manually...
-        # compute truncated eigendecomposition of the Hessian, only keep eigvals > EPS
-        if self.last_layer:
-            _, x = self.model.forward_with_features(x)
-        cfg = HessianConfig(hessian_shapes=[SHAPE_FULL])
-        hess_maker = HessianMaker(self.model, cfg)
-        dummy = hess_maker.setup_model_call(self._model, x)
-        hess_maker.setup_loss_call(self.lossfunc, dummy, y)
-        # iteratively go through data loader and average eigendecomposition
-        # previously:
-        eigvals, eigvecs = hessian_eig(self.model, self.lossfunc, data_loader=data_loader,
-                                       top_n=self.low_rank, max_iters=self.low_rank*10)
-        eigvals = torch.from_numpy(np.array(eigvals))
-        mask = (eigvals > EPS)
-        eigvecs = torch.stack([vec.get_flatten_vector() for vec in eigvecs], dim=1)[:, mask]
-        device = eigvecs.device
-        eigvals = eigvals[mask].to(eigvecs.dtype).to(device)
-        loss = sum([self.lossfunc(self.model(x.to(device)).detach(), y.to(device)) for x, y in data_loader])
-        return eigvecs, self.factor * eigvals, self.factor * loss
+    def matrix_vector_products(self, batch, V):
+        """Compute the Hessian-vector products \\(H v\\) for the vectors `V` with
+        forward-over-reverse differentiation of the loss, vectorized over `V`.
+
+        Parameters
+        ----------
+        batch : dict
+            input data and `labels` on compatible device with model.
+        V : torch.Tensor
+            vectors `(n_vectors, parameters)`
+
+        Returns
+        -------
+        loss : torch.Tensor
+        HV : torch.Tensor
+            Hessian-vector products `(n_vectors, parameters)`
+        """
+        f, params = self._functional_model(batch)
+        tangents = self._unflatten(V, params)
+
+        def loss(params):
+            return self.factor * self.lossfunc(f(params), batch['labels'])
+
+        grad = torch.func.grad(loss)
+        HV = torch.func.vmap(lambda t: torch.func.jvp(grad, (params,), (t,))[1])(tangents)
+        HV = torch.cat([HV[name].reshape(len(V), -1) for name in params], dim=1)
+        return loss(params).detach(), HV.detach()
+
+    def eig_lowrank(self, data_loader, rank=None, **kwargs):
+        """Top-`rank` eigendecomposition of the Hessian, see
+        `CurvatureInterface.eig_lowrank`; `rank` defaults to `low_rank`.
+        """
+        rank = self.low_rank if rank is None else rank
+        return super().eig_lowrank(data_loader, rank=rank, **kwargs)
 
 
 class AsdlGGN(AsdlInterface, GGNInterface):
@@ -1,6 +1,10 @@
 import torch
 from torch.nn import MSELoss, CrossEntropyLoss
 
+from laplace.utils import is_distributed, local_batches, all_reduce_tensors
+
+EPS = 1e-6
+
 
 class CurvatureInterface:
     """Interface to access curvature for a model and corresponding likelihood.
@@ -167,6 +171,140 @@ class CurvatureInterface:
         """
         raise NotImplementedError
 
+    def _functional_model(self, batch):
+        """The model output on `batch` as a function of the parameters of the curvature,
+        i.e., the trainable parameters in the order of the posterior mean.
+        For last-layer, the features are computed once and only the last layer is a
+        function of its parameters.
+
+        Returns
+        -------
+        f : callable
+            maps a dict of parameters to the output `(batch, outputs)`
+        params : dict[str, torch.Tensor]
+            current parameters
+        """
+        if self.last_layer:
+            with torch.no_grad():
+                _, phi = self.model.forward_with_features(**batch)
+            module, args, kwargs = self.model.last_layer, (phi,), dict()
+        else:
+            module, args, kwargs = self.model, (), batch
+        params = {name: p.detach() for name, p in module.named_parameters()
+                  if p.requires_grad and 'modules_to_save' not in name}
+
+        def f(params):
+            return torch.func.functional_call(module, params, args, kwargs)
+        return f, params
+
+    @staticmethod
+    def _unflatten(V, params):
+        # vectors `(n_vectors, parameters)` as a dict of batched parameters
+        Vs = V.split([p.numel() for p in params.values()], dim=1)
+        return {name: v.reshape(len(V), *p.shape) for v, (name, p) in zip(Vs, params.items())}
+
+    def matrix_vector_products(self, batch, V):
+        """Compute the products \\(H v\\) of the curvature of `batch` with the vectors `V`.
+
+        Parameters
+        ----------
+        batch : dict
+            input data and `labels` on compatible device with model.
+        V : torch.Tensor
+            vectors `(n_vectors, parameters)`
+
+        Returns
+        -------
+        loss : torch.Tensor
+        HV : torch.Tensor
+            products `(n_vectors, parameters)`
+        """
+        raise NotImplementedError
+
+    def eig_lowrank(self, data_loader, rank=10, oversampling=10, n_iter=5, tol=1e-3,
+                    init_vectors=None, shard=True, seed=0):
+        """Compute the top-`rank` eigendecomposition of the curvature of the data in
+        `data_loader` with randomized subspace iteration. Every iteration is one pass
+        over `data_loader` which accumulates the products of the curvature with an
+        orthonormal basis of `rank + oversampling` vectors via `matrix_vector_products`.
+        The Ritz values and vectors in the subspace are the estimate of the eigenpairs
+        and the next basis is that of the products. Only the basis and the products
+        are kept in memory, i.e., \\(O(kP)\\) for rank \\(k\\) and \\(P\\) parameters.
+
+        Parameters
+        ----------
+        data_loader : torch.data.utils.DataLoader
+            each iterate is a training batch with `labels`
+        rank : int, default=10
+            number of eigenpairs
+        oversampling : int, default=10
+            additional vectors of the subspace that speed up the convergence
+        n_iter : int, default=5
+            maximum number of passes over `data_loader`
+        tol : float, default=1e-3
+            stop when the relative change of the top eigenvalues is below `tol`
+        init_vectors : torch.Tensor, default=None
+            initial vectors of the subspace `(parameters, n_vectors)`, e.g., the
+            eigenvectors of an earlier call to restart from; random if None
+        shard : bool, default=True
+            in the distributed setting, process every `world_size`-th batch on each process
+            and sum the products across processes; see `laplace.utils.local_batches`.
+        seed : int, default=0
+            seed of the random initial vectors
+
+        Returns
+        -------
+        eigenvectors : torch.Tensor
+            `(parameters, rank)`, only those with eigenvalue larger than `EPS`
+        eigenvalues : torch.Tensor
+            `(rank)` in descending order
+        loss : torch.Tensor
+        """
+        distributed = is_distributed()
+        batch = next(iter(data_loader))
+        device = next(self.model.parameters()).device
+        _, params = self._functional_model({k: v.to(device) for k, v in batch.items()})
+        P = sum(p.numel() for p in params.values())
+        dtype = next(iter(params.values())).dtype
+        n_vectors = min(rank + oversampling, P)
+        generator = torch.Generator(device=device).manual_seed(seed)
+        Q = torch.randn(P, n_vectors, device=device, dtype=dtype, generator=generator)
+        if init_vectors is not None:
+            init_vectors = init_vectors[:, :n_vectors]
+            Q[:, :init_vectors.shape[1]] = init_vectors.to(Q)
+        Q = torch.linalg.qr(Q).Q
+
+        eigenvalues = None
+        for _ in range(n_iter):
+            loss, Y = 0., torch.zeros_like(Q)
+            for batch in local_batches(data_loader, shard):
+                batch = {k: v.to(device) for k, v in batch.items()}
+                loss_batch, HV = self.matrix_vector_products(batch, Q.T)
+                loss, Y = loss + loss_batch, Y + HV.T
+            if distributed:
+                loss = torch.as_tensor(loss, device=device, dtype=dtype)
+                all_reduce_tensors([loss, Y])
+            # Rayleigh-Ritz in the current subspace
+            T = Q.T @ Y
+            l, U = torch.linalg.eigh((T + T.T) / 2)
+            l, U = l.flip(0)[:rank], U.flip(1)[:, :rank]
+            converged = (eigenvalues is not None
+                         and bool(((l - eigenvalues).abs() <= tol * l.abs()).all()))
+            eigenvalues, eigenvectors = l, Q @ U
+            if converged:
+                break
+            Q = torch.linalg.qr(Y).Q
+
+        mask = eigenvalues > EPS
+        return eigenvectors[:, mask], eigenvalues[mask], loss
+
+    def close(self):
+        """Release the resources that are reused across batches, such as hooks
+        registered on the model. The interface can still be used afterwards and
+        acquires them again when needed.
+        """
+        pass
+
 
 class GGNInterface(CurvatureInterface):
     """Generalized Gauss-Newton or Fisher Curvature Interface.
@@ -247,6 +385,41 @@ class GGNInterface(CurvatureInterface):
 
         return loss, H_ggn
 
+    def matrix_vector_products(self, batch, V):
+        """Compute the GGN-vector products \\(J^T \\Lambda J v\\) for the vectors `V`
+        without the Jacobians \\(J\\): the Jacobian-vector products are forward-mode
+        JVPs and the products with \\(J^T\\) are VJPs, both vectorized over `V`.
+
+        Parameters
+        ----------
+        batch : dict
+            input data and `labels` on compatible device with model.
+        V : torch.Tensor
+            vectors `(n_vectors, parameters)`
+
+        Returns
+        -------
+        loss : torch.Tensor
+        HV : torch.Tensor
+            GGN-vector products `(n_vectors, parameters)`
+        """
+        if self.stochastic:
+            raise ValueError('Stochastic approximation not implemented for GGN-vector products.')
+        f, params = self._functional_model(batch)
+        tangents = self._unflatten(V, params)
+        out, vjp = torch.func.vjp(f, params)
+        JV = torch.func.vmap(lambda t: torch.func.jvp(f, (params,), (t,))[1])(tangents)
+        if self.likelihood == 'regression':
+            LJV = JV
+        else:
+            # second derivative of log lik is diag(p) - pp^T
+            ps = torch.softmax(out, dim=-1)
+            LJV = ps * JV - ps * (ps * JV).sum(-1, keepdim=True)
+        HV = torch.func.vmap(vjp)(LJV)[0]
+        HV = torch.cat([HV[name].reshape(len(V), -1) for name in params], dim=1)
+        loss = self.factor * self.lossfunc(out, batch['labels'])
+        return loss.detach(), HV.detach()
+
 
 class EFInterface(CurvatureInterface):
     """Interface for Empirical Fisher as Hessian approximation.
@@ -0,0 +1,101 @@
+import torch
+
+from laplace.curvature.asdl import AsdlGGN
+from laplace.utils import Kron, SketchedFactor, lora_linear_modules
+
+
+class LoraGGN(AsdlGGN):
+    """GGN backend with Kronecker factors that are aware of LoRA adapters.
+    For a `lora_A` module of shape `(r, d_in)` and a `lora_B` module of shape `(d_out, r)`,
+    the Kronecker factors on the side of the rank-r subspace are `r x r`, but the input
+    covariance of `lora_A` and the output-gradient covariance of `lora_B` are `d_in x d_in`
+    and `d_out x d_out`. These are accumulated as `SketchedFactor` of rank `sketch_rank`
+    such that the memory of the posterior scales like the adapters themselves.
+    The factors are computed with the forward hooks of `AsdlInterface` for both values
+    of `kfac_conv`, from the inputs and output gradients of the `torch.nn.Linear` modules.
+    The hooks are registered on the first call of `kron` and removed by `close`.
+    Modules that read the identical input tensor, e.g., the `lora_A` modules of the
+    query and value projections, share one input covariance factor.
+    All other curvatures are computed by `AsdlGGN`.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+    likelihood : {'classification', 'regression'}
+    last_layer : bool, default=False
+        only consider curvature of last layer, falls back to `AsdlGGN.kron`
+    subnetwork_indices : torch.Tensor, default=None
+    stochastic : bool, default=False
+        Monte Carlo approximation of the GGN with one sampled output per example
+    kfac_conv : {'kfac-expand', 'kfac-reduce'}, default='kfac-expand'
+        treat every token as a sample or aggregate over the tokens of each example
+    sketch_rank : int, default=64
+        rank of the sketches of large LoRA factors
+    max_dense_dim : int, default=None
+        also sketch the factors of other modules with a larger dimension
+    seed : int, default=0
+        seed of the test matrices, which need to agree across batches and processes;
+        factors of the same dimension share a test matrix
+    """
+    def __init__(self, model, likelihood, last_layer=False, subnetwork_indices=None, stochastic=False,
+                 kfac_conv='kfac-expand', sketch_rank=64, max_dense_dim=None, seed=0):
+        super().__init__(model, likelihood, last_layer, subnetwork_indices, stochastic,
+                         kfac_conv=kfac_conv)
+        self.sketch_rank = sketch_rank
+        self.max_dense_dim = max_dense_dim
+        self.seed = seed
+        self._roles = lora_linear_modules(model)
+        self._test_matrices = dict()
+
+    def _sketched(self, module, j):
+        dim = module.weight.shape[j]
+        if dim <= self.sketch_rank:
+            return False
+        role = self._roles.get(module)
+        if (role == 'A' and j == 1) or (role == 'B' and j == 0):
+            return True
+        return self.max_dense_dim is not None and dim > self.max_dense_dim
+
+    def _test_matrix(self, dim, device):
+        if dim not in self._test_matrices:
+            generator = torch.Generator(device=device).manual_seed(self.seed + dim)
+            Omega = torch.randn(dim, self.sketch_rank, device=device, generator=generator)
+            self._test_matrices[dim] = torch.linalg.qr(Omega).Q
+        return self._test_matrices[dim]
+
+    def _factor(self, i, j, X=None, device=None, dense=False):
+        module = self._kron_modules[i]
+        if dense or not self._sketched(module, j):
+            return super()._factor(i, j, X, device)
+        device = module.weight.device if device is None else device
+        Omega = self._test_matrix(module.weight.shape[j], device)
+        return SketchedFactor(Omega) if X is None else SketchedFactor.from_outer(Omega, X)
+
+    def init_kron(self, device):
+        """Zero Kronecker factors with the layout of `kron` to accumulate into.
+
+        Parameters
+        ----------
+        device : torch.device
+
+        Returns
+        -------
+        kron : Kron
+        """
+        if not self._hooks_supported:
+            return Kron.init_from_model(self.model, device)
+        kfacs = list()
+        for i, module in enumerate(self._kron_modules):
+            if module.weight.requires_grad:
+                kfacs.append([self._factor(i, 0, device=device), self._factor(i, 1, device=device)])
+            if module.bias is not None and module.bias.requires_grad:
+                kfacs.append([self._factor(i, 0, device=device, dense=True)])
+        return Kron(kfacs)
+
+    def kron(self, batch, N, kfac_conv=None, **kwargs):
+        if not self._hooks_supported:
+            return super().kron(batch, N, kfac_conv=kfac_conv, **kwargs)
+        kfac_conv = self.kfac_conv if kfac_conv is None else kfac_conv
+        self._check_kfac_conv(kfac_conv)
+        f, kron = self._hook_kron(batch, N, reduce=kfac_conv == 'kfac-reduce')
+        return self.factor * self.lossfunc(f, batch['labels']), kron, f
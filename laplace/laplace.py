@@ -1,4 +1,4 @@
-from laplace.baselaplace import ParametricLaplace
+from laplace.baselaplace import BaseLaplace
 from laplace.lllaplace import LLLaplace,KronLLLaplace,DiagLLLaplace ## FullLaplace missing here and in src files
 from laplace import *
 
@@ -13,18 +13,19 @@ def Laplace(model, likelihood, subset_of_weights='last_layer', hessian_structure
     likelihood : {'classification', 'regression'}
     subset_of_weights : {'last_layer', 'subnetwork', 'all'}, default='last_layer'
         subset of weights to consider for inference
-    hessian_structure : {'diag', 'kron', 'full', 'lowrank'}, default='kron'
-        structure of the Hessian approximation
+    hessian_structure : {'diag', 'kron', 'full', 'lowrank', 'gp', 'sod'}, default='kron'
+        structure of the Hessian approximation; 'gp' and 'sod' select the function-space
+        `FunctionalLaplace` and its subset-of-data variant `SoDLaplace`
 
     Returns
     -------
-    laplace : ParametricLaplace
-        chosen subclass of ParametricLaplace instantiated with additional arguments
+    laplace : BaseLaplace
+        chosen subclass of BaseLaplace instantiated with additional arguments
     """
     if subset_of_weights == 'subnetwork' and hessian_structure not in ['full', 'diag']:
         raise ValueError('Subnetwork Laplace requires a full or diagonal Hessian approximation!')
 
-    laplace_map = {subclass._key: subclass for subclass in _all_subclasses(ParametricLaplace)
+    laplace_map = {subclass._key: subclass for subclass in _all_subclasses(BaseLaplace)
                    if hasattr(subclass, '_key')}
     laplace_class = laplace_map[(subset_of_weights, hessian_structure)]
     return laplace_class(model, likelihood, *args, **kwargs)
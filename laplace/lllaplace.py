@@ -1,9 +1,9 @@
 from copy import deepcopy
 import torch
-from torch.nn.utils import parameters_to_vector, vector_to_parameters
+from torch.nn.utils import parameters_to_vector
 
 from laplace.baselaplace import ParametricLaplace, KronLaplace, DiagLaplace
-from laplace.utils import FeatureExtractor, Kron
+from laplace.utils import FeatureExtractor, FeatureCache, Kron, SampledLinears
 
 
 __all__ = ['LLLaplace', 'FullLLLaplace', 'KronLLLaplace', 'DiagLLLaplace']
@@ -56,10 +56,17 @@ class LLLaplace(ParametricLaplace):
     backend_kwargs : dict, default=None
         arguments passed to the backend on initialization, for example to
         set the number of MC samples for stochastic approximations.
+    feature_cache : laplace.utils.feature_cache.FeatureCache or str, default=None
+        cache of the last-layer features and the outputs, or the directory of a
+        memory-mapped one, used by `fit` and for the loaders from `cached_loader`;
+        entries of other checkpoints are detected by `model_fingerprint` and replaced
     """
+    # whether the 'glm' predictive uses `functional_variance_features`
+    _closed_form_variance = False
+
     def __init__(self, model, likelihood, sigma_noise=1., prior_precision=1.,
                  prior_mean=0., temperature=1., enable_backprop=False, backend=None, last_layer_name=None,
-                 backend_kwargs=None):
+                 backend_kwargs=None, feature_cache=None):
         self.H = None
         self.enable_backprop = enable_backprop
         print('INIT LLLaplace')
@@ -67,8 +74,10 @@ class LLLaplace(ParametricLaplace):
                          prior_mean=0., temperature=temperature,
                          backend=backend,
                          backend_kwargs=backend_kwargs)
+        if isinstance(feature_cache, str):
+            feature_cache = FeatureCache(feature_cache)
         self.model = FeatureExtractor(
-            deepcopy(model), last_layer_name=last_layer_name
+            deepcopy(model), last_layer_name=last_layer_name, feature_cache=feature_cache
         )
         if self.model.last_layer is None:
             self.mean = None
@@ -87,7 +96,7 @@ class LLLaplace(ParametricLaplace):
         self._backend_kwargs['last_layer'] = True
         self._last_layer_name = last_layer_name
 
-    def fit(self, train_loader, override=True):
+    def fit(self, train_loader, override=True, shard=True, split='train', **kwargs):
         """Fit the local Laplace approximation at the parameters of the model.
 
         Parameters
@@ -98,9 +107,16 @@ class LLLaplace(ParametricLaplace):
         override : bool, default=True
             whether to initialize H, loss, and n_data again; setting to False is useful for
             online learning settings to accumulate a sequential posterior approximation.
+        shard : bool, default=True
+            in the distributed setting, process every `world_size`-th batch on each process,
+            see `ParametricLaplace.fit`.
+        split : str, default='train'
+            split under which the features are cached if there is a `feature_cache`
         """
         if not override:
             raise ValueError('Last-layer Laplace approximations do not support `override=False`.')
+        if self.model.feature_cache is not None and not hasattr(train_loader, 'extractor'):
+            train_loader = self.cached_loader(train_loader, split)
 
         self.model.eval()
 
@@ -129,13 +145,18 @@ class LLLaplace(ParametricLaplace):
             self.prior_mean = self._prior_mean
             self._init_H()
 
-        super().fit(train_loader, override=override)
+        super().fit(train_loader, override=override, shard=shard, **kwargs)
         self.mean = parameters_to_vector(self.model.last_layer.parameters())
 
         if not self.enable_backprop:
             self.mean = self.mean.detach()
 
     def _glm_predictive_distribution(self, X, joint=False):
+        if self._closed_form_variance and not joint:
+            f_mu, phi = self.model.forward_with_features(**X)
+            f_var = self.functional_variance_features(phi)
+            return (f_mu.detach(), f_var.detach()) if not self.enable_backprop else (f_mu, f_var)
+
         Js, f_mu = self.backend.last_layer_jacobians(X)
 
         if joint:
@@ -146,14 +167,60 @@ class LLLaplace(ParametricLaplace):
 
         return (f_mu.detach(), f_var.detach()) if not self.enable_backprop else (f_mu, f_var)
 
-    def _nn_predictive_samples(self, X, n_samples=100):
+    def cached_loader(self, loader, split):
+        """Batches of `loader` whose last-layer features are cached under `split`, e.g.
+        for the predictive or `optimize_prior_precision` with `val_loader`, such that the
+        model is evaluated only once per example; see `FeatureExtractor.cached_loader`.
+
+        Parameters
+        ----------
+        loader : torch.utils.data.DataLoader
+        split : str
+
+        Returns
+        -------
+        loader : iterable
+        """
+        if self.model.feature_cache is None:
+            raise ValueError('Feature caching requires a `feature_cache`.')
+        return self.model.cached_loader(loader, split)
+
+    def functional_variance_features(self, phi):
+        """Compute the functional variance of the last layer directly from its inputs
+        `phi` instead of from the Jacobians, which are `(batch, outputs, parameters)`.
+        Only available if `_closed_form_variance` is set for the Hessian structure.
+
+        Parameters
+        ----------
+        phi : torch.Tensor
+            features of the penultimate layer `(batch, features)`
+
+        Returns
+        -------
+        f_var : torch.Tensor
+            output covariance `(batch, outputs, outputs)`
+        """
+        raise NotImplementedError
+
+    def _jvp_predictive_samples(self, X, n_samples=100, chunk_size=None):
+        # the model is linear in the parameters of the last layer such that only the
+        # last layer needs to be evaluated for the samples, on the features
+        _, phi = self.model.forward_with_features(**X)
+        params = dict(self.model.last_layer.named_parameters())
+        fs = self._linearized_samples(self.model.last_layer, params, (phi,), {}, n_samples, chunk_size)
+        return fs.detach() if not self.enable_backprop else fs
+
+    def _nn_predictive_samples(self, X, n_samples=100, chunk_size=None):
+        # the features are shared by all samples, only the last layer is evaluated per sample
+        _, phi = self.model.forward_with_features(**X)
+        engine = SampledLinears(self.model.last_layer, dict(self.model.last_layer.named_parameters()))
+        chunk_size = n_samples if chunk_size is None else chunk_size
         fs = list()
-        for sample in self.sample(n_samples):
-            vector_to_parameters(sample, self.model.last_layer.parameters())
-            f = self.model(X.to(self._device))
-            fs.append(f.detach() if not self.enable_backprop else f)
-        vector_to_parameters(self.mean, self.model.last_layer.parameters())
-        fs = torch.stack(fs)
+        for start in range(0, n_samples, chunk_size):
+            deltas = self.sample(min(chunk_size, n_samples - start)) - self.mean
+            fs.append(engine(deltas, phi))
+        fs = torch.cat(fs)
+        fs = fs.detach() if not self.enable_backprop else fs
         if self.likelihood == 'classification':
             fs = torch.softmax(fs, dim=-1)
         return fs
@@ -178,28 +245,21 @@ class LLLaplace(ParametricLaplace):
 
     def state_dict(self) -> dict:
         state_dict = super().state_dict()
-        state_dict['X'] = getattr(self, 'X', None)
-        state_dict['_last_layer_name'] = self._last_layer_name
+        state_dict['last_layer_name'] = self.model._last_layer_name
         return state_dict
 
     def load_state_dict(self, state_dict: dict):
-        if self._last_layer_name != state_dict['_last_layer_name']:
+        if self.model.last_layer is None:
+            self.model.set_last_layer(state_dict['last_layer_name'])
+        elif self.model._last_layer_name != state_dict['last_layer_name']:
             raise ValueError('Different `last_layer_name` detected!')
 
-        self.X = state_dict['X']
-        if self.X is not None:
-            with torch.no_grad():
-                try:
-                    self.model.find_last_layer(self.X[:1].to(self._device))
-                except (TypeError, AttributeError):
-                    self.model.find_last_layer(self.X.to(self._device))
-
-        super().load_state_dict(state_dict)
-
         params = parameters_to_vector(self.model.last_layer.parameters()).detach()
         self.n_params = len(params)
         self.n_layers = len(list(self.model.last_layer.parameters()))
 
+        super().load_state_dict(state_dict)
+
 
 #class FullLLLaplace(LLLaplace, FullLaplace):
     """Last-layer Laplace approximation with full, i.e., dense, log likelihood Hessian approximation
@@ -223,27 +283,46 @@ class KronLLLaplace(LLLaplace, KronLaplace):
     `KronDecomposed` is used to add the prior, a Hessian factor (e.g. temperature),
     and computing posterior covariances, marginal likelihood, etc.
     Use of `damping` is possible by initializing or setting `damping=True`.
+    The `'glm'` predictive is computed from the last-layer features, see
+    `KronDecomposed.inv_square_form_features`.
     """
     # key to map to correct subclass of BaseLaplace, (subset of weights, Hessian structure)
     _key = ('last_layer', 'kron')
+    _closed_form_variance = True
 
     def __init__(self, model, likelihood, sigma_noise=1., prior_precision=1.,
                  prior_mean=0., temperature=1., enable_backprop=False, backend=None, last_layer_name=None,
-                 damping=False, **backend_kwargs):
+                 damping=False, feature_cache=None, **backend_kwargs):
         self.damping = damping
         print('INIT KronLLLaplace')
         super().__init__(model, likelihood, sigma_noise, prior_precision,
-                         prior_mean, temperature, enable_backprop=False, backend=backend, last_layer_name=last_layer_name, **backend_kwargs)
+                         prior_mean, temperature, enable_backprop=False, backend=backend, last_layer_name=last_layer_name,
+                         feature_cache=feature_cache, **backend_kwargs)
 
     def _init_H(self):
         self.H = Kron.init_from_model(self.model.last_layer, self._device)
 
+    def functional_variance_features(self, phi):
+        return self.posterior_precision.inv_square_form_features(phi)
+
 
 class DiagLLLaplace(LLLaplace, DiagLaplace):
     """Last-layer Laplace approximation with diagonal log likelihood Hessian approximation
     and hence posterior precision.
     Mathematically, we have \\(P \\approx \\textrm{diag}(P)\\).
     See `DiagLaplace`, `LLLaplace`, and `BaseLaplace` for the full interface.
+    The `'glm'` predictive is computed from the last-layer features.
     """
     # key to map to correct subclass of BaseLaplace, (subset of weights, Hessian structure)
-    _key = ('last_layer', 'diag')
\ No newline at end of file
+    _key = ('last_layer', 'diag')
+    _closed_form_variance = True
+
+    def functional_variance_features(self, phi):
+        # posterior variances of the weight `(outputs, features)` and the bias `(outputs)`
+        n_outputs, n_features = self.model.last_layer.weight.shape
+        variance = self.posterior_variance
+        weight_variance = variance[:n_outputs * n_features].reshape(n_outputs, n_features)
+        f_var = phi.to(variance.dtype).square() @ weight_variance.T
+        if self.model.last_layer.bias is not None:
+            f_var = f_var + variance[n_outputs * n_features:]
+        return torch.diag_embed(f_var)
\ No newline at end of file
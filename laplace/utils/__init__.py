@@ -1,14 +1,24 @@
-from laplace.utils.utils import get_nll, validate, parameters_per_layer, invsqrt_precision, _is_batchnorm, _is_valid_scalar, kron, diagonal_add_scalar, symeig, block_diag, expand_prior_precision, normal_samples
+from laplace.utils.utils import get_nll, validate, parameters_per_layer, invsqrt_precision, _is_batchnorm, _is_valid_scalar, kron, diagonal_add_scalar, symeig, batched_symeig, block_diag, expand_prior_precision, normal_samples, mc_softmax_predictive
+from laplace.utils.feature_cache import FeatureCache, model_fingerprint
 from laplace.utils.feature_extractor import FeatureExtractor
-from laplace.utils.matrix import Kron, KronDecomposed
+from laplace.utils.jacobian_store import JacobianStore
+from laplace.utils.matrix import Kron, KronDecomposed, SketchedFactor
+from laplace.utils.lora import is_lora_layer, lora_linear_modules, SampledLinears
+from laplace.utils.serialization import save_tensors, load_tensors
+from laplace.utils.distributed import is_distributed, is_sharded, local_batches, all_reduce_tensors
 from laplace.utils.swag import fit_diagonal_swag_var
+from laplace.utils.subset import subset_loader, SubsetSelection, RandomSubsetSelection, MaxVarianceSubsetSelection
 from laplace.utils.subnetmask import SubnetMask, RandomSubnetMask, LargestMagnitudeSubnetMask, LargestVarianceDiagLaplaceSubnetMask, LargestVarianceSWAGSubnetMask, ParamNameSubnetMask, ModuleNameSubnetMask, LastLayerSubnetMask
 
 
 __all__ = ['get_nll', 'validate', 'parameters_per_layer', 'invsqrt_precision', 'kron',
-		   'diagonal_add_scalar', 'symeig', 'block_diag', 'expand_prior_precision',
-		   'FeatureExtractor',
-           'Kron', 'KronDecomposed',
+		   'diagonal_add_scalar', 'symeig', 'batched_symeig', 'block_diag', 'expand_prior_precision',
+		   'mc_softmax_predictive',
+		   'FeatureCache', 'model_fingerprint', 'FeatureExtractor', 'JacobianStore',
+           'Kron', 'KronDecomposed', 'SketchedFactor',
+		   'is_lora_layer', 'lora_linear_modules', 'SampledLinears',
+		   'save_tensors', 'load_tensors', 'is_distributed', 'is_sharded', 'local_batches', 'all_reduce_tensors',
 		   'fit_diagonal_swag_var',
+		   'subset_loader', 'SubsetSelection', 'RandomSubsetSelection', 'MaxVarianceSubsetSelection',
 		   'SubnetMask', 'RandomSubnetMask', 'LargestMagnitudeSubnetMask', 'LargestVarianceDiagLaplaceSubnetMask',
 		   'LargestVarianceSWAGSubnetMask', 'ParamNameSubnetMask', 'ModuleNameSubnetMask', 'LastLayerSubnetMask']
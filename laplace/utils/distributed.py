@@ -0,0 +1,91 @@
+from itertools import islice
+
+import torch
+import torch.distributed as dist
+from torch.utils.data.distributed import DistributedSampler
+
+
+__all__ = ['is_distributed', 'is_sharded', 'local_batches', 'all_reduce_tensors']
+
+# loaders, samplers, and datasets of `accelerate` that split the data across processes;
+# `accelerate` is not a dependency, so they are recognized by name
+_ACCELERATE_SHARDS = {'DataLoaderShard', 'DataLoaderDispatcher', 'BatchSamplerShard',
+                      'IterableDatasetShard'}
+
+
+def is_distributed():
+    """Whether a process group with more than one process is initialized."""
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def is_sharded(data_loader):
+    """Whether `data_loader` already yields a different share of the data on each process,
+    i.e., it samples with a `DistributedSampler` or was prepared by `accelerate`.
+
+    Parameters
+    ----------
+    data_loader : iterable
+
+    Returns
+    -------
+    sharded : bool
+    """
+    parts = [data_loader] + [getattr(data_loader, name, None)
+                             for name in ('sampler', 'batch_sampler', 'dataset')]
+    batch_sampler = getattr(data_loader, 'batch_sampler', None)
+    parts.append(getattr(batch_sampler, 'sampler', None))
+    if any(isinstance(part, DistributedSampler) for part in parts):
+        return True
+    return any(cls.__name__ in _ACCELERATE_SHARDS for part in parts for cls in type(part).__mro__)
+
+
+def local_batches(data_loader, shard=True):
+    """Batches of `data_loader` to process on this process. In the distributed setting
+    and if `shard` is set, every process takes every `world_size`-th batch, unless
+    `data_loader` is already sharded across processes, see `is_sharded`.
+
+    Parameters
+    ----------
+    data_loader : iterable
+    shard : bool, default=True
+
+    Returns
+    -------
+    batches : iterable
+    """
+    if not shard or not is_distributed() or is_sharded(data_loader):
+        return data_loader
+    return islice(data_loader, dist.get_rank(), None, dist.get_world_size())
+
+
+def all_reduce_tensors(tensors, bucket_size=2**26):
+    """Sum tensors in-place across all processes.
+    Tensors are flattened into buckets of up to `bucket_size` elements to reduce
+    the number of collective calls for many small tensors, such as Kronecker factors.
+
+    Parameters
+    ----------
+    tensors : list[torch.Tensor]
+        contiguous tensors, reduced in-place
+    bucket_size : int, default=2**26
+        maximum number of elements per bucket
+    """
+    def reduce_bucket(bucket):
+        if len(bucket) == 1:
+            dist.all_reduce(bucket[0])
+            return
+        flat = torch.cat([t.flatten() for t in bucket])
+        dist.all_reduce(flat)
+        for t, f in zip(bucket, flat.split([t.numel() for t in bucket])):
+            t.copy_(f.view_as(t))
+
+    bucket, n = list(), 0
+    for t in tensors:
+        if len(bucket) > 0 and (n + t.numel() > bucket_size or t.dtype != bucket[0].dtype
+                                or t.device != bucket[0].device):
+            reduce_bucket(bucket)
+            bucket, n = list(), 0
+        bucket.append(t)
+        n += t.numel()
+    if len(bucket) > 0:
+        reduce_bucket(bucket)
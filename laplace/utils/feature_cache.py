@@ -0,0 +1,178 @@
+import hashlib
+import json
+import math
+import os
+import torch
+import torch.nn as nn
+from typing import Optional, Tuple
+
+
+__all__ = ['FeatureCache', 'model_fingerprint']
+
+
+def model_fingerprint(model: nn.Module, n_values: int = 64) -> str:
+    """Fingerprint of the parameters of `model` from their names, shapes, and types and
+    `n_values` evenly spaced values of each, such that different checkpoints of the same
+    architecture are told apart without reading all of their parameters.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+    n_values : int, default=64
+        number of values per parameter that enter the fingerprint
+
+    Returns
+    -------
+    fingerprint : str
+    """
+    h = hashlib.sha1()
+    for name, param in model.named_parameters():
+        values = param.detach().reshape(-1)
+        values = values[::max(1, len(values) // n_values)][:n_values]
+        h.update(f'{name}{tuple(param.shape)}{param.dtype}'.encode())
+        h.update(values.double().cpu().numpy().tobytes())
+    return h.hexdigest()
+
+
+class FeatureCache:
+    """Cache of the features of the penultimate layer, i.e. the inputs of the last
+    layer, and of the outputs of the model per split of the data and index of the
+    example in its dataset.
+    Both do not change as long as the model is fixed, so that a last-layer Laplace
+    approximation only needs one forward pass through the model per example.
+    The outputs are cached as well since they are not necessarily the outputs of the
+    last layer, e.g., if a LoRA adapter is added to them.
+    Features and outputs are kept in memory or, if `directory` is given, in
+    memory-mapped files that persist across runs with the same checkpoint.
+    The files record the `fingerprint` of the model they were computed with, see
+    `set_fingerprint`, and are replaced when they are opened for another one.
+
+    Parameters
+    ----------
+    directory : str, default=None
+        directory of the memory-mapped files
+    """
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self.fingerprint = None
+        self._features = dict()
+        self._outputs = dict()
+        self._cached = dict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def set_fingerprint(self, fingerprint: Optional[str]):
+        """Set the fingerprint of the model whose features and outputs are cached, e.g.,
+        from `model_fingerprint`. If it changes, the features and outputs in memory are
+        dropped and files with another fingerprint are replaced when they are opened.
+
+        Parameters
+        ----------
+        fingerprint : str or None
+        """
+        if fingerprint != self.fingerprint:
+            self._features, self._outputs, self._cached = dict(), dict(), dict()
+            self.fingerprint = fingerprint
+
+    def _paths(self, split):
+        return {ext: os.path.join(self.directory, f'{split}.{ext}') for ext in ['json', 'bin', 'out', 'mask']}
+
+    def _open(self, split, n_examples=None, features=None, outputs=None):
+        # existing files are opened, new ones are created for the shapes of `features` and `outputs`
+        if split in self._features:
+            return True
+        if n_examples is not None:
+            meta = {'fingerprint': self.fingerprint, 'n_examples': n_examples, 'n_features': features.shape[-1],
+                    'dtype': str(features.dtype).replace('torch.', ''),
+                    'output_shape': list(outputs.shape[1:]),
+                    'output_dtype': str(outputs.dtype).replace('torch.', '')}
+        if self.directory is None:
+            if n_examples is None:
+                return False
+            self._features[split] = torch.zeros(n_examples, meta['n_features'], dtype=features.dtype)
+            self._outputs[split] = torch.zeros(n_examples, *meta['output_shape'], dtype=outputs.dtype)
+            self._cached[split] = torch.zeros(n_examples, dtype=torch.bool)
+            return True
+        paths = self._paths(split)
+        stored = None
+        if os.path.exists(paths['json']):
+            with open(paths['json']) as f:
+                stored = json.load(f)
+            if stored.get('fingerprint') != self.fingerprint:
+                # computed with another model, e.g., an earlier checkpoint
+                self.clear(split)
+                stored = None
+        if stored is not None:
+            meta = stored
+        elif n_examples is None:
+            return False
+        else:
+            with open(paths['json'], 'w') as f:
+                json.dump(meta, f)
+        n_examples, n_features, output_shape = meta['n_examples'], meta['n_features'], meta['output_shape']
+        self._features[split] = torch.from_file(
+            paths['bin'], shared=True, size=n_examples * n_features, dtype=getattr(torch, meta['dtype'])
+        ).view(n_examples, n_features)
+        self._outputs[split] = torch.from_file(
+            paths['out'], shared=True, size=n_examples * math.prod(output_shape),
+            dtype=getattr(torch, meta['output_dtype'])
+        ).view(n_examples, *output_shape)
+        self._cached[split] = torch.from_file(paths['mask'], shared=True, size=n_examples,
+                                              dtype=torch.bool)
+        return True
+
+    def get(self, split: str, indices: torch.Tensor) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """Cached features and outputs of the examples `indices` of `split`.
+
+        Parameters
+        ----------
+        split : str
+        indices : torch.Tensor
+            indices of the examples in their dataset `(batch)`
+
+        Returns
+        -------
+        features, outputs : Tuple[torch.Tensor, torch.Tensor] or None
+            `(batch, features)` and `(batch, outputs)` or None if any of the examples
+            is not cached
+        """
+        if not self._open(split) or not bool(self._cached[split][indices].all()):
+            return None
+        return self._features[split][indices], self._outputs[split][indices]
+
+    def put(self, split: str, indices: torch.Tensor, features: torch.Tensor, outputs: torch.Tensor,
+            n_examples: int):
+        """Store the features and outputs of the examples `indices` of `split`.
+
+        Parameters
+        ----------
+        split : str
+        indices : torch.Tensor
+            indices of the examples in their dataset `(batch)`
+        features : torch.Tensor
+            `(batch, features)`
+        outputs : torch.Tensor
+            `(batch, outputs)`
+        n_examples : int
+            number of examples in the dataset of `split`
+        """
+        features, outputs = features.detach().cpu(), outputs.detach().cpu()
+        self._open(split, n_examples, features, outputs)
+        self._features[split][indices] = features.to(self._features[split].dtype)
+        self._outputs[split][indices] = outputs.to(self._outputs[split].dtype)
+        self._cached[split][indices] = True
+
+    def clear(self, split: Optional[str] = None):
+        """Remove the features and outputs of `split` or of all splits, including their files."""
+        splits = set(self._features)
+        if self.directory is not None:
+            splits |= {name[:-len('.json')] for name in os.listdir(self.directory)
+                       if name.endswith('.json')}
+        for split in (splits if split is None else [split]):
+            self._features.pop(split, None)
+            self._outputs.pop(split, None)
+            self._cached.pop(split, None)
+            if self.directory is not None:
+                for path in self._paths(split).values():
+                    if os.path.exists(path):
+                        os.remove(path)
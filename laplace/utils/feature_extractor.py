@@ -2,6 +2,8 @@ import torch
 import torch.nn as nn
 from typing import Tuple, Callable, Optional
 
+from laplace.utils.feature_cache import FeatureCache, model_fingerprint
+
 
 __all__ = ['FeatureExtractor']
 
@@ -23,11 +25,18 @@ class FeatureExtractor(nn.Module):
     last_layer_name : str, default=None
         if the name of the last layer is already known, otherwise it will
         be determined automatically.
+    feature_cache : FeatureCache, default=None
+        cache of the features and outputs of batches from `cached_loader`, for which
+        the model is only evaluated once
     """
-    def __init__(self, model: nn.Module, last_layer_name: Optional[str] = None) -> None:
+    def __init__(self, model: nn.Module, last_layer_name: Optional[str] = None,
+                 feature_cache: Optional[FeatureCache] = None) -> None:
         super().__init__()
         self.model = model
         self._features = dict()
+        self.feature_cache = feature_cache
+        # split, example indices, and size of the dataset of the current batch
+        self._cache_keys = None
         if last_layer_name is None:
             self.last_layer = None
         else:
@@ -42,14 +51,47 @@ class FeatureExtractor(nn.Module):
         x : torch.Tensor
             one batch of data to use as input for the forward pass
         """
+        keys = self._cache_keys if self.feature_cache is not None else None
+        if keys is not None and self.last_layer is not None:
+            split, indices, _ = keys
+            cached = self.feature_cache.get(split, indices)
+            if cached is not None:
+                features, out = (t.to(self.last_layer.weight.device) for t in cached)
+                self._features[self._last_layer_name] = features
+                return out
         if self.last_layer is None:
             # if this is the first forward pass and last layer is unknown
             out = self.find_last_layer(**kwargs)
         else:
             # if last and penultimate layers are already known
             out = self.model(**kwargs)
+        if keys is not None:
+            split, indices, n_examples = keys
+            self.feature_cache.put(split, indices, self._features[self._last_layer_name], out, n_examples)
         return out
 
+    def cached_loader(self, loader, split: str):
+        """Iterate over `loader` such that the features and outputs of its batches are
+        cached under `split` and the indices of the examples in `loader.dataset`.
+        The batches are collated from the indices of `loader.batch_sampler`, which
+        also keeps the keys correct for shuffled loaders. Every pass checks the
+        cache against the fingerprint of the model, see `FeatureCache.set_fingerprint`.
+
+        Parameters
+        ----------
+        loader : torch.utils.data.DataLoader
+        split : str
+            name of the split of the data, e.g. `'train'`
+
+        Returns
+        -------
+        loader : iterable
+            iterable over the batches of `loader` with the attribute `dataset`
+        """
+        if getattr(loader, 'batch_sampler', None) is None:
+            raise ValueError('Feature caching requires a loader with a batch sampler.')
+        return _CachedLoader(self, loader, split)
+
     def forward_with_features(self, **kwargs) -> Tuple[torch.Tensor, torch.Tensor]:
         """Forward pass which returns the output of the penultimate layer along
         with the output of the last layer. If the last layer is not known yet,
@@ -142,3 +184,32 @@ class FeatureExtractor(nn.Module):
                 return out
 
         raise ValueError('Something went wrong (all modules have children).')
+
+
+class _CachedLoader:
+    # batches of a loader that set the keys of the feature cache while they are used
+    def __init__(self, extractor, loader, split):
+        self.extractor = extractor
+        self.loader = loader
+        self.split = split
+        self.dataset = loader.dataset
+        self.batch_size = loader.batch_size
+        # such that a batch sampler that is sharded across processes is recognized
+        self.batch_sampler = loader.batch_sampler
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        # features and outputs cached for other parameters of the model are not used
+        self.extractor.feature_cache.set_fingerprint(model_fingerprint(self.extractor.model))
+        keys = None
+        try:
+            for indices in self.batch_sampler:
+                batch = self.loader.collate_fn([self.dataset[i] for i in indices])
+                keys = (self.split, torch.as_tensor(indices), len(self.dataset))
+                self.extractor._cache_keys = keys
+                yield batch
+        finally:
+            if self.extractor._cache_keys is keys:
+                self.extractor._cache_keys = None
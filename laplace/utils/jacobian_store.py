@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import torch
+
+
+__all__ = ['JacobianStore']
+
+
+class JacobianStore:
+    """Chunked, preallocated on-disk store of per-example Jacobians.
+    Jacobians are written into memory-mapped files of `chunk_size` examples each
+    so that the host memory does not limit the number of stored examples.
+    Outputs and targets are small and kept in memory.
+    Minibatches are gathered directly from the memory-mapped chunks by index;
+    shuffling only permutes indices. They are returned in the type of the appended
+    Jacobians, e.g., to match a `torch.float64` or `torch.bfloat16` posterior.
+
+    Parameters
+    ----------
+    path : str, default=None
+        directory to store the chunks in; a temporary directory is used if `None`
+    dtype : torch.dtype, default=torch.float32
+        storage type of the Jacobians, `torch.float32` or `torch.float16`
+    chunk_size : int, default=1024
+        number of examples per chunk
+    """
+    _dtypes = {torch.float32: np.float32, torch.float16: np.float16}
+
+    def __init__(self, path=None, dtype=torch.float32, chunk_size=1024):
+        if dtype not in self._dtypes:
+            raise ValueError(f'Unsupported storage type {dtype}.')
+        self._tmpdir = tempfile.mkdtemp(dir=path, prefix='jacobians_')
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.shape = None
+        # type of the appended Jacobians, which `batches` casts back to
+        self.source_dtype = None
+        self._chunks = list()
+        self._f_mu = list()
+        self._targets = list()
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def _new_chunk(self):
+        filename = os.path.join(self._tmpdir, f'chunk_{len(self._chunks)}.npy')
+        chunk = np.lib.format.open_memmap(filename, mode='w+', dtype=self._dtypes[self.dtype],
+                                          shape=(self.chunk_size, *self.shape))
+        self._chunks.append(chunk)
+        return chunk
+
+    def append(self, Js, f_mu, targets):
+        """Append a batch of Jacobians with corresponding outputs and targets.
+
+        Parameters
+        ----------
+        Js : torch.Tensor
+            Jacobians `(batch, outputs, parameters)` or any other per-example tensor
+        f_mu : torch.Tensor
+            outputs `(batch, outputs)`
+        targets : torch.Tensor
+            targets `(batch)`
+        """
+        if self.shape is None:
+            self.shape = tuple(Js.shape[1:])
+            self.source_dtype = Js.dtype
+        elif tuple(Js.shape[1:]) != self.shape:
+            raise ValueError('All stored Jacobians need to have the same shape.')
+        Js = Js.detach().to(self.dtype).cpu().numpy()
+        i = 0
+        while i < len(Js):
+            offset = self._n % self.chunk_size
+            chunk = self._chunks[-1] if offset > 0 else self._new_chunk()
+            n = min(len(Js) - i, self.chunk_size - offset)
+            chunk[offset:offset+n] = Js[i:i+n]
+            i += n
+            self._n += n
+        self._f_mu.append(f_mu.detach().cpu())
+        self._targets.append(targets.detach().cpu())
+
+    def _gather(self, indices):
+        """Read the examples at the sorted `indices` into one array. Each run of
+        consecutive indices within a chunk is read with a slice of the memory map and
+        copied once into the preallocated result, so that the data is neither copied
+        by fancy indexing nor again by concatenation.
+        """
+        chunk_ids, offsets = np.divmod(indices, self.chunk_size)
+        breaks = np.flatnonzero((np.diff(indices) != 1) | (np.diff(chunk_ids) != 0)) + 1
+        starts, ends = np.r_[0, breaks], np.r_[breaks, len(indices)]
+        out = np.empty((len(indices), *self.shape), dtype=self._dtypes[self.dtype])
+        for start, end in zip(starts, ends):
+            offset = offsets[start]
+            out[start:end] = self._chunks[chunk_ids[start]][offset:offset+end-start]
+        return torch.from_numpy(out)
+
+    def batches(self, batch_size, shuffle=True, device=None, generator=None):
+        """Iterate over the stored examples in minibatches.
+
+        Parameters
+        ----------
+        batch_size : int
+        shuffle : bool, default=True
+            iterate in random order by permuting the indices
+        device : torch.device, default=None
+            device to move the minibatches to
+        generator : torch.Generator, default=None
+            random number generator for the permutation
+
+        Yields
+        ------
+        Js : torch.Tensor
+            Jacobians `(batch_size, outputs, parameters)` in the type of the appended ones
+        f_mu : torch.Tensor
+            outputs `(batch_size, outputs)`
+        targets : torch.Tensor
+            targets `(batch_size)`
+        """
+        f_mu, targets = torch.cat(self._f_mu), torch.cat(self._targets)
+        if shuffle:
+            indices = torch.randperm(self._n, generator=generator)
+        else:
+            indices = torch.arange(self._n)
+        for i in range(0, self._n, batch_size):
+            # sort within minibatch for sequential reads of the chunks
+            idx = indices[i:i+batch_size].sort().values
+            Js = self._gather(idx.numpy()).to(device=device, dtype=self.source_dtype)
+            yield Js, f_mu[idx].to(device), targets[idx].to(device)
+
+    def close(self):
+        """Release the memory maps and delete the stored chunks."""
+        self._chunks = list()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
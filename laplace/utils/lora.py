@@ -0,0 +1,143 @@
+import logging
+import torch
+from torch import nn
+
+try:
+    from peft.tuners.lora import LoraLayer
+except ModuleNotFoundError:
+    logging.info('peft not available, LoRA layers are recognized by their lora_A and lora_B modules.')
+    LoraLayer = None
+
+
+__all__ = ['is_lora_layer', 'lora_linear_modules', 'SampledLinears']
+
+
+def _linear_adapters(adapters):
+    # `lora_A`/`lora_B` are a `torch.nn.ModuleDict` per adapter name in peft
+    if isinstance(adapters, nn.Linear):
+        return [adapters]
+    if isinstance(adapters, nn.ModuleDict):
+        return [m for m in adapters.values() if isinstance(m, nn.Linear)]
+    return []
+
+
+def is_lora_layer(module):
+    """Whether `module` is a LoRA layer, i.e., a peft `LoraLayer` or a module with
+    `lora_A` and `lora_B` submodules such as the LoRA classification heads.
+
+    Parameters
+    ----------
+    module : torch.nn.Module
+
+    Returns
+    -------
+    is_lora : bool
+    """
+    if LoraLayer is not None and isinstance(module, LoraLayer):
+        return True
+    return (len(_linear_adapters(getattr(module, 'lora_A', None))) > 0
+            and len(_linear_adapters(getattr(module, 'lora_B', None))) > 0)
+
+
+def lora_linear_modules(model):
+    """Find the `torch.nn.Linear` modules of all LoRA adapters in `model`.
+    The `lora_A` modules project the inputs of a layer into the rank-r subspace and
+    the `lora_B` modules project back to the outputs of the layer.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+
+    Returns
+    -------
+    roles : dict[torch.nn.Module, str]
+        `'A'` or `'B'` for each `torch.nn.Linear` module of an adapter
+    """
+    roles = dict()
+    for module in model.modules():
+        if is_lora_layer(module):
+            for m in _linear_adapters(module.lora_A):
+                roles[m] = 'A'
+            for m in _linear_adapters(module.lora_B):
+                roles[m] = 'B'
+    return roles
+
+
+class SampledLinears:
+    """Forward pass of a model for several samples of the parameters `params` of its
+    `torch.nn.Linear` modules at once, without changing the parameters of the model.
+    The batch is repeated once per sample and forward hooks add the correction
+    \\(x (W_s - W)^T + b_s - b\\) of each sample \\(s\\) to the output of the modules.
+    Since the inputs of a module differ between samples after the first sampled module,
+    the base matmul is not shared: for LoRA layers, the frozen base layer is evaluated
+    on the repeated batch in one matmul of `n_samples` times the rows, while the
+    `lora_A` and `lora_B` modules add a batched low-rank correction. The memory of
+    the activations thus grows linearly with the number of samples.
+    The samples are assumed to be in the leading dimension of the repeated batch
+    throughout the model, i.e., the model treats the examples independently.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+    params : dict[str, torch.nn.Parameter]
+        parameters of `model` by name, in the order of the entries of the samples
+    """
+    def __init__(self, model, params):
+        modules = dict(model.named_modules())
+        self.model = model
+        self.params = params
+        self.targets = list()
+        for name in params:
+            module_name, _, attr = name.rpartition('.')
+            self.targets.append((modules[module_name], attr))
+        self._deltas = dict()
+        self._n_samples = None
+
+    @property
+    def supported(self):
+        return all(isinstance(m, nn.Linear) and attr in ['weight', 'bias'] for m, attr in self.targets)
+
+    def _hook(self, module, args, kwargs, output):
+        deltas = self._deltas.get(module)
+        if deltas is None:
+            return None
+        f = output.reshape(self._n_samples, -1, output.shape[-1])
+        if 'weight' in deltas:
+            x = args[0] if len(args) > 0 else kwargs['input']
+            x = x.reshape(self._n_samples, -1, x.shape[-1])
+            f = f.baddbmm(x, deltas['weight'].to(x.dtype).transpose(1, 2))
+        if 'bias' in deltas:
+            f = f + deltas['bias'].to(f.dtype).unsqueeze(1)
+        return f.reshape(output.shape)
+
+    def __call__(self, deltas, *args, **kwargs):
+        """Evaluate the model on the inputs `args` and `kwargs` for the parameters
+        `params + deltas`. Tensor inputs have the examples in their leading dimension.
+
+        Parameters
+        ----------
+        deltas : torch.Tensor
+            differences of the samples to the parameters `(n_samples, parameters)`
+
+        Returns
+        -------
+        f : torch.Tensor
+            outputs `(n_samples, batch, outputs)`
+        """
+        S = len(deltas)
+        sizes = [p.numel() for p in self.params.values()]
+        for (module, attr), delta in zip(self.targets, deltas.split(sizes, dim=1)):
+            self._deltas.setdefault(module, dict())[attr] = delta.reshape(S, *getattr(module, attr).shape)
+        self._n_samples = S
+        handles = [module.register_forward_hook(self._hook, with_kwargs=True) for module in self._deltas]
+
+        def repeat(v):
+            return v.repeat(S, *[1] * (v.ndim - 1)) if torch.is_tensor(v) and v.ndim > 0 else v
+
+        try:
+            f = self.model(*[repeat(v) for v in args], **{k: repeat(v) for k, v in kwargs.items()})
+        finally:
+            for handle in handles:
+                handle.remove()
+            self._deltas = dict()
+        return f.reshape(S, -1, *f.shape[1:])
@@ -1,12 +1,192 @@
+import logging
 from math import pow
 import torch
 import numpy as np
 from typing import Union
 
-from laplace.utils import _is_valid_scalar, symeig, kron, block_diag
+from laplace.utils import _is_valid_scalar, symeig, batched_symeig, kron, block_diag
 
 
-__all__ = ['Kron', 'KronDecomposed']
+__all__ = ['Kron', 'KronDecomposed', 'SketchedFactor']
+
+
+def _flatten_factors(factors, prefix):
+    return {f'{prefix}.{i}.{j}': F for i, Fs in enumerate(factors) for j, F in enumerate(Fs)}
+
+
+def _group_layers(factors):
+    """Group indices of layers by the shapes of their factors, in order of occurrence."""
+    groups = dict()
+    for i, Fs in enumerate(factors):
+        key = tuple((F.shape[0], getattr(F, 'rank', None)) for F in Fs)
+        groups.setdefault(key, list()).append(i)
+    return list(groups.values())
+
+
+def _dense(F):
+    return F.to_dense() if isinstance(F, SketchedFactor) else F
+
+
+def _equal(F, G):
+    if isinstance(F, SketchedFactor) and isinstance(G, SketchedFactor):
+        return (torch.equal(F.test_matrix, G.test_matrix) and torch.equal(F.sketch, G.sketch)
+                and torch.equal(F.trace, G.trace))
+    return torch.is_tensor(F) and torch.is_tensor(G) and F.shape == G.shape and torch.equal(F, G)
+
+
+def _unflatten_factor_dict(state_dict, prefix, name=None):
+    # keys `<prefix>.<i>.<j>` or `<prefix>.<i>.<name>.<j>` to `{i: {j: value}}`
+    factors = dict()
+    for key, value in state_dict.items():
+        parts = key.split('.')
+        if name is None and len(parts) == 3 and parts[0] == prefix:
+            i, j = int(parts[1]), int(parts[2])
+        elif name is not None and len(parts) == 4 and parts[0] == prefix and parts[2] == name:
+            i, j = int(parts[1]), int(parts[3])
+        else:
+            continue
+        factors.setdefault(i, dict())[j] = value
+    return factors
+
+
+def _unflatten_factors(state_dict, prefix, name=None):
+    factors = _unflatten_factor_dict(state_dict, prefix, name)
+    return [[factors[i][j] for j in sorted(factors[i])] for i in sorted(factors)]
+
+
+def _nystrom_eigh(Y, Omega, trace):
+    """Eigendecomposition of the Nyström approximations given by sketches `Y` `(n, d, k)`
+    of matrices with test matrices `Omega` `(n, d, k)` and their traces `(n,)`,
+    following the numerically stable variant of Tropp et al. (2017).
+    The mean of the remaining `d - k` eigenvalues is inferred from the trace.
+    """
+    dtype, (d, k) = Y.dtype, Y.shape[1:]
+    # shift by a multiple of the machine precision of the accumulated sketch
+    nu = d ** 0.5 * torch.finfo(dtype).eps * torch.linalg.matrix_norm(Y).double()
+    Y = Y.double() + nu.reshape(-1, 1, 1) * Omega.double()
+    C = Omega.double().mT @ Y
+    C = torch.linalg.cholesky(0.5 * (C + C.mT))
+    B = torch.linalg.solve_triangular(C, Y.mT, upper=False).mT
+    U, S, _ = torch.linalg.svd(B, full_matrices=False)
+    L = (S.square() - nu.unsqueeze(1)).clamp(min=0.0)
+    remainder = ((trace.double() - L.sum(1)) / (d - k)).clamp(min=0.0)
+    return L.to(dtype), U.to(dtype), remainder.to(dtype)
+
+
+class SketchedFactor:
+    """Randomized Nyström sketch of a symmetric positive semi-definite Kronecker factor
+    \\(H\\) that is too large to be stored densely, for example, the input covariance of
+    a `lora_A` module.
+    Only the sketch \\(Y = H \\Omega\\) with a fixed orthonormal test matrix
+    \\(\\Omega\\) and the trace of \\(H\\) are stored. Both are linear in \\(H\\) such
+    that sketches sharing the test matrix are added and scaled like dense factors.
+    After decomposition, the factor is represented by the top eigenpairs of the Nyström
+    approximation and the mean of the remaining eigenvalues.
+
+    Parameters
+    ----------
+    test_matrix : torch.Tensor
+        orthonormal test matrix `(dim, rank)` shared by all sketches of the factor
+    sketch : torch.Tensor, default=None
+        \\(H \\Omega\\) `(dim, rank)`, zero if None
+    trace : torch.Tensor, default=None
+        trace of \\(H\\), zero if None
+    """
+    def __init__(self, test_matrix, sketch=None, trace=None):
+        self.test_matrix = test_matrix
+        self.sketch = torch.zeros_like(test_matrix) if sketch is None else sketch
+        self.trace = test_matrix.new_zeros(()) if trace is None else trace
+
+    @classmethod
+    def from_outer(cls, test_matrix, X):
+        """Sketch of \\(X^T X\\) without computing the product.
+
+        Parameters
+        ----------
+        test_matrix : torch.Tensor
+            `(dim, rank)`
+        X : torch.Tensor
+            `(samples, dim)`
+
+        Returns
+        -------
+        sketch : SketchedFactor
+        """
+        X = X.to(test_matrix.dtype)
+        return cls(test_matrix, X.T @ (X @ test_matrix), X.square().sum())
+
+    @property
+    def shape(self) -> torch.Size:
+        return torch.Size([len(self), len(self)])
+
+    @property
+    def rank(self) -> int:
+        return self.test_matrix.shape[1]
+
+    def __len__(self) -> int:
+        return self.test_matrix.shape[0]
+
+    def _check(self, other):
+        if not isinstance(other, SketchedFactor) or other.test_matrix.shape != self.test_matrix.shape:
+            raise ValueError('Can only combine sketches with the same test matrix.')
+
+    def add(self, other, alpha: float = 1.):
+        self._check(other)
+        return SketchedFactor(self.test_matrix, self.sketch.add(other.sketch, alpha=alpha),
+                              self.trace.add(other.trace, alpha=alpha))
+
+    def add_(self, other, alpha: float = 1.):
+        self._check(other)
+        self.sketch.add_(other.sketch, alpha=alpha)
+        self.trace.add_(other.trace, alpha=alpha)
+        return self
+
+    def mul(self, scalar):
+        return SketchedFactor(self.test_matrix, self.sketch * scalar, self.trace * scalar)
+
+    def mul_(self, scalar):
+        self.sketch.mul_(scalar)
+        self.trace.mul_(scalar)
+        return self
+
+    def lerp_(self, other, weight: float):
+        self._check(other)
+        self.sketch.lerp_(other.sketch, weight)
+        self.trace.lerp_(other.trace, weight)
+        return self
+
+    def tensors(self):
+        """Tensors that are summed when factors are summed, e.g., across processes."""
+        return [self.sketch, self.trace]
+
+    def eigendecompose(self):
+        """Top eigenpairs of the Nyström approximation and the isotropic remainder.
+
+        Returns
+        -------
+        L : torch.Tensor
+            eigenvalues `(rank)`
+        W : torch.Tensor
+            eigenvectors `(dim, rank)`
+        remainder : torch.Tensor
+            mean of the remaining eigenvalues
+        """
+        L, W, remainder = _nystrom_eigh(self.sketch.unsqueeze(0), self.test_matrix.unsqueeze(0),
+                                        self.trace.unsqueeze(0))
+        return L[0], W[0], remainder[0]
+
+    def to_dense(self) -> torch.Tensor:
+        """Dense low-rank plus isotropic approximation of the factor.
+        Warning: this should only be used for testing purposes.
+        """
+        L, W, remainder = self.eigendecompose()
+        eye = torch.eye(len(self), device=W.device, dtype=W.dtype)
+        return (W * (L - remainder)) @ W.T + remainder * eye
+
+    __mul__ = mul
+    __rmul__ = mul
+    __iadd__ = add_
+    __imul__ = mul_
 
 
 class Kron:
@@ -15,6 +195,11 @@ class Kron:
     Each element in `kfacs` is either a tuple or single matrix.
     A tuple represents two Kronecker factors \\(Q\\), and \\(H\\) and a single element
     is just a full block Hessian approximation.
+    Kronecker factors that are too large to be stored densely can be given as
+    `SketchedFactor`.
+    Groups can share a Kronecker factor object, for example, the input covariance of
+    modules that read the same input. Shared factors are stored, updated, and
+    decomposed once.
 
     Parameters
     ----------
@@ -59,6 +244,86 @@ class Kron:
                     raise ValueError('Invalid parameter shape in network.')
         return cls(kfacs)
 
+    def state_dict(self) -> dict:
+        """Flat dictionary of the Kronecker factors with keys `kfacs.<group>.<factor>`.
+        Sketched factors are stored with keys `sketches.<group>.<name>.<factor>` for
+        the test matrix, sketch, and trace, and shared factors with keys
+        `links.<group>.<factor>` referring to the group and factor of their first occurrence.
+
+        Returns
+        -------
+        state_dict : dict[str, torch.Tensor]
+        """
+        state_dict, first = dict(), dict()
+        for i, Fs in enumerate(self.kfacs):
+            for j, F in enumerate(Fs):
+                if id(F) in first:  # shared factor stored as reference to its first occurrence
+                    state_dict[f'links.{i}.{j}'] = torch.tensor(first[id(F)])
+                    continue
+                first[id(F)] = (i, j)
+                if isinstance(F, SketchedFactor):
+                    state_dict[f'sketches.{i}.test_matrix.{j}'] = F.test_matrix
+                    state_dict[f'sketches.{i}.sketch.{j}'] = F.sketch
+                    state_dict[f'sketches.{i}.trace.{j}'] = F.trace
+                else:
+                    state_dict[f'kfacs.{i}.{j}'] = F
+        return state_dict
+
+    @classmethod
+    def from_state_dict(cls, state_dict: dict):
+        """Restore Kronecker factors from `state_dict()`.
+
+        Parameters
+        ----------
+        state_dict : dict[str, torch.Tensor]
+
+        Returns
+        -------
+        kron : Kron
+        """
+        factors = _unflatten_factor_dict(state_dict, 'kfacs')
+        sketches = [_unflatten_factor_dict(state_dict, 'sketches', name)
+                    for name in ['test_matrix', 'sketch', 'trace']]
+        for i, Omegas in sketches[0].items():
+            for j, Omega in Omegas.items():
+                factors.setdefault(i, dict())[j] = SketchedFactor(
+                    Omega, sketches[1][i][j], sketches[2][i][j])
+        for i, links in _unflatten_factor_dict(state_dict, 'links').items():
+            for j, link in links.items():
+                factors.setdefault(i, dict())[j] = factors[int(link[0])][int(link[1])]
+        return cls([[factors[i][j] for j in sorted(factors[i])] for i in sorted(factors)])
+
+    def unique_factors(self):
+        """Iterate over the Kronecker factors, shared factors only once.
+
+        Returns
+        -------
+        factors : Iterator[Tuple[Union[torch.Tensor, SketchedFactor], int]]
+            factor and the number of factors of its group
+        """
+        seen = set()
+        for F in self.kfacs:
+            for H in F:
+                if id(H) not in seen:
+                    seen.add(id(H))
+                    yield H, len(F)
+
+    def _paired_factors(self, other):
+        """Pairs of factors of `self` and `other` with each factor of `self` once.
+        Where `other` shares a factor between groups, the corresponding factors of
+        `self` are shared as well if they are equal, e.g., zero after initialization.
+        """
+        pairs, seen, shared = list(), set(), dict()
+        for Fi, Fj in zip(self.kfacs, other.kfacs):
+            for k, (Hi, Hj) in enumerate(zip(Fi, Fj)):
+                H = shared.setdefault((id(Hj), len(Fj), k), Hi)
+                if H is not Hi and _equal(H, Hi):
+                    Fi[k] = Hi = H
+                if id(Hi) not in seen:
+                    seen.add(id(Hi))
+                    pairs.append((Hi, Hj))
+        return pairs
+
     def __add__(self, other):
         """Add up Kronecker factors `self` and `other`.
 
@@ -72,8 +337,13 @@ class Kron:
         """
         if not isinstance(other, Kron):
             raise ValueError('Can only add Kron to Kron.')
-        kfacs = [[Hi.add(Hj) for Hi, Hj in zip(Fi, Fj)]
-                 for Fi, Fj in zip(self.kfacs, other.kfacs)]
+        sums = dict()
+        kfacs = list()
+        for Fi, Fj in zip(self.kfacs, other.kfacs):
+            for Hi, Hj in zip(Fi, Fj):
+                if (id(Hi), id(Hj)) not in sums:
+                    sums[(id(Hi), id(Hj))] = Hi.add(Hj)
+            kfacs.append([sums[(id(Hi), id(Hj))] for Hi, Hj in zip(Fi, Fj)])
         return Kron(kfacs)
 
     def __mul__(self, scalar: Union[float, torch.Tensor]):
@@ -93,33 +363,152 @@ class Kron:
             raise ValueError('Input not valid python or torch scalar.')
 
         # distribute factors evenly so that each group is multiplied by factor
-        kfacs = [[pow(scalar, 1/len(F)) * Hi for Hi in F] for F in self.kfacs]
+        products = dict()
+        for F in self.kfacs:
+            for H in F:
+                if (id(H), len(F)) not in products:
+                    products[(id(H), len(F))] = pow(scalar, 1/len(F)) * H
+        kfacs = [[products[(id(H), len(F))] for H in F] for F in self.kfacs]
         return Kron(kfacs)
 
+    def add_(self, other, alpha: float = 1.):
+        """Add Kronecker factors of `other`, scaled by `alpha`, to `self` in-place
+        so that no new factors are allocated.
+
+        Parameters
+        ----------
+        other : Kron
+        alpha : float, default=1
+
+        Returns
+        -------
+        kron : Kron
+            `self`
+        """
+        if not isinstance(other, Kron):
+            raise ValueError('Can only add Kron to Kron.')
+        for Hi, Hj in self._paired_factors(other):
+            Hi.add_(Hj, alpha=alpha)
+        return self
+
+    def mul_(self, scalar: Union[float, torch.Tensor]):
+        """Multiply all Kronecker factors by scalar in-place, see `__mul__`.
+
+        Parameters
+        ----------
+        scalar : float, torch.Tensor
+
+        Returns
+        -------
+        kron : Kron
+            `self`
+        """
+        if not _is_valid_scalar(scalar):
+            raise ValueError('Input not valid python or torch scalar.')
+        for H, n in self.unique_factors():
+            H.mul_(pow(scalar, 1/n))
+        return self
+
+    def update_mean_(self, other, n: int):
+        """Update a running mean of Kronecker factors in-place with the `n`-th
+        element `other`, i.e., `self += (other - self) / n`.
+        Useful to keep accumulated factors in the range of a single batch.
+
+        Parameters
+        ----------
+        other : Kron
+        n : int
+            number of elements in the mean including `other`
+
+        Returns
+        -------
+        kron : Kron
+            `self`
+        """
+        if not isinstance(other, Kron):
+            raise ValueError('Can only add Kron to Kron.')
+        for Hi, Hj in self._paired_factors(other):
+            Hi.lerp_(Hj, 1 / n)
+        return self
+
+    # in-place accumulation, e.g., `H += H_batch` during fitting
+    __iadd__ = add_
+    __imul__ = mul_
+
     def __len__(self):
         return len(self.kfacs)
 
-    def decompose(self, damping=False):
+    def decompose(self, damping=False, chunk_size=2**26, max_rank=None):
         """Eigendecompose Kronecker factors and turn into `KronDecomposed`.
+        Layers whose factors have the same shapes, e.g., LoRA layers, are decomposed
+        together with batched eigendecompositions.
+        Sketched factors are decomposed into the top eigenpairs of their Nyström
+        approximation and an isotropic remainder.
+        With `max_rank`, Kronecker factors of larger dimension are truncated to their top
+        `max_rank` eigenpairs and the mean of the remaining eigenvalues as isotropic
+        remainder. The relative error in Frobenius norm of each truncated factor is stored
+        in `truncation_errors` of the result, `nan` for sketched factors.
+
         Parameters
         ----------
         damping : bool
             use damping
+        chunk_size : int, default=2**26
+            maximum number of matrix elements decomposed in one batch
+        max_rank : int, default=None
+            number of eigenpairs kept per Kronecker factor, all if None; only applies to
+            groups of two Kronecker factors
 
         Returns
         -------
         kron_decomposed : KronDecomposed
         """
-        eigvecs, eigvals = list(), list()
-        for F in self.kfacs:
-            Qs, ls = list(), list()
-            for Hi in F:
-                l, Q = symeig(Hi)
-                Qs.append(Q)
-                ls.append(l)
-            eigvecs.append(Qs)
-            eigvals.append(ls)
-        return KronDecomposed(eigvecs, eigvals, damping=damping)
+        buckets = list()
+        errors = torch.zeros(len(self), 2)
+        for layers in _group_layers(self.kfacs):
+            eigvecs, eigvals, remainders, shared = list(), list(), list(), list()
+            for j, H in enumerate(self.kfacs[layers[0]]):
+                # factors shared by layers of the bucket are decomposed once
+                rows = dict()
+                index = [rows.setdefault(id(self.kfacs[k][j]), len(rows)) for k in layers]
+                Fs = list({id(self.kfacs[k][j]): self.kfacs[k][j] for k in layers}.values())
+                shared.append(None if len(Fs) == len(layers) else torch.tensor(index))
+                if isinstance(H, SketchedFactor):
+                    l, Q, r = _nystrom_eigh(torch.stack([F.sketch for F in Fs]),
+                                            torch.stack([F.test_matrix for F in Fs]),
+                                            torch.stack([F.trace for F in Fs]))
+                    eigvecs.append(Q)
+                    eigvals.append(l)
+                    remainders.append(r)
+                    errors[layers, j] = float('nan')
+                    continue
+                n, d = len(Fs), len(H)
+                truncate = max_rank is not None and len(self.kfacs[layers[0]]) == 2 and d > max_rank
+                rank = max_rank if truncate else d
+                Q, l, r = H.new_empty(n, d, rank), H.new_empty(n, rank), H.new_empty(n)
+                error = H.new_zeros(n)
+                step = max(1, chunk_size // (d * d))
+                for i in range(0, n, step):
+                    Hs = torch.stack(Fs[i:i+step])
+                    l_i, Q_i = batched_symeig(Hs)
+                    del Hs
+                    if truncate:  # eigenvalues in ascending order
+                        r[i:i+step] = l_i[:, :-rank].mean(1)
+                        e = (l_i[:, :-rank] - r[i:i+step].unsqueeze(1)).square().sum(1)
+                        error[i:i+step] = e / l_i.square().sum(1).clamp(min=torch.finfo(l_i.dtype).tiny)
+                        l_i, Q_i = l_i[:, -rank:], Q_i[:, :, -rank:]
+                    l[i:i+step], Q[i:i+step] = l_i, Q_i
+                errors[layers, j] = error.sqrt().cpu().to(errors.dtype)[index]
+                eigvecs.append(Q)
+                eigvals.append(l)
+                remainders.append(r if truncate else None)
+            buckets.append(_KronBucket(layers, eigvecs, eigvals, remainders, shared))
+        kron = KronDecomposed.from_buckets(buckets, len(self), damping=damping)
+        kron.truncation_errors = errors
+        if max_rank is not None:
+            logging.info(f'Largest relative truncation error of Kronecker factors: '
+                         f'{errors.nan_to_num().max().item():.3e}')
+        return kron
 
     def _bmm(self, W: torch.Tensor) -> torch.Tensor:
         """Implementation of `bmm` which casts the parameters to the right shape.
@@ -141,6 +530,7 @@ class Kron:
         cur_p = 0
         SW = list()
         for Fs in self.kfacs:
+            Fs = [_dense(F) for F in Fs]
             if len(Fs) == 1:
                 Q = Fs[0]
                 p = len(Q)
@@ -199,6 +589,7 @@ class Kron:
         """
         logdet = 0
         for F in self.kfacs:
+            F = [_dense(Hi) for Hi in F]
             if len(F) == 1:
                 logdet += F[0].logdet()
             else:  # len(F) == 2
@@ -216,6 +607,7 @@ class Kron:
         """
         diags = list()
         for F in self.kfacs:
+            F = [_dense(Hi) for Hi in F]
             if len(F) == 1:
                 diags.append(F[0].diagonal())
             else:
@@ -233,6 +625,7 @@ class Kron:
         """
         blocks = list()
         for F in self.kfacs:
+            F = [_dense(Hi) for Hi in F]
             if len(F) == 1:
                 blocks.append(F[0])
             else:
@@ -244,6 +637,59 @@ class Kron:
     __rmul__ = __mul__
 
 
+class _KronBucket:
+    """Eigendecompositions of the Kronecker factors of layers with equal shapes,
+    stacked along the first dimension.
+
+    Parameters
+    ----------
+    layers : list[int]
+        indices of the layers in the bucket
+    eigenvectors : list[torch.Tensor]
+        stacked eigenvectors `(len(layers), dim, dim)` per Kronecker factor
+    eigenvalues : list[torch.Tensor]
+        stacked eigenvalues `(len(layers), dim)` per Kronecker factor
+    remainders : list[Optional[torch.Tensor]], default=None
+        per Kronecker factor, None if the eigendecomposition is complete or the stacked
+        isotropic remainders `(len(layers),)` if only `rank` eigenpairs are kept, in which
+        case eigenvectors and eigenvalues have shapes `(len(layers), dim, rank)` and
+        `(len(layers), rank)`
+    shared : list[Optional[torch.Tensor]], default=None
+        per Kronecker factor, None if every layer has its own factor or the row of the
+        stacked eigendecompositions for each layer if layers share factors, in which case
+        only the distinct eigendecompositions are stacked
+    """
+    def __init__(self, layers, eigenvectors, eigenvalues, remainders=None, shared=None):
+        self.layers = list(layers)
+        device = eigenvalues[0].device
+        self.index = torch.tensor(self.layers, device=device)
+        self.eigenvectors = eigenvectors
+        self.eigenvalues = eigenvalues
+        self.remainders = [None] * len(eigenvalues) if remainders is None else remainders
+        self.shared = [None if s is None else s.to(device)
+                       for s in ([None] * len(eigenvalues) if shared is None else shared)]
+        # positions of the parameters of the bucket in the flattened parameters,
+        # see `KronDecomposed._columns`
+        self.columns = None
+
+    def __len__(self) -> int:
+        return len(self.layers)
+
+    @property
+    def n_params_per_layer(self) -> int:
+        return int(np.prod([Q.shape[1] for Q in self.eigenvectors]))
+
+    @property
+    def compressed(self) -> bool:
+        return any(r is not None for r in self.remainders)
+
+    def expanded(self, attr):
+        """Stacked `eigenvectors`, `eigenvalues`, or `remainders` per Kronecker factor
+        with one row per layer, i.e., with shared factors repeated."""
+        return [X if X is None or s is None else X.index_select(0, s)
+                for X, s in zip(getattr(self, attr), self.shared)]
+
+
 class KronDecomposed:
     """Decomposed Kronecker factored approximate curvature representation
     for a corresponding neural network.
@@ -252,6 +698,10 @@ class KronDecomposed:
     of inverses and log determinants.
     In contrast to `Kron`, we can add scalar or layerwise scalars but
     we cannot add other `Kron` or `KronDecomposed` anymore.
+    Layers whose Kronecker factors have the same shapes are stored in buckets
+    of stacked eigenvectors and eigenvalues.
+    Factors decomposed from a `SketchedFactor` are compressed, i.e., they only keep
+    the top eigenpairs and one isotropic remainder eigenvalue for the complement.
 
     Parameters
     ----------
@@ -267,9 +717,20 @@ class KronDecomposed:
     """
 
     def __init__(self, eigenvectors, eigenvalues, deltas=None, damping=False):
-        self.eigenvectors = eigenvectors
-        self.eigenvalues = eigenvalues
-        device = eigenvectors[0][0].device
+        buckets = [_KronBucket(layers,
+                               [torch.stack([eigenvectors[i][j] for i in layers])
+                                for j in range(len(eigenvalues[layers[0]]))],
+                               [torch.stack([eigenvalues[i][j] for i in layers])
+                                for j in range(len(eigenvalues[layers[0]]))])
+                   for layers in _group_layers(eigenvalues)]
+        self._init_buckets(buckets, len(eigenvalues), deltas, damping)
+
+    def _init_buckets(self, buckets, n_layers, deltas, damping):
+        self.buckets = buckets
+        self.n_layers = n_layers
+        # relative errors of truncated factors, see `Kron.decompose`
+        self.truncation_errors = None
+        device = buckets[0].eigenvalues[0].device
         if deltas is None:
             self.deltas = torch.zeros(len(self), device=device)
         else:
@@ -277,11 +738,126 @@ class KronDecomposed:
             self.deltas = deltas
         self.damping = damping
 
+    @classmethod
+    def from_buckets(cls, buckets, n_layers, deltas=None, damping=False):
+        """Create from buckets of stacked eigendecompositions, see `Kron.decompose`.
+
+        Parameters
+        ----------
+        buckets : list[_KronBucket]
+        n_layers : int
+        deltas : torch.Tensor, default=None
+        damping : bool, default=False
+
+        Returns
+        -------
+        kron : KronDecomposed
+        """
+        kron = cls.__new__(cls)
+        kron._init_buckets(buckets, n_layers, deltas, damping)
+        return kron
+
+    def _per_layer(self, attr):
+        per_layer = [None] * len(self)
+        for bucket in self.buckets:
+            for i, layer in enumerate(bucket.layers):
+                per_layer[layer] = [None if X is None else X[i if s is None else s[i]]
+                                    for X, s in zip(getattr(bucket, attr), bucket.shared)]
+        return per_layer
+
+    @property
+    def eigenvectors(self):
+        """Eigenvectors per layer as views into the buckets.
+
+        Returns
+        -------
+        eigenvectors : list[list[torch.Tensor]]
+        """
+        return self._per_layer('eigenvectors')
+
+    @property
+    def eigenvalues(self):
+        """Eigenvalues per layer as views into the buckets.
+
+        Returns
+        -------
+        eigenvalues : list[list[torch.Tensor]]
+        """
+        return self._per_layer('eigenvalues')
+
+    @property
+    def remainders(self):
+        """Isotropic remainders per layer, None for factors that are not compressed.
+
+        Returns
+        -------
+        remainders : list[list[Optional[torch.Tensor]]]
+        """
+        return self._per_layer('remainders')
+
+    @property
+    def compressed(self) -> bool:
+        """Whether any Kronecker factor is compressed."""
+        return any(bucket.compressed for bucket in self.buckets)
+
     def detach(self):
         self.deltas = self.deltas.detach()
     
         return self
 
+    def state_dict(self) -> dict:
+        """Flat dictionary of the eigendecomposition with keys
+        `buckets.<bucket>.layers`, `buckets.<bucket>.eigenvectors.<factor>`,
+        `buckets.<bucket>.eigenvalues.<factor>`, `n_layers`, `deltas`, and `damping`,
+        `buckets.<bucket>.remainders.<factor>` for compressed factors, and
+        `buckets.<bucket>.shared.<factor>` for factors shared by layers.
+
+        Returns
+        -------
+        state_dict : dict
+        """
+        state_dict = dict()
+        for i, bucket in enumerate(self.buckets):
+            state_dict[f'buckets.{i}.layers'] = bucket.index
+            for j, (Q, l) in enumerate(zip(bucket.eigenvectors, bucket.eigenvalues)):
+                state_dict[f'buckets.{i}.eigenvectors.{j}'] = Q
+                state_dict[f'buckets.{i}.eigenvalues.{j}'] = l
+                if bucket.remainders[j] is not None:
+                    state_dict[f'buckets.{i}.remainders.{j}'] = bucket.remainders[j]
+                if bucket.shared[j] is not None:
+                    state_dict[f'buckets.{i}.shared.{j}'] = bucket.shared[j]
+        state_dict['n_layers'] = len(self)
+        state_dict['deltas'] = self.deltas
+        state_dict['damping'] = self.damping
+        return state_dict
+
+    @classmethod
+    def from_state_dict(cls, state_dict: dict):
+        """Restore the eigendecomposition from `state_dict()`.
+
+        Parameters
+        ----------
+        state_dict : dict
+
+        Returns
+        -------
+        kron : KronDecomposed
+        """
+        if 'n_layers' not in state_dict:  # nested lists per layer
+            return cls(_unflatten_factors(state_dict, 'eigenvectors'),
+                       _unflatten_factors(state_dict, 'eigenvalues'),
+                       state_dict['deltas'], state_dict['damping'])
+        eigenvectors = _unflatten_factors(state_dict, 'buckets', 'eigenvectors')
+        eigenvalues = _unflatten_factors(state_dict, 'buckets', 'eigenvalues')
+        layers = [state_dict[f'buckets.{i}.layers'].tolist() for i in range(len(eigenvalues))]
+        remainders, shared = [[[state_dict.get(f'buckets.{i}.{name}.{j}') for j in range(len(ls))]
+                               for i, ls in enumerate(eigenvalues)]
+                              for name in ['remainders', 'shared']]
+        buckets = [_KronBucket(*args)
+                   for args in zip(layers, eigenvectors, eigenvalues, remainders, shared)]
+        return cls.from_buckets(buckets, state_dict['n_layers'], state_dict['deltas'],
+                                state_dict['damping'])
+
     def _check_deltas(self, deltas: torch.Tensor):
         if not isinstance(deltas, torch.Tensor):
             raise ValueError('Can only add torch.Tensor to KronDecomposed.')
@@ -306,7 +882,7 @@ class KronDecomposed:
         kron : KronDecomposed
         """
         self._check_deltas(deltas)
-        return KronDecomposed(self.eigenvectors, self.eigenvalues, self.deltas + deltas)
+        return KronDecomposed.from_buckets(self.buckets, len(self), self.deltas + deltas)
 
     def __mul__(self, scalar):
         """Multiply by a scalar by changing the eigenvalues.
@@ -323,11 +899,18 @@ class KronDecomposed:
         if not _is_valid_scalar(scalar):
             raise ValueError('Invalid argument, can only multiply Kron with scalar.')
 
-        eigenvalues = [[pow(scalar, 1/len(ls)) * l for l in ls] for ls in self.eigenvalues]
-        return KronDecomposed(self.eigenvectors, eigenvalues, self.deltas)
+        buckets = list()
+        for b in self.buckets:
+            factor = pow(scalar, 1/len(b.eigenvalues))
+            bucket = _KronBucket(b.layers, b.eigenvectors, [factor * l for l in b.eigenvalues],
+                                 [None if r is None else factor * r for r in b.remainders],
+                                 b.shared)
+            bucket.columns = b.columns
+            buckets.append(bucket)
+        return KronDecomposed.from_buckets(buckets, len(self), self.deltas)
 
     def __len__(self) -> int:
-        return len(self.eigenvalues)
+        return self.n_layers
 
     def logdet(self) -> torch.Tensor:
         """Compute log determinant of the Kronecker factors and sums them up.
@@ -340,22 +923,99 @@ class KronDecomposed:
         logdet : torch.Tensor
         """
         logdet = 0
-        for ls, delta in zip(self.eigenvalues, self.deltas):
-            if len(ls) == 1:  # not KFAC just full
-                logdet += torch.log(ls[0] + delta).sum()
-            elif len(ls) == 2:
-                l1, l2 = ls
-                if self.damping:
-                    l1d, l2d = l1 + torch.sqrt(delta), l2 + torch.sqrt(delta)
-                    logdet += torch.log(torch.ger(l1d, l2d)).sum()
-                else:
-                    logdet += torch.log(torch.ger(l1, l2) + delta).sum()
+        for bucket in self.buckets:
+            delta = self.deltas[bucket.index]
+            eigenvalues = bucket.expanded('eigenvalues')
+            if len(eigenvalues) == 1:  # not KFAC just full
+                logdet += torch.log(eigenvalues[0] + delta.unsqueeze(1)).sum()
+            elif len(eigenvalues) == 2:
+                (l1, m1), (l2, m2) = [self._spectrum(*args) for args in zip(
+                    bucket.eigenvectors, eigenvalues, bucket.expanded('remainders'))]
+                ls = self._kron_eigenvalues(l1, l2, delta)
+                logdet += (torch.log(ls) * torch.outer(m1, m2)).sum()
             else:
                 raise ValueError('Too many Kronecker factors. Something went wrong.')
         return logdet
 
+    @staticmethod
+    def _spectrum(Q, l, remainder):
+        # eigenvalues `(n, k)` of stacked factors and their multiplicities `(k)`; the remainder
+        # of a compressed factor is an eigenvalue for the complement of its eigenvectors
+        if remainder is None:
+            return l, l.new_ones(l.shape[1])
+        d, k = Q.shape[1:]
+        return (torch.cat([l, remainder.unsqueeze(1)], 1),
+                torch.cat([l.new_ones(k), l.new_full((1,), d - k)]))
+
+    def _pair_eigenvalues(self, l1, l2, delta, exponent: float = 1):
+        # eigenvalues of a Kronecker product from broadcastable eigenvalues of both
+        # factors and the prior `delta`
+        if self.damping:
+            delta_sqrt = torch.sqrt(delta)
+            return torch.pow((l1 + delta_sqrt) * (l2 + delta_sqrt), exponent)
+        return torch.pow(l1 * l2 + delta, exponent)
+
+    def _kron_eigenvalues(self, l1, l2, delta, exponent: float = 1):
+        # eigenvalues `(n, k1, k2)` of the Kronecker products of stacked factors with
+        # eigenvalues `(n, k1)` and `(n, k2)` and the prior `delta` `(n,)`
+        return self._pair_eigenvalues(l1.unsqueeze(2), l2.unsqueeze(1), delta.reshape(-1, 1, 1),
+                                      exponent)
+
+    def spectra(self):
+        """Eigenvalues of each group of Kronecker factors without `deltas` and their
+        multiplicities, which exceed one for the remainders of compressed factors.
+
+        Returns
+        -------
+        spectra : list[Tuple[torch.Tensor, torch.Tensor]]
+            eigenvalues and multiplicities per group of Kronecker factors
+        """
+        spectra = [None] * len(self)
+        for bucket in self.buckets:
+            parts = [self._spectrum(*args) for args in zip(
+                bucket.eigenvectors, bucket.expanded('eigenvalues'), bucket.expanded('remainders'))]
+            if len(parts) == 1:
+                l, m = parts[0]
+            else:
+                (l1, m1), (l2, m2) = parts
+                l = (l1.unsqueeze(2) * l2.unsqueeze(1)).flatten(1)
+                m = torch.outer(m1, m2).flatten()
+            for i, layer in enumerate(bucket.layers):
+                spectra[layer] = (l[i], m)
+        return spectra
+
+    def _columns(self, bucket):
+        """Positions of the parameters of `bucket` in the flattened parameters,
+        either a tuple `(start, stride)` if the layers are evenly spaced or an index tensor.
+        Computed once and shared by all `KronDecomposed` derived from the same buckets.
+        """
+        if bucket.columns is None:
+            sizes = [0] * len(self)
+            for b in self.buckets:
+                for layer in b.layers:
+                    sizes[layer] = b.n_params_per_layer
+            offsets = np.cumsum([0] + sizes)
+            p = bucket.n_params_per_layer
+            starts = [int(offsets[layer]) for layer in bucket.layers]
+            stride = starts[1] - starts[0] if len(starts) > 1 else p
+            if stride >= p and all(start == starts[0] + i * stride for i, start in enumerate(starts)):
+                bucket.columns = (starts[0], stride)
+            else:
+                bucket.columns = torch.cat([torch.arange(start, start + p) for start in starts])
+                bucket.columns = bucket.columns.to(bucket.index.device)
+        return bucket.columns
+
+    @staticmethod
+    def _strided_columns(W, columns, n, p):
+        # view on the columns of `n` evenly spaced layers of `p` parameters each in `W`
+        start, stride = columns
+        return W.as_strided((W.shape[0], n, p), (W.stride(0), stride, 1),
+                            W.storage_offset() + start)
+
     def _bmm(self, W: torch.Tensor, exponent: float = -1) -> torch.Tensor:
         """Implementation of `bmm`, i.e., `self ** exponent @ W`.
+        All layers of a bucket are gathered from `W` at once and multiplied with
+        batched matrix multiplications over the layers of the bucket.
 
         Parameters
         ----------
@@ -372,37 +1032,64 @@ class KronDecomposed:
         # self @ W[batch, k, params]
         assert len(W.size()) == 3
         B, K, P = W.size()
-        #print( 'W shape',W.shape)
-        W = W.reshape(B * K, P)
-        cur_p = 0
-        SW = list()
-        for ls, Qs, delta in zip(self.eigenvalues, self.eigenvectors, self.deltas):
-            #print('len ls',len(ls))
-            if len(ls) == 1:
-                Q, l, p = Qs[0], ls[0], len(ls[0])
-                ldelta_exp = torch.pow(l + delta, exponent).reshape(-1, 1)
-                W_p = W[:, cur_p:cur_p+p].T
-                SW.append((Q @ (ldelta_exp * (Q.T @ W_p))).T)
-                cur_p += p
-            elif len(ls) == 2:
-                Q1, Q2 = Qs
-                l1, l2 = ls
-                p = len(l1) * len(l2)
-                if self.damping:
-                    l1d, l2d = l1 + torch.sqrt(delta), l2 + torch.sqrt(delta)
-                    ldelta_exp = torch.pow(torch.ger(l1d, l2d), exponent).unsqueeze(0)
+        W = W.reshape(B * K, P).contiguous()
+        SW = torch.empty_like(W)
+        for bucket in self.buckets:
+            n, p = len(bucket), bucket.n_params_per_layer
+            columns = self._columns(bucket)
+            delta = self.deltas[bucket.index]
+            if isinstance(columns, tuple):
+                W_b = self._strided_columns(W, columns, n, p)
+            else:
+                W_b = W.index_select(1, columns)
+            if len(bucket.eigenvalues) == 1:
+                Q, l = bucket.expanded('eigenvectors')[0], bucket.expanded('eigenvalues')[0]
+                ldelta_exp = torch.pow(l + delta.unsqueeze(1), exponent)
+                W_b = torch.einsum('bni,nij->bnj', W_b.reshape(B * K, n, p), Q) * ldelta_exp
+                W_b = torch.einsum('bnj,nij->bni', W_b, Q)
+            elif len(bucket.eigenvalues) == 2:
+                Q1, Q2 = bucket.expanded('eigenvectors')
+                l1, l2 = bucket.expanded('eigenvalues')
+                p_in, p_out = Q1.shape[1], Q2.shape[1]
+                W_b = W_b.reshape(B * K, n, p_in, p_out)
+                if bucket.compressed:
+                    W_b = self._bmm_compressed(W_b, Q1, Q2, l1, l2, bucket.expanded('remainders'),
+                                               delta, exponent)
                 else:
-                    ldelta_exp = torch.pow(torch.ger(l1, l2) + delta, exponent).unsqueeze(0)
-                p_in, p_out = len(l1), len(l2)
-                W_p = W[:, cur_p:cur_p+p].reshape(B * K, p_in, p_out)
-                W_p = (Q1.T @ W_p @ Q2) * ldelta_exp
-                W_p = Q1 @ W_p @ Q2.T
-                SW.append(W_p.reshape(B * K, p_in * p_out))
-                cur_p += p
+                    ldelta_exp = self._kron_eigenvalues(l1, l2, delta, exponent)
+                    W_b = torch.einsum('nji,bnjk,nkl->bnil', Q1, W_b, Q2) * ldelta_exp
+                    W_b = torch.einsum('nij,bnjk,nlk->bnil', Q1, W_b, Q2)
             else:
                 raise AttributeError('Shape mismatch')
-        #print('SW shape', len(SW))
-        SW = torch.cat(SW, dim=1).reshape(B, K, P)
+            if isinstance(columns, tuple):
+                self._strided_columns(SW, columns, n, p).copy_(W_b.reshape(B * K, n, p))
+            else:
+                SW.index_copy_(1, columns, W_b.reshape(B * K, n * p))
+        return SW.reshape(B, K, P)
+
+    def _bmm_compressed(self, W, Q1, Q2, l1, l2, remainders, delta, exponent):
+        """`bmm` for a bucket with compressed factors and `W` `(batch, layers, p_in, p_out)`.
+        With \\(P_i^\\perp = I - Q_i Q_i^T\\), `W` is split into its components
+        \\(Q_1 Q_1^T W Q_2 Q_2^T\\), \\(Q_1 Q_1^T W P_2^\\perp\\), \\(P_1^\\perp W Q_2 Q_2^T\\),
+        and \\(P_1^\\perp W P_2^\\perp\\), which are eigenspaces of the Kronecker product
+        scaled by the eigenvalues or the remainders of the respective factors.
+        Components for the complement of a factor that is not compressed vanish.
+        """
+        r1, r2 = [None if r is None else r.unsqueeze(1) for r in remainders]
+        WQ2 = torch.einsum('bnij,njk->bnik', W, Q2)
+        M = torch.einsum('nji,bnjk->bnik', Q1, WQ2)
+        SW = torch.einsum('nij,bnjk,nlk->bnil', Q1, M * self._kron_eigenvalues(l1, l2, delta, exponent), Q2)
+        if r2 is not None:
+            Q1W = torch.einsum('nji,bnjk->bnik', Q1, W)
+            R = Q1W - torch.einsum('bnij,nkj->bnik', M, Q2)
+            SW += torch.einsum('nij,bnjk->bnik', Q1, R * self._kron_eigenvalues(l1, r2, delta, exponent))
+        if r1 is not None:
+            R = WQ2 - torch.einsum('nij,bnjk->bnik', Q1, M)
+            SW += torch.einsum('bnij,nkj->bnik', R * self._kron_eigenvalues(r1, l2, delta, exponent), Q2)
+        if r1 is not None and r2 is not None:
+            R = (W - torch.einsum('nij,bnjk->bnik', Q1, Q1W) - torch.einsum('bnij,nkj->bnik', WQ2, Q2)
+                 + torch.einsum('nij,bnjk,nlk->bnil', Q1, M, Q2))
+            SW += R * self._kron_eigenvalues(r1, r2, delta, exponent)
         return SW
 
     def inv_square_form(self, W: torch.Tensor) -> torch.Tensor:
@@ -410,6 +1097,221 @@ class KronDecomposed:
         SW = self._bmm(W, exponent=-1)
         return torch.bmm(W, SW.transpose(1, 2))
 
+    def inv_square_form_factors(self, factors) -> torch.Tensor:
+        """Compute `inv_square_form` one group of Kronecker factors at a time from
+        factored Jacobians so that the Jacobian of all parameters is never materialized.
+        For a group with two Kronecker factors, the Jacobian is either given as a
+        tuple `(G, A)` of output gradients `(batch, classes, tokens, p_in)` and inputs
+        `(batch, tokens, p_out)`, i.e. `G^T A` summed over tokens, or explicitly.
+        The factors are consumed one group at a time, so they can be generated lazily.
+
+        Parameters
+        ----------
+        factors : iterable
+            one element per group of Kronecker factors, either a tuple `(G, A)`
+            or the Jacobian of the group `(batch, classes, params of group)`
+
+        Returns
+        -------
+        f_var : torch.Tensor
+            result `(batch, classes, classes)`
+        """
+        factors = iter(factors)
+        f_var, n_groups = 0, 0
+        # factors last so that no factor is drawn once the groups are exhausted
+        for ls, Qs, rs, delta, F in zip(self.eigenvalues, self.eigenvectors,
+                                        self.remainders, self.deltas, factors):
+            n_groups += 1
+            if len(ls) == 1:
+                Q, l = Qs[0], ls[0]
+                ldelta_exp = torch.pow(l + delta, -1)
+                M = F.to(Q.dtype) @ Q
+                f_var += torch.einsum('nki,i,nli->nkl', M, ldelta_exp, M)
+            elif len(ls) == 2 and any(r is not None for r in rs):
+                grams, l1, l2 = self._square_form_components(F, Qs, ls, rs)
+                f_var += (grams * self._pair_eigenvalues(l1, l2, delta, -1)).sum(-1)
+            elif len(ls) == 2:
+                Q1, Q2 = Qs
+                l1, l2 = ls
+                ldelta_exp = self._pair_eigenvalues(l1.unsqueeze(1), l2.unsqueeze(0), delta, -1)
+                if isinstance(F, tuple):
+                    G, A = F
+                    M = torch.einsum('nkti,ntj->nkij', G.to(Q1.dtype) @ Q1, A.to(Q2.dtype) @ Q2)
+                else:
+                    B, K, _ = F.shape
+                    M = Q1.T @ F.to(Q1.dtype).reshape(B, K, len(l1), len(l2)) @ Q2
+                f_var += torch.einsum('nkij,ij,nlij->nkl', M, ldelta_exp, M)
+                del M
+            else:
+                raise AttributeError('Shape mismatch')
+            del F
+        if n_groups != len(self) or next(factors, None) is not None:
+            raise ValueError('Need one Jacobian factor per group of Kronecker factors.')
+        return f_var
+
+    def inv_square_form_features(self, phi) -> torch.Tensor:
+        """Compute `inv_square_form` of the Jacobians of a `torch.nn.Linear` layer with
+        inputs `phi`, e.g. the last layer, from `phi` alone. The Jacobian of the weight
+        `(classes, features)` is \\(I \\otimes \\phi^T\\) and the one of the bias is the identity,
+        so only the projections of `phi` onto the eigenvectors of the input factors are
+        needed and the Jacobians `(batch, classes, classes * features)` are never formed.
+        Groups with one Kronecker factor are treated as biases.
+
+        Parameters
+        ----------
+        phi : torch.Tensor
+            features `(batch, features)`
+
+        Returns
+        -------
+        f_var : torch.Tensor
+            result `(batch, classes, classes)`
+        """
+        f_var = 0
+        for ls, Qs, rs, delta in zip(self.eigenvalues, self.eigenvectors, self.remainders,
+                                     self.deltas):
+            if len(ls) == 1:
+                Q, l = Qs[0], ls[0]
+                f_var = f_var + (Q * torch.pow(l + delta, -1)) @ Q.T
+            elif len(ls) == 2:
+                (Q1, Q2), (l1, l2), (r1, r2) = Qs, ls, rs
+                x = phi.to(Q2.dtype)
+                C = (x @ Q2).square()
+                # weights of the eigenvectors of the output factor per example
+                w = C @ self._pair_eigenvalues(l1.unsqueeze(1), l2.unsqueeze(0), delta, -1).T
+                if r2 is not None:  # part of phi in the complement of Q2
+                    C_perp = x.square().sum(-1) - C.sum(-1)
+                    w = w + C_perp.unsqueeze(-1) * self._pair_eigenvalues(l1, r2, delta, -1)
+                f_var = f_var + torch.einsum('ki,ni,li->nkl', Q1, w, Q1)
+                if r1 is not None:  # complement of Q1 scaled per example
+                    w_perp = C @ self._pair_eigenvalues(r1, l2, delta, -1)
+                    if r2 is not None:
+                        w_perp = w_perp + C_perp * self._pair_eigenvalues(r1, r2, delta, -1)
+                    P_perp = torch.eye(len(Q1), device=Q1.device, dtype=Q1.dtype) - Q1 @ Q1.T
+                    f_var = f_var + w_perp.reshape(-1, 1, 1) * P_perp
+            else:
+                raise AttributeError('Shape mismatch')
+        return f_var
+
+    @staticmethod
+    def _square_form_components(F, Qs, ls, rs):
+        """Split the Jacobian `F` of a group of two Kronecker factors, given as in
+        `inv_square_form_factors`, into the eigenspaces of the Kronecker product.
+        With compressed factors, the eigenspaces include the complements of the
+        eigenvectors, on which the factors are scaled by their remainders.
+
+        Returns
+        -------
+        grams : torch.Tensor
+            Gram matrices of the projections of `F` `(batch, classes, classes, components)`
+        l1, l2 : torch.Tensor
+            eigenvalues of the first and second factor per component `(components)`
+        """
+        (Q1, Q2), (l1, l2), (r1, r2) = Qs, ls, rs
+        if isinstance(F, tuple):
+            G, A = F
+            G, A = G.to(Q1.dtype), A.to(Q2.dtype)
+            GQ, AQ = G @ Q1, A @ Q2
+            M = torch.einsum('nkti,ntj->nkij', GQ, AQ)
+        else:
+            B, K, _ = F.shape
+            J = F.to(Q1.dtype).reshape(B, K, len(Q1), len(Q2))
+            M = Q1.T @ J @ Q2
+        MM = M.unsqueeze(2) * M.unsqueeze(1)
+        grams = [MM.flatten(3)]
+        e1, e2 = [l1.repeat_interleave(len(l2))], [l2.repeat(len(l1))]
+        if isinstance(F, tuple) and r1 is not None:
+            GG = torch.einsum('nkti,nlsi->nklts', G, G)
+        if isinstance(F, tuple) and r2 is not None:
+            AA = A @ A.mT
+        if r2 is not None:  # Q1^T F P2^perp per eigenvector of the first factor
+            if isinstance(F, tuple):
+                C2 = torch.einsum('nkti,nts,nlsi->nkli', GQ, AA, GQ)
+            else:
+                Q1J = Q1.T @ J
+                C2 = torch.einsum('nkip,nlip->nkli', Q1J, Q1J)
+            grams.append(C2 - MM.sum(-1))
+            e1.append(l1)
+            e2.append(r2.expand(len(l1)))
+        if r1 is not None:  # P1^perp F Q2 per eigenvector of the second factor
+            if isinstance(F, tuple):
+                C1 = torch.einsum('nklts,ntj,nsj->nklj', GG, AQ, AQ)
+            else:
+                JQ2 = J @ Q2
+                C1 = torch.einsum('nkpj,nlpj->nklj', JQ2, JQ2)
+            grams.append(C1 - MM.sum(-2))
+            e1.append(r1.expand(len(l2)))
+            e2.append(l2)
+        if r1 is not None and r2 is not None:  # P1^perp F P2^perp
+            if isinstance(F, tuple):
+                C = torch.einsum('nklts,nts->nkl', GG, AA)
+            else:
+                C = torch.einsum('nkij,nlij->nkl', J, J)
+            grams.append((C - C2.sum(-1) - C1.sum(-1) + MM.sum((-2, -1))).unsqueeze(-1))
+            e1.append(r1.reshape(1))
+            e2.append(r2.reshape(1))
+        return torch.cat(grams, -1), torch.cat(e1), torch.cat(e2)
+
+    def square_form_groups(self, W: torch.Tensor, n_groups: int = 32):
+        """Precompute statistics of `W` from which `inv_square_form(W)` can be evaluated
+        for any `deltas` at a cost independent of the number of parameters.
+        `W` is projected onto the eigenbasis of each layer once, and the outer products
+        of the projections are summed over `n_groups` log-spaced groups of eigenvalues
+        per layer. Each group is represented by the mean of its eigenvalues weighted by
+        the squared projections, so that
+        `inv_square_form(W) ~= (S / (lambdas + deltas[layers])).sum(-1)`.
+        Only supported without damping, where deltas enter the eigenvalues additively.
+
+        Parameters
+        ----------
+        W : torch.Tensor
+            matrix `(batch, classes, params)`
+        n_groups : int, default=32
+            number of groups of eigenvalues per layer
+
+        Returns
+        -------
+        S : torch.Tensor
+            summed outer products `(batch, classes, classes, layers * n_groups)`
+        lambdas : torch.Tensor
+            representative eigenvalue per group `(batch, layers * n_groups)`
+        layers : torch.Tensor
+            layer index of each group `(layers * n_groups)`
+        """
+        if self.damping:
+            raise ValueError('Grouping of eigenvalues not supported with damping.')
+        B, K, P = W.size()
+        S = W.new_zeros(B, K, K, len(self) * n_groups)
+        weights = W.new_zeros(B, len(self) * n_groups)
+        lambdas = W.new_zeros(B, len(self) * n_groups)
+        cur_p = 0
+        for i, (ls, Qs, rs) in enumerate(zip(self.eigenvalues, self.eigenvectors, self.remainders)):
+            if len(ls) == 1:
+                Q, l = Qs[0], ls[0]
+                p = len(l)
+                M = W[:, :, cur_p:cur_p+p] @ Q
+                grams = M.unsqueeze(2) * M.unsqueeze(1)
+            elif len(ls) == 2:
+                Q1, Q2 = Qs
+                p = len(Q1) * len(Q2)
+                grams, l1, l2 = self._square_form_components(W[:, :, cur_p:cur_p+p], Qs, ls, rs)
+                l = l1 * l2
+            else:
+                raise AttributeError('Shape mismatch')
+            cur_p += p
+            # log-spaced groups spanning eight orders of magnitude below the largest eigenvalue
+            l_max = l.max().clamp(min=torch.finfo(l.dtype).tiny)
+            log_rel = torch.log10(l.clamp(min=l_max * 1e-8) / l_max)
+            groups = ((log_rel + 8) / 8 * (n_groups - 1)).round().long() + i * n_groups
+            w = grams.diagonal(dim1=1, dim2=2).sum(-1)
+            S.index_add_(3, groups, grams)
+            weights.index_add_(1, groups, w)
+            lambdas.index_add_(1, groups, w * l)
+            del grams
+        lambdas = torch.where(weights > 0, lambdas / weights.clamp(min=torch.finfo(W.dtype).tiny), 1.)
+        layers = torch.arange(len(self), device=W.device).repeat_interleave(n_groups)
+        return S, lambdas, layers
+
     def bmm(self, W: torch.Tensor, exponent: float = -1) -> torch.Tensor:
         """Batched matrix multiplication with the decomposed Kronecker factors.
         This is useful for computing the predictive or a regularization loss.
@@ -447,7 +1349,11 @@ class KronDecomposed:
         block_diag : torch.Tensor
         """
         blocks = list()
-        for Qs, ls, delta in zip(self.eigenvectors, self.eigenvalues, self.deltas):
+        for Qs, ls, rs, delta in zip(self.eigenvectors, self.eigenvalues, self.remainders, self.deltas):
+            # complete the eigenbases of compressed factors
+            ls, Qs = zip(*[(l, Q) if r is None else symeig(
+                (Q * (l - r)) @ Q.T + r * torch.eye(len(Q), device=Q.device, dtype=Q.dtype))
+                for Q, l, r in zip(Qs, ls, rs)])
             if len(ls) == 1:
                 Q, l = Qs[0], ls[0]
                 blocks.append(Q @ torch.diag(torch.pow(l + delta, exponent)) @ Q.T)
@@ -0,0 +1,77 @@
+import json
+import logging
+import torch
+
+try:
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+except ModuleNotFoundError:
+    logging.info('safetensors not available, tensors are serialized with torch.save.')
+    safe_open = save_file = None
+
+
+__all__ = ['save_tensors', 'load_tensors']
+
+
+# incremented whenever the layout of saved Laplace approximations changes
+FORMAT_VERSION = 2
+
+
+def save_tensors(path, state_dict):
+    """Save a flat dictionary of tensors and JSON-serializable values.
+    Tensors are written in the safetensors format if available, otherwise with
+    `torch.save`; all other values are stored as metadata.
+
+    Parameters
+    ----------
+    path : str
+    state_dict : dict[str, Union[torch.Tensor, int, float, bool, str, None]]
+    """
+    tensors, storages = dict(), set()
+    for k, v in state_dict.items():
+        if torch.is_tensor(v):
+            v = v.detach().contiguous()
+            # safetensors does not support tensors sharing memory
+            if v.untyped_storage().data_ptr() in storages:
+                v = v.clone()
+            storages.add(v.untyped_storage().data_ptr())
+            tensors[k] = v
+    metadata = {k: v for k, v in state_dict.items() if not torch.is_tensor(v)}
+    metadata['format_version'] = FORMAT_VERSION
+    if save_file is not None:
+        save_file(tensors, path, metadata={'laplace': json.dumps(metadata)})
+    else:
+        torch.save({'tensors': tensors, 'metadata': metadata}, path)
+
+
+def load_tensors(path, device='cpu', mmap=True):
+    """Load a dictionary saved with `save_tensors`.
+
+    Parameters
+    ----------
+    path : str
+    device : torch.device or str, default='cpu'
+        device to load the tensors to
+    mmap : bool, default=True
+        memory-map files written by `torch.save` instead of reading them into memory;
+        safetensors files are always memory-mapped
+
+    Returns
+    -------
+    state_dict : dict
+    """
+    with open(path, 'rb') as f:
+        is_zip = f.read(4) == b'PK\x03\x04'
+    if is_zip:  # torch.save
+        saved = torch.load(path, map_location=device, mmap=mmap)
+        state_dict, metadata = saved['tensors'], saved['metadata']
+    else:
+        if safe_open is None:
+            raise ValueError(f'{path} is a safetensors file but safetensors is not installed.')
+        with safe_open(path, framework='pt', device=str(device)) as f:
+            metadata = json.loads(f.metadata()['laplace'])
+            state_dict = {k: f.get_tensor(k) for k in f.keys()}
+    if metadata['format_version'] > FORMAT_VERSION:
+        raise ValueError(f'Unsupported format version {metadata["format_version"]}.')
+    state_dict.update(metadata)
+    return state_dict
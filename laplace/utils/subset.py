@@ -0,0 +1,126 @@
+import torch
+from torch.utils.data import DataLoader, Subset
+
+
+__all__ = ['subset_loader', 'SubsetSelection', 'RandomSubsetSelection', 'MaxVarianceSubsetSelection']
+
+
+def subset_loader(loader, indices):
+    """Loader over the examples `indices` of `loader.dataset` in the given order,
+    with the batch size and collate function of `loader`.
+
+    Parameters
+    ----------
+    loader : torch.utils.data.DataLoader
+    indices : torch.LongTensor
+
+    Returns
+    -------
+    loader : torch.utils.data.DataLoader
+    """
+    return DataLoader(Subset(loader.dataset, indices.tolist()), batch_size=loader.batch_size or 1,
+                      shuffle=False, collate_fn=loader.collate_fn)
+
+
+class SubsetSelection:
+    """Baseclass for the selection of a subset of the training data (for subset-of-data
+    Laplace). Subclasses implement `select`.
+
+    Parameters
+    ----------
+    n_subset : int
+        number of examples in the subset
+    seed : int, default=0
+    """
+    def __init__(self, n_subset, seed=0):
+        self.n_subset = n_subset
+        self.seed = seed
+
+    def select(self, laplace, train_loader):
+        """Select the subset.
+
+        Parameters
+        ----------
+        laplace : laplace.baselaplace.FunctionalLaplace
+            Laplace approximation whose model, backend, and prior are used, if needed
+        train_loader : torch.data.utils.DataLoader
+            each iterate is a training batch with `labels`
+
+        Returns
+        -------
+        indices : torch.LongTensor
+            sorted indices of the examples in `train_loader.dataset`
+        """
+        raise NotImplementedError
+
+
+class RandomSubsetSelection(SubsetSelection):
+    """Subset of examples drawn uniformly at random without replacement."""
+    def select(self, laplace, train_loader):
+        generator = torch.Generator().manual_seed(self.seed)
+        N = len(train_loader.dataset)
+        return torch.randperm(N, generator=generator)[:self.n_subset].sort().values
+
+
+class MaxVarianceSubsetSelection(SubsetSelection):
+    """Greedy selection of the examples with the largest prior variance of the outputs
+    given the examples selected so far, i.e., a pivoted Cholesky decomposition of the
+    neural tangent kernel \\(\\mathcal{J}(x) P_0^{-1} \\mathcal{J}(x')^T\\) in blocks of
+    the outputs of one example.
+    The kernel of `n_candidates` random candidates is approximated with a count sketch
+    of the prior-scaled Jacobians of dimension `sketch_dim`, so that the Jacobians are
+    only computed once and never stored. Once the sketch cannot explain more variance,
+    which happens after about `sketch_dim / outputs` selections, the remaining examples
+    are drawn at random from the candidates.
+
+    Parameters
+    ----------
+    n_subset : int
+    n_candidates : int, default=None
+        number of random candidates, `4 * n_subset` if None
+    sketch_dim : int, default=2048
+    seed : int, default=0
+    """
+    def __init__(self, n_subset, n_candidates=None, sketch_dim=2048, seed=0):
+        super().__init__(n_subset, seed)
+        self.n_candidates = 4 * n_subset if n_candidates is None else n_candidates
+        self.sketch_dim = sketch_dim
+
+    def _sketch(self, laplace, loader, generator):
+        prior_scale = laplace.prior_precision_diag.rsqrt()
+        P = len(prior_scale)
+        buckets = torch.randint(self.sketch_dim, (P,), generator=generator).to(laplace._device)
+        signs = torch.randint(2, (P,), generator=generator).to(laplace._device) * 2 - 1
+        scale = signs * prior_scale
+        features = list()
+        for batch in loader:
+            batch = {k: v.to(laplace._device) for k, v in batch.items()}
+            Js, _ = laplace.backend.jacobians(batch)
+            Phi = torch.zeros(*Js.shape[:2], self.sketch_dim, device=Js.device, dtype=Js.dtype)
+            features.append(Phi.index_add_(2, buckets, Js.detach() * scale))
+        return torch.cat(features)
+
+    def select(self, laplace, train_loader):
+        generator = torch.Generator().manual_seed(self.seed)
+        N = len(train_loader.dataset)
+        candidates = torch.randperm(N, generator=generator)[:self.n_candidates]
+        n_subset = min(self.n_subset, len(candidates))
+        # residuals of the sketched features after projecting out the selected examples
+        R = self._sketch(laplace, subset_loader(train_loader, candidates), generator)
+        variances = R.square().sum(dim=(1, 2))
+        eps = 1e-6 * variances.max()
+        selected = torch.zeros(len(candidates), dtype=torch.bool)
+        for _ in range(n_subset):
+            variances[selected.to(variances.device)] = -float('inf')
+            i = int(variances.argmax())
+            if variances[i] <= eps:
+                break
+            selected[i] = True
+            Q = torch.linalg.qr(R[i].T).Q
+            R = R - (R @ Q) @ Q.T
+            variances = R.square().sum(dim=(1, 2))
+        n_random = n_subset - int(selected.sum())
+        if n_random > 0:
+            rest = (~selected).nonzero().squeeze(1)
+            selected[rest[torch.randperm(len(rest), generator=generator)[:n_random]]] = True
+        return candidates[selected].sort().values
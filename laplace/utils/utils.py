@@ -3,13 +3,16 @@ from typing import Union
 import numpy as np
 import torch
 import torch.nn.functional as F
+import torch.utils.checkpoint
 from torch.nn.utils import parameters_to_vector
+from torch.quasirandom import SobolEngine
 from torch.nn import BatchNorm1d, BatchNorm2d, BatchNorm3d
 from torch.distributions.multivariate_normal import _precision_to_scale_tril
 
 
 __all__ = ['get_nll', 'validate', 'parameters_per_layer', 'invsqrt_precision', 'kron',
-           'diagonal_add_scalar', 'symeig', 'block_diag', 'expand_prior_precision']
+           'diagonal_add_scalar', 'symeig', 'batched_symeig', 'block_diag',
+           'expand_prior_precision', 'mc_softmax_predictive']
 
 
 def get_nll(out_dist, targets):
@@ -178,6 +181,35 @@ def symeig(M):
     return L, W
 
 
+def batched_symeig(M):
+    """Symmetric eigendecomposition of a batch of matrices with one call to
+    `torch.linalg.eigh`. If the batched decomposition fails, the matrices are decomposed
+    one at a time with `symeig` such that the jitter is only added where needed.
+
+    Parameters
+    ----------
+    M : torch.Tensor
+        `(batch, dim, dim)`
+
+    Returns
+    -------
+    L : torch.Tensor
+        eigenvalues `(batch, dim)`
+    W : torch.Tensor
+        eigenvectors `(batch, dim, dim)`
+    """
+    try:
+        L, W = torch.linalg.eigh(M, UPLO='U')
+    except RuntimeError:  # did not converge for at least one element
+        logging.info('SYMEIG: batched decomposition failed, decomposing one at a time.')
+        Ls, Ws = zip(*[symeig(Mi) for Mi in M])
+        return torch.stack(Ls), torch.stack(Ws)
+    L = L.clamp(min=0.0)
+    L = torch.nan_to_num(L)
+    W = torch.nan_to_num(W)
+    return L, W
+
+
 def block_diag(blocks):
     """Compose block-diagonal matrix of individual blocks.
 
@@ -256,3 +288,83 @@ def normal_samples(mean, var, n_samples, generator=None):
         return (mean.unsqueeze(-1) + scaled_samples).permute((2, 0, 1))
     else:
         raise ValueError('Invalid input shapes.')
+
+
+def mc_softmax_predictive(f_mu, f_var, n_samples=100000, chunk_size=10000, sampling='normal',
+                          jitter=1e-6, generator=None):
+    """Monte Carlo estimate of the softmax predictive
+    \\(\\mathbb{E}[\\mathrm{softmax}(f)]\\) with \\(f \\sim \\mathcal{N}(f_\\mu, f_{var})\\).
+    The covariance of each example is factorized once and samples are drawn in chunks
+    of `chunk_size` with a streaming mean so that the memory does not grow with `n_samples`.
+    The estimate is differentiable w.r.t. `f_mu` and `f_var`. When a gradient is needed,
+    each chunk is checkpointed: its samples are redrawn from a per-chunk seed in the
+    backward pass instead of keeping the graph of all chunks alive.
+
+    Parameters
+    ----------
+    f_mu : torch.Tensor
+        `(batch_size, output_dim)`
+    f_var : torch.Tensor
+        `(batch_size, output_dim, output_dim)`
+    n_samples : int, default=100000
+        number of samples
+    chunk_size : int, default=10000
+        number of samples drawn at once
+    sampling : {'normal', 'antithetic', 'qmc'}, default='normal'
+        i.i.d. normal samples, pairs of antithetic samples, or scrambled Sobol points
+        transformed to normal samples; the Sobol points are shifted by an independent
+        uniform random vector per example (modulo 1) so that the estimates of different
+        examples are independent
+    jitter : float, default=1e-6
+        added to the diagonal of `f_var` before the Cholesky factorization
+    generator : torch.Generator
+        random number generator on the device of `f_mu`
+
+    Returns
+    -------
+    probs : torch.Tensor
+        `(batch_size, output_dim)`
+    """
+    if sampling not in ['normal', 'antithetic', 'qmc']:
+        raise ValueError(f'Invalid sampling {sampling}.')
+    batch_size, output_dim = f_mu.shape
+    device = f_mu.device
+    eye = torch.eye(output_dim, device=f_var.device, dtype=f_var.dtype)
+    scale = torch.linalg.cholesky(f_var + jitter * eye).to(f_mu.dtype)
+    if sampling == 'qmc':
+        seed = int(torch.randint(2**31, (1,), device=device, generator=generator))
+        engine = SobolEngine(output_dim, scramble=True, seed=seed)
+        shift = torch.rand((batch_size, output_dim), device=device, dtype=torch.float64,
+                           generator=generator)
+    if sampling == 'antithetic':
+        # draw pairs of samples such that chunks contain both halves
+        chunk_size += chunk_size % 2
+
+    def chunk_probs(f_mu, scale, n, seed, u):
+        # samples are drawn from `seed` or the Sobol points `u` inside the chunk so that
+        # the recomputation of a checkpointed chunk draws the same samples
+        if u is not None:
+            u = torch.frac(u.unsqueeze(1) + shift).clamp(1e-10, 1 - 1e-10)
+            eps = torch.special.ndtri(u).to(f_mu.dtype)
+        else:
+            chunk_generator = torch.Generator(device=device).manual_seed(seed)
+            shape = (n - n // 2 if sampling == 'antithetic' else n, batch_size, output_dim)
+            eps = torch.randn(shape, device=device, dtype=f_mu.dtype, generator=chunk_generator)
+            if sampling == 'antithetic':
+                eps = torch.cat([eps, -eps[:n // 2]])
+        fs = f_mu + torch.einsum('bij,nbj->nbi', scale, eps)
+        return torch.softmax(fs, dim=-1).sum(0)
+
+    checkpoint = torch.is_grad_enabled() and (f_mu.requires_grad or scale.requires_grad)
+    probs = 0.
+    for start in range(0, n_samples, chunk_size):
+        n = min(chunk_size, n_samples - start)
+        seed = int(torch.randint(2**62, (1,), device=device, generator=generator))
+        u = engine.draw(n, dtype=torch.float64).to(device) if sampling == 'qmc' else None
+        if checkpoint:
+            chunk = torch.utils.checkpoint.checkpoint(chunk_probs, f_mu, scale, n, seed, u,
+                                                      use_reentrant=False)
+        else:
+            chunk = chunk_probs(f_mu, scale, n, seed, u)
+        probs = probs + chunk
+    return probs / n_samples
@@ -1,8 +1,17 @@
-from datasets import load_dataset
+from datasets import load_dataset, load_from_disk
+import hashlib
+import inspect
+import json
 import os
+import shutil
+import tempfile
 import numpy as np
 
 
+# tokenized datasets are shared by all scripts, seeds, and configurations
+TOKENIZED_CACHE_DIR = os.environ.get(
+    'TOKENIZED_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'laplace_lora', 'tokenized'))
+
 
 def preprocess_function(examples, tokenizer, args, padding):
         if args.task_name == 'boolq':
@@ -190,4 +199,84 @@ def download_data(args,cache_dir):
     return raw_datasets,num_labels
 
 
+def _tokenizer_fingerprint(tokenizer):
+    # the serialized fast tokenizer contains the vocabulary, normalizer and post-processor
+    if getattr(tokenizer, 'is_fast', False):
+        state = tokenizer.backend_tokenizer.to_str()
+    else:
+        state = json.dumps(tokenizer.get_vocab(), sort_keys=True)
+    settings = {name: str(getattr(tokenizer, name, None)) for name in
+                ['name_or_path', 'padding_side', 'truncation_side', 'model_max_length', 'add_bos_token', 'add_eos_token']}
+    settings['special_tokens'] = {k: str(v) for k, v in tokenizer.special_tokens_map.items()}
+    return hashlib.sha256((state + json.dumps(settings, sort_keys=True)).encode()).hexdigest()
+
+
+def _template_fingerprint(preprocess):
+    # the source of the prompt template and the plain values it closes over, e.g. label maps
+    closure = inspect.getclosurevars(preprocess).nonlocals
+    values = {k: repr(v) for k, v in closure.items()
+              if isinstance(v, (str, int, float, bool, tuple, list, dict, type(None)))}
+    return inspect.getsource(preprocess) + json.dumps(values, sort_keys=True)
+
+
+def tokenize_datasets(raw_datasets, tokenizer, args, padding, preprocess=None, cache_dir=None, num_proc=None):
+    """Tokenize `raw_datasets` once and reuse the result across all runs.
+    The tokenized splits are stored as Arrow files in a directory of `cache_dir` whose name
+    is the hash of the task, the prompt template, the tokenizer, `max_length`, the padding,
+    and the fingerprints of the raw splits. Existing caches are opened memory-mapped without
+    copying the token arrays; new ones are tokenized with `num_proc` processes and moved into
+    place atomically, such that concurrent jobs never read a partial cache.
+
+    Parameters
+    ----------
+    raw_datasets : datasets.DatasetDict
+    tokenizer : transformers.PreTrainedTokenizer
+    args : argparse.Namespace
+        with `task_name` and `max_length`
+    padding : str or bool
+    preprocess : callable, default=None
+        batched preprocessing of the examples, `preprocess_function` if None
+    cache_dir : str, default=None
+        `TOKENIZED_CACHE_DIR` if None, which can be set by the environment variable of the same name
+    num_proc : int, default=None
+        number of tokenization processes, all CPUs up to 8 if None
+
+    Returns
+    -------
+    processed_datasets : datasets.DatasetDict
+    """
+    if preprocess is None:
+        template = inspect.getsource(preprocess_function)
+        preprocess = lambda examples: preprocess_function(examples, tokenizer, args, padding)
+    else:
+        template = _template_fingerprint(preprocess)
+    cache_dir = TOKENIZED_CACHE_DIR if cache_dir is None else cache_dir
+    num_proc = min(os.cpu_count() or 1, 8) if num_proc is None else num_proc
+
+    key = json.dumps({
+        'task_name': args.task_name, 'max_length': args.max_length, 'padding': str(padding),
+        'template': template, 'tokenizer': _tokenizer_fingerprint(tokenizer),
+        'data': {split: dataset._fingerprint for split, dataset in raw_datasets.items()},
+    }, sort_keys=True)
+    path = os.path.join(cache_dir, f'{args.task_name}_{hashlib.sha256(key.encode()).hexdigest()[:24]}')
+    if os.path.exists(os.path.join(path, 'dataset_dict.json')):
+        print(f'loading tokenized datasets from {path}')
+        return load_from_disk(path)
 
+    processed_datasets = raw_datasets.map(
+        preprocess,
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=raw_datasets["train"].column_names,
+        desc="Running tokenizer on dataset",
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp_')
+    processed_datasets.save_to_disk(tmp_path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another job has written the same cache in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    print(f'saved tokenized datasets to {path}')
+    return load_from_disk(path)
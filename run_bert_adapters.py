@@ -359,12 +359,7 @@ def main():
 
     #processed_datasets = preprocess_function(raw_datasets,tokenizer,args,padding)
 
-    processed_datasets = raw_datasets.map(
-    lambda examples: preprocessing.preprocess_function(examples,tokenizer,args,padding),
-    batched=True,
-    remove_columns=raw_datasets["train"].column_names,
-    desc="Running tokenizer on dataset",
-    )
+    processed_datasets = preprocessing.tokenize_datasets(raw_datasets, tokenizer, args, padding)
 
 
     # print('====train data====')
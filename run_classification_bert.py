@@ -43,6 +43,7 @@ from peft import (
     PrefixTuningConfig,
     PromptEncoderConfig,
 )
+from preprocessing import tokenize_datasets
 
 
 # Will error if the minimal version of Transformers is not installed. Remove at your own risks.
@@ -409,12 +410,7 @@ def main():
         return result
 
     with accelerator.main_process_first():
-        processed_datasets = raw_datasets.map(
-            preprocess_function,
-            batched=True,
-            remove_columns=raw_datasets["train"].column_names,
-            desc="Running tokenizer on dataset",
-        )
+        processed_datasets = tokenize_datasets(raw_datasets, tokenizer, args, padding, preprocess=preprocess_function)
 
     train_dataset = processed_datasets["train"]
     processed_dataset = processed_datasets["validation_matched" if args.task_name == "mnli" else "validation"]
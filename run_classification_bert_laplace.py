@@ -7,6 +7,7 @@ import math
 import os
 import random
 from pathlib import Path
+from types import SimpleNamespace
 
 import datasets
 import evaluate
@@ -47,6 +48,7 @@ from peft import (
 )
 
 from laplace import Laplace
+from preprocessing import tokenize_datasets
 import pickle
 import dill
 
@@ -202,6 +204,8 @@ def parse_args():
     )
     parser.add_argument("--save", action="store_true", default=False)
     parser.add_argument("--load_step", type=int, default=0)
+    parser.add_argument("--load_steps", type=int, nargs='+', default=[0, *range(999, 10999, 1000)],
+                        help='checkpoints to evaluate in one sweep that loads the base model and the data once')
     parser.add_argument("--lora_r", type=int, default=8)
     parser.add_argument("--lora_alpha", type=int, default=16)
     parser.add_argument("--lora_dropout", type=float, default=0.1)
@@ -239,17 +243,22 @@ def parse_args():
     return args
 
 
-def main(load_step):
-    args = parse_args()
-    args.load_step = load_step
+def load_adapter_state_dict(adapter_dir):
+    # checkpoints are saved as safetensors by recent versions of peft
+    path = os.path.join(adapter_dir, 'adapter_model.safetensors')
+    if os.path.exists(path):
+        from safetensors.torch import load_file
+        return load_file(path)
+    return torch.load(os.path.join(adapter_dir, 'adapter_model.bin'), map_location='cpu')
+
+
+def setup(args):
+    """Set up everything that the checkpoints of a sweep share once: the accelerator, the
+    tokenized datasets, the loaders, and the base model with the adapter of `args.load_step`,
+    which `load_adapter` later replaces in place."""
     # Sending telemetry. Tracking the example usage helps us better allocate resources to maintain them. The
     # information sent is the one passed as arguments along with your Python/PyTorch versions.
     send_example_telemetry("run_glue_no_trainer", args)
-    
-    peft_method = 'lora'
-    laplace_output_dir = f'/user/work/ad20999/outputs_laplace/{args.task_name}/{args.model_name_or_path}_{peft_method}_{args.lora_alpha}_{args.lora_dropout}_{args.learning_rate}_{args.seed}/step_{args.load_step}'
-    
-    os.makedirs(laplace_output_dir, exist_ok=True)
 
     # Initialize the accelerator. We will let the accelerator handle device placement for us in this example.
     # If we're using tracking, we also need to initialize it here and it will by default pick up all supported trackers
@@ -434,12 +443,7 @@ def main(load_step):
         return result
 
     with accelerator.main_process_first():
-        processed_datasets = raw_datasets.map(
-            preprocess_function,
-            batched=True,
-            remove_columns=raw_datasets["train"].column_names,
-            desc="Running tokenizer on dataset",
-        )
+        processed_datasets = tokenize_datasets(raw_datasets, tokenizer, args, padding, preprocess=preprocess_function)
 
     train_dataset = processed_datasets["train"]
     processed_dataset = processed_datasets["validation_matched" if args.task_name == "mnli" else "validation"]
@@ -511,15 +515,6 @@ def main(load_step):
 
     model.eval()
 
-    # Get the metric function
-    if args.task_name is not None:
-        if args.task_name in ['wnli', 'rte', 'mrpc', 'cola', 'sst2', 'qnli', 'qqp', 'mnli']:
-            metric = evaluate.load("glue", args.task_name, experiment_id=f"{laplace_output_dir}/la_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}")
-        elif args.task_name in ['cb', 'wic', 'boolq']:
-            metric = evaluate.load("super_glue", args.task_name, experiment_id=f"{laplace_output_dir}/la_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}")
-    else:
-        metric = evaluate.load("accuracy")
-
     class WrappedModel(torch.nn.Module):
         def __init__(self, model):
             super().__init__()
@@ -530,7 +525,51 @@ def main(load_step):
             return output_dict['logits']
 
     model = WrappedModel(model)
-    
+
+    return SimpleNamespace(accelerator=accelerator, model=model, train_dataloader=train_dataloader,
+                           val_dataloader=val_dataloader if args.testing_set != 'val' else None,
+                           eval_dataloader=eval_dataloader)
+
+
+def load_adapter(args, run):
+    """Copy the LoRA weights and the classifier of the checkpoint of `args.load_step` into the
+    model of `run` in place, such that the base model, the datasets, and the loaders are reused."""
+    output_dir = args.output_dir + f'/step_{args.load_step}'
+    peft_model = run.accelerator.unwrap_model(run.model.model)
+    peft_config, loaded_config = LoraConfig.from_pretrained(output_dir), peft_model.peft_config['default']
+    if (peft_config.base_model_name_or_path, peft_config.r, set(peft_config.target_modules)) != \
+            (loaded_config.base_model_name_or_path, loaded_config.r, set(loaded_config.target_modules)):
+        raise ValueError(f'The adapter in {output_dir} does not match the adapters of the loaded model.')
+
+    load_result = set_peft_model_state_dict(peft_model, load_adapter_state_dict(output_dir))
+    if load_result.unexpected_keys:
+        raise ValueError(f'Unexpected weights in {output_dir}: {load_result.unexpected_keys}')
+    # the state dict is loaded non-strictly, so the weights of the base model are always missing
+    missing_keys = [k for k in load_result.missing_keys if 'lora_' in k or 'modules_to_save' in k]
+    if missing_keys:
+        raise ValueError(f'Missing adapter weights in {output_dir}: {missing_keys}')
+    print(f'----loaded adapter of step {args.load_step}-----')
+
+
+def evaluate_checkpoint(args, run):
+    """Fit and evaluate the Laplace approximation at the adapter of `args.load_step`."""
+    accelerator, model = run.accelerator, run.model
+    train_dataloader, val_dataloader, eval_dataloader = run.train_dataloader, run.val_dataloader, run.eval_dataloader
+    output_dir = args.output_dir + f'/step_{args.load_step}'
+    peft_method = 'lora'
+    laplace_output_dir = f'/user/work/ad20999/outputs_laplace/{args.task_name}/{args.model_name_or_path}_{peft_method}_{args.lora_alpha}_{args.lora_dropout}_{args.learning_rate}_{args.seed}/step_{args.load_step}'
+    os.makedirs(laplace_output_dir, exist_ok=True)
+    set_seed(args.seed)
+
+    # Get the metric function
+    if args.task_name is not None:
+        if args.task_name in ['wnli', 'rte', 'mrpc', 'cola', 'sst2', 'qnli', 'qqp', 'mnli']:
+            metric = evaluate.load("glue", args.task_name, experiment_id=f"{laplace_output_dir}/la_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}")
+        elif args.task_name in ['cb', 'wic', 'boolq']:
+            metric = evaluate.load("super_glue", args.task_name, experiment_id=f"{laplace_output_dir}/la_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}")
+    else:
+        metric = evaluate.load("accuracy")
+
     if args.laplace_prior == 'hetero':
         la = Laplace(model, 'classification',
                         subset_of_weights='all',  #args.laplace_sub,
@@ -640,12 +679,23 @@ def main(load_step):
         json.dump(all_results, f)
 
 
-    del model, train_dataloader, output_dicts, metric, la, f_mu, f_var, f_mu_list, f_var_list, eval_dataloader, val_dataloader
+    la.close()
+    del output_dicts, metric, la, f_mu, f_var, f_mu_list, f_var_list
     
     torch.cuda.empty_cache()
 
 
+def main():
+    args = parse_args()
+    run = None
+    for load_step in args.load_steps:
+        args.load_step = load_step
+        if run is None:
+            run = setup(args)
+        else:
+            load_adapter(args, run)
+        evaluate_checkpoint(args, run)
+
+
 if __name__ == "__main__":
-    step_list = [0,*list(range(999, 10999, 1000))]
-    for load_step in step_list:
-        main(load_step)
\ No newline at end of file
+    main()
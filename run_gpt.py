@@ -45,6 +45,7 @@ from peft import (
     PrefixTuningConfig,
     PromptEncoderConfig,
 )
+import preprocessing
 
 
 logger = get_logger(__name__)
@@ -427,37 +428,8 @@ def main():
 
     padding = "max_length" if args.pad_to_max_length else False
 
-    def preprocess_function(examples):
-        if args.task_name == 'boolq':
-            texts = [f"Answer the question with only True or False: {question} Context: {passage}" for passage, question in zip(examples['passage'], examples['question'])]
-            result = tokenizer(texts, padding=padding, max_length=args.max_length, truncation=True)
-            result["labels"] = examples["label"]
-        elif 'openbookqa' in args.task_name:
-            choices_list = [' '.join(f'{label}. {text}' for label, text in zip(choices['label'], choices['text'])) for choices in examples['choices']]
-            texts = [f"Select one of the choices that answers the following question: {question} Choices: {choices} Answer:" for question, choices in zip(examples['question_stem'], choices_list)]
-            result = tokenizer(texts, padding=padding, max_length=args.max_length, truncation=True)
-            map_dict = {"A": 0, "B": 1, "C": 2, "D": 3, "1": 0, "2": 1, "3": 2, "4": 3}
-            result["labels"] = [map_dict[label] for label in examples["answerKey"]]
-        elif 'ARC' in args.task_name:
-            choices_list = [' '.join(f'{label}. {text}' for label, text in zip(choices['label'], choices['text'])) for choices in examples['choices']]
-            texts = [f"Select one of the choices that answers the following question: {question} Choices: {choices} Answer:" for question, choices in zip(examples['question'], choices_list)]
-            result = tokenizer(texts, padding=padding, max_length=args.max_length, truncation=True)
-            map_dict = {"A": 0, "B": 1, "C": 2, "D": 3, "1": 0, "2": 1, "3": 2, "4": 3}
-            result["labels"] = [map_dict[label] for label in examples["answerKey"]]
-        elif 'winogrande' in  args.task_name:
-            texts = [f"Select one of the choices that answers the following question: {question} Choices: A. {option1}. B {option2}. Answer:" for question, option1, option2 in zip(examples['sentence'], examples['option1'], examples['option2'])]
-            result = tokenizer(texts, padding=padding, max_length=args.max_length, truncation=True)
-            map_dict = {"1": 0, "2": 1, "":None}
-            result["labels"] = [map_dict[label] for label in examples["answer"]]
-        return result
-
     with accelerator.main_process_first():
-        processed_datasets = raw_datasets.map(
-            preprocess_function,
-            batched=True,
-            remove_columns=raw_datasets["train"].column_names,
-            desc="Running tokenizer on dataset",
-        )
+        processed_datasets = preprocessing.tokenize_datasets(raw_datasets, tokenizer, args, padding)
 
     # print('====train data====')
     train_dataset = processed_datasets["train"]
@@ -5,6 +5,7 @@ import math
 import os
 import random
 from pathlib import Path
+from types import SimpleNamespace
 
 import datasets
 import evaluate
@@ -47,6 +48,9 @@ from peft import (
 )
 
 from laplace import Laplace
+from laplace.utils import mc_softmax_predictive
+from laplace.curvature import LoraGGN
+import preprocessing
 import pickle
 import dill
 
@@ -179,6 +183,8 @@ def parse_args():
     )
     parser.add_argument("--save", action="store_true", default=False)
     parser.add_argument("--load_step", type=int, default=999)
+    parser.add_argument("--load_steps", type=int, nargs='+', default=[0, *range(999, 10999, 1000)],
+                        help='checkpoints to evaluate in one sweep that loads the base model and the data once')
     parser.add_argument("--lora_r", type=int, default=8)
     parser.add_argument("--lora_alpha", type=int, default=16)
     parser.add_argument("--lora_dropout", type=float, default=0.1)
@@ -187,8 +193,21 @@ def parse_args():
     parser.add_argument("--laplace_prior", type=str, default='homo', help='homo')
     parser.add_argument("--laplace_optim_step", type=int, default=1000)
     parser.add_argument("--testing_set", type=str, default='train_val')
-    parser.add_argument("--laplace_predict", type=str, default='mc_corr', help='probit bridge bridge_norm mc_indep mc_corr')
+    parser.add_argument("--laplace_predict", type=str, default='mc_corr', help='probit bridge bridge_norm mc_indep mc_corr mc_jvp')
     parser.add_argument("--lm_head", action="store_true", default=True)
+    parser.add_argument("--laplace_refit", action="store_true", default=False, help='refit even if a saved posterior exists')
+    parser.add_argument("--laplace_mc_samples", type=int, default=100000)
+    parser.add_argument("--laplace_mc_sampling", type=str, default='normal', help='normal antithetic qmc')
+    parser.add_argument("--laplace_sketch_rank", type=int, default=None,
+                        help='sketch the large Kronecker factors of LoRA layers with this rank')
+    parser.add_argument("--laplace_max_rank", type=int, default=None,
+                        help='truncate larger Kronecker factors to this many eigenpairs')
+    parser.add_argument("--laplace_kfac_conv", type=str, default='kfac-expand', help='kfac-expand kfac-reduce')
+    parser.add_argument("--laplace_jvp_samples", type=int, default=200,
+                        help='number of parameter samples for --laplace_predict mc_jvp, each of which '
+                             'takes a forward pass with a Jacobian-vector product of the full model')
+    parser.add_argument("--laplace_jvp_chunk_size", type=int, default=None,
+                        help='number of samples pushed through the model at once for --laplace_predict mc_jvp')
     args = parser.parse_args()
 
     print(args)
@@ -220,16 +239,23 @@ def parse_args():
     return args
 
 
-def main(load_step):
-    args = parse_args()
-    args.load_step = load_step
+def load_adapter_state_dict(adapter_dir):
+    # checkpoints are saved as safetensors by recent versions of peft
+    path = os.path.join(adapter_dir, 'adapter_model.safetensors')
+    if os.path.exists(path):
+        from safetensors.torch import load_file
+        return load_file(path)
+    return torch.load(os.path.join(adapter_dir, 'adapter_model.bin'), map_location='cpu')
+
+
+def setup(args):
+    """Set up everything that the checkpoints of a sweep share once: the accelerator, the
+    tokenized datasets, the prepared loaders, and the base model with the adapter of
+    `args.load_step`, which `load_adapter` later replaces in place."""
     # Sending telemetry. Tracking the example usage helps us better allocate resources to maintain them. The
     # information sent is the one passed as arguments along with your Python/PyTorch versions.
     send_example_telemetry("run_glue_no_trainer", args)
 
-    laplace_output_dir = args.laplace_output_dir + f'step_{args.load_step}'
-    os.makedirs(laplace_output_dir, exist_ok=True)
-
     # Initialize the accelerator. We will let the accelerator handle device placement for us in this example.
     # If we're using tracking, we also need to initialize it here and it will by default pick up all supported trackers
     # in the environment
@@ -417,37 +443,8 @@ def main(load_step):
 
     padding = "max_length" if args.pad_to_max_length else False
 
-    def preprocess_function(examples):
-        if args.task_name == 'boolq':
-            texts = [f"Answer the question with only True or False: {question} Context: {passage}" for passage, question in zip(examples['passage'], examples['question'])]
-            result = tokenizer(texts, padding=padding, max_length=args.max_length, truncation=True)
-            result["labels"] = examples["label"]
-        elif 'openbookqa' in args.task_name:
-            choices_list = [' '.join(f'{label}. {text}' for label, text in zip(choices['label'], choices['text'])) for choices in examples['choices']]
-            texts = [f"Select one of the choices that answers the following question: {question} Choices: {choices} Answer:" for question, choices in zip(examples['question_stem'], choices_list)]
-            result = tokenizer(texts, padding=padding, max_length=args.max_length, truncation=True)
-            map_dict = {"A": 0, "B": 1, "C": 2, "D": 3, "1": 0, "2": 1, "3": 2, "4": 3}
-            result["labels"] = [map_dict[label] for label in examples["answerKey"]]
-        elif 'ARC' in args.task_name:
-            choices_list = [' '.join(f'{label}. {text}' for label, text in zip(choices['label'], choices['text'])) for choices in examples['choices']]
-            texts = [f"Select one of the choices that answers the following question: {question} Choices: {choices} Answer:" for question, choices in zip(examples['question'], choices_list)]
-            result = tokenizer(texts, padding=padding, max_length=args.max_length, truncation=True)
-            map_dict = {"A": 0, "B": 1, "C": 2, "D": 3, "1": 0, "2": 1, "3": 2, "4": 3}
-            result["labels"] = [map_dict[label] for label in examples["answerKey"]]
-        elif 'winogrande' in  args.task_name:
-            texts = [f"Select one of the choices that answers the following question: {question} Choices: A. {option1}. B {option2}. Answer:" for question, option1, option2 in zip(examples['sentence'], examples['option1'], examples['option2'])]
-            result = tokenizer(texts, padding=padding, max_length=args.max_length, truncation=True)
-            map_dict = {"1": 0, "2": 1, "":None}
-            result["labels"] = [map_dict[label] for label in examples["answer"]]
-        return result
-
     with accelerator.main_process_first():
-        processed_datasets = raw_datasets.map(
-            preprocess_function,
-            batched=True,
-            remove_columns=raw_datasets["train"].column_names,
-            desc="Running tokenizer on dataset",
-        )
+        processed_datasets = preprocessing.tokenize_datasets(raw_datasets, tokenizer, args, padding)
 
     train_dataset = processed_datasets["train"]
     processed_dataset = processed_datasets["validation_matched" if args.task_name == "mnli" else "validation"]
@@ -601,6 +598,55 @@ def main(load_step):
         )
     model.eval()
 
+    return SimpleNamespace(accelerator=accelerator, model=model, train_dataloader=train_dataloader,
+                           val_dataloader=val_dataloader if args.testing_set != 'val' else None,
+                           eval_dataloader=eval_dataloader)
+
+
+def load_adapter(args, run):
+    """Copy the LoRA weights of the checkpoint of `args.load_step` into the prepared model
+    of `run` in place, such that the base model, the datasets, and the loaders are reused."""
+    output_dir = args.output_dir + f'/step_{args.load_step}'
+    peft_model = run.accelerator.unwrap_model(run.model).model
+    peft_config, loaded_config = LoraConfig.from_pretrained(output_dir), peft_model.peft_config['default']
+    if (peft_config.base_model_name_or_path, peft_config.r, set(peft_config.target_modules)) != \
+            (loaded_config.base_model_name_or_path, loaded_config.r, set(loaded_config.target_modules)):
+        raise ValueError(f'The adapter in {output_dir} does not match the adapters of the loaded model.')
+
+    state_dict = load_adapter_state_dict(output_dir)
+    # the LoRA weights of the lm_head are trimmed copies in CustomLMHead_lora
+    lm_head_state_dict = {k: v for k, v in state_dict.items() if args.lm_head and 'lm_head' in k}
+    load_result = set_peft_model_state_dict(
+        peft_model, {k: v for k, v in state_dict.items() if k not in lm_head_state_dict})
+    if load_result.unexpected_keys:
+        raise ValueError(f'Unexpected weights in {output_dir}: {load_result.unexpected_keys}')
+    # the state dict is loaded non-strictly, so the weights of the base model are always missing
+    missing_keys = [k for k in load_result.missing_keys if ('lora_' in k or 'modules_to_save' in k)
+                    and not (args.lm_head and 'lm_head' in k)]
+    if args.lm_head:
+        missing_keys += [name for name in ['lora_A', 'lora_B']
+                         if not any(name in k for k in lm_head_state_dict)]
+    if missing_keys:
+        raise ValueError(f'Missing adapter weights in {output_dir}: {missing_keys}')
+    lm_head = peft_model.base_model.model.lm_head
+    with torch.no_grad():
+        for k, v in lm_head_state_dict.items():
+            if 'lora_A' in k:
+                lm_head.lora_A.weight.copy_(v)
+            elif 'lora_B' in k:
+                lm_head.lora_B.weight.copy_(v[lm_head.id_list])
+    print(f'----loaded adapter of step {args.load_step}-----')
+
+
+def evaluate_checkpoint(args, run):
+    """Fit and evaluate the Laplace approximation at the adapter of `args.load_step`."""
+    accelerator, model = run.accelerator, run.model
+    train_dataloader, val_dataloader, eval_dataloader = run.train_dataloader, run.val_dataloader, run.eval_dataloader
+    output_dir = args.output_dir + f'/step_{args.load_step}'
+    laplace_output_dir = args.laplace_output_dir + f'step_{args.load_step}'
+    os.makedirs(laplace_output_dir, exist_ok=True)
+    set_seed(args.seed)
+
     # Get the metric function
     if args.task_name is not None:
         if args.task_name in ['wnli', 'rte', 'mrpc', 'cola', 'sst2', 'qnli', 'qqp', 'mnli']:
@@ -613,19 +659,40 @@ def main(load_step):
         metric = evaluate.load("accuracy", experiment_id=f"{laplace_output_dir}/prior_precision_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}")
 
 
+    laplace_kwargs, posterior_name = dict(), f'{args.laplace_hessian}_{args.laplace_sub}'
+    if args.laplace_sketch_rank is not None and args.laplace_hessian == 'kron':
+        laplace_kwargs = dict(backend=LoraGGN, backend_kwargs=dict(sketch_rank=args.laplace_sketch_rank))
+        posterior_name += f'_sketch{args.laplace_sketch_rank}'
+    if args.laplace_max_rank is not None and args.laplace_hessian == 'kron':
+        laplace_kwargs['max_rank'] = args.laplace_max_rank
+        posterior_name += f'_rank{args.laplace_max_rank}'
+    fit_kwargs = dict()
+    if args.laplace_kfac_conv == 'kfac-reduce' and args.laplace_hessian == 'kron':
+        fit_kwargs['kfac_conv'] = args.laplace_kfac_conv
+        posterior_name += '_reduce'
     la = Laplace(model, 'classification', prior_precision=1.,
                     subset_of_weights='all',
-                    hessian_structure=args.laplace_hessian)
+                    hessian_structure=args.laplace_hessian, **laplace_kwargs)
 
 
-    print('----fitting Laplace-----')
-    la.fit(train_dataloader)
+    # the fitted posterior does not depend on the prior, reuse it across evaluation jobs
+    posterior_path = f'{laplace_output_dir}/posterior_{posterior_name}.safetensors'
+    if os.path.exists(posterior_path) and not args.laplace_refit:
+        print('----loading Laplace-----')
+        la.load(posterior_path)
+    else:
+        print('----fitting Laplace-----')
+        # the prepared loader already yields different batches on each process
+        la.fit(train_dataloader, shard=False, **fit_kwargs)
+        if accelerator.is_main_process:
+            la.save(posterior_path)
 
     if args.testing_set == 'val':
         prior_precision = la.optimize_prior_precision(method='marglik', n_steps=args.laplace_optim_step, lr=1e-1)
         print(f'prior precision: {prior_precision}')    
     else:
-        prior_precision = la.optimize_prior_precision(method='val_gd', val_loader=val_dataloader, n_steps=args.laplace_optim_step, lr=1e-1)
+        prior_precision = la.optimize_prior_precision(method='val_gd', val_loader=val_dataloader, n_steps=args.laplace_optim_step, lr=1e-1,
+                                                      mc_samples=args.laplace_mc_samples, mc_sampling=args.laplace_mc_sampling)
     
     torch.save(prior_precision, f'{laplace_output_dir}/prior_precision_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}.pt')
     print('prior precision', prior_precision)
@@ -637,17 +704,18 @@ def main(load_step):
     f_mu_list = []
     f_var_list = []
     for step, batch in tqdm(enumerate(eval_dataloader)):
-        with torch.no_grad():
-            f_mu, f_var = la._glm_predictive_distribution(batch)
-            f_mu_list.append(f_mu)
-            f_var_list.append(f_var)
-        
-        samples = 100000
-        f_mu = f_mu.expand(samples, -1, -1)
-        f_var = f_var.expand(samples, -1, -1, -1)
+        if args.laplace_predict == 'mc_jvp':
+            # samples of the linearized model from Jacobian-vector products, without f_var
+            logits = la(batch, pred_type='glm_jvp', link_approx='mc', n_samples=args.laplace_jvp_samples,
+                        chunk_size=args.laplace_jvp_chunk_size)
+        else:
+            with torch.no_grad():
+                f_mu, f_var = la._glm_predictive_distribution(batch)
+                f_mu_list.append(f_mu)
+                f_var_list.append(f_var)
 
-        logits = f_mu + (torch.linalg.cholesky(f_var + torch.eye(f_var.shape[-1]).to(f_var.device)*1e-6).to(f_mu.dtype) @ torch.randn_like(f_mu).unsqueeze(-1).to(f_mu.dtype).to(accelerator.device)).squeeze(-1)
-        logits = torch.softmax(logits, dim=-1).mean(0)
+            logits = mc_softmax_predictive(f_mu, f_var, n_samples=args.laplace_mc_samples,
+                                           sampling=args.laplace_mc_sampling)
         
         predictions = logits.argmax(dim=-1)
 
@@ -678,14 +746,17 @@ def main(load_step):
             references=references,
         )
 
-    f_mu = torch.cat(f_mu_list, dim=0)
-    f_var = torch.cat(f_var_list, dim=0)
-    print('f_mu shape', f_mu.shape)
-    print('f_var shape', f_var.shape)
-    print(f_mu)
-    print(f_var)
-    torch.save(f_mu, f'{laplace_output_dir}/f_mu_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}.pt')
-    torch.save(f_var, f'{laplace_output_dir}/f_var_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}.pt')
+    la.close()
+    f_mu, f_var = None, None
+    if f_var_list:
+        f_mu = torch.cat(f_mu_list, dim=0)
+        f_var = torch.cat(f_var_list, dim=0)
+        print('f_mu shape', f_mu.shape)
+        print('f_var shape', f_var.shape)
+        print(f_mu)
+        print(f_var)
+        torch.save(f_mu, f'{laplace_output_dir}/f_mu_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}.pt')
+        torch.save(f_var, f'{laplace_output_dir}/f_var_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}.pt')
 
     output_path = os.path.join(output_dir, f'eval_res_la_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_predict}_{args.laplace_optim_step}.json')
     print(f'writing outputs to \'{output_path}\'')
@@ -714,13 +785,23 @@ def main(load_step):
     with open(all_results_path, "w") as f:
         json.dump(all_results, f)
 
-    del model, train_dataloader, la, f_mu, f_var, f_mu_list, f_var_list, metric, eval_metric, output_dicts, eval_dataloader
+    del la, f_mu, f_var, f_mu_list, f_var_list, metric, eval_metric, output_dicts
     torch.cuda.empty_cache()
 
 
+def main():
+    args = parse_args()
+    run = None
+    for load_step in args.load_steps:
+        args.load_step = load_step
+        if run is None:
+            run = setup(args)
+        else:
+            load_adapter(args, run)
+        evaluate_checkpoint(args, run)
+
+
 
 
 if __name__ == "__main__":
-    step_list = [0,*list(range(999, 10999, 1000))]
-    for load_step in step_list:
-        main(load_step)
\ No newline at end of file
+    main()
@@ -5,6 +5,7 @@ import math
 import os
 import random
 from pathlib import Path
+from types import SimpleNamespace
 import numpy as np
 import datasets
 import evaluate
@@ -58,7 +59,7 @@ from adapters import (
 
 )
 
-from preprocessing import convert_choices_to_alpha,preprocess_function,download_data
+from preprocessing import convert_choices_to_alpha,download_data,tokenize_datasets
 from memory import save_gpu_stats 
 
 logger = get_logger(__name__)
@@ -190,6 +191,8 @@ def parse_args():
     )
     parser.add_argument("--save", action="store_true", default=False)
     parser.add_argument("--load_step", type=int, default=999)
+    parser.add_argument("--load_steps", type=int, nargs='+', default=[0, *range(1999, 10999, 2000)],
+                        help='checkpoints to evaluate in one sweep that loads the base model and the data once')
     #parser.add_argument("--lora_r", type=int, default=8)
     #parser.add_argument("--lora_alpha", type=int, default=16)
     #parser.add_argument("--lora_dropout", type=float, default=0.1)
@@ -247,20 +250,24 @@ def parse_args():
     return args
 
 
-def main(load_step):
-    #args = parse_args()
-    args.load_step = load_step
+def load_adapter_file(adapter_dir, name):
+    # adapters are saved as safetensors or as pickled state dicts, depending on the version of adapters
+    path = os.path.join(adapter_dir, f'{name}.safetensors')
+    if os.path.exists(path):
+        from safetensors.torch import load_file
+        return load_file(path)
+    path = os.path.join(adapter_dir, f'{name}.bin')
+    return torch.load(path, map_location='cpu') if os.path.exists(path) else {}
+
+
+def setup(args):
+    """Set up everything that the checkpoints of a sweep share once: the accelerator, the
+    tokenized datasets, the loaders, and the base model with the adapter of `args.load_step`,
+    which `load_adapter` later replaces in place."""
     # Sending telemetry. Tracking the example usage helps us better allocate resources to maintain them. The
     # information sent is the one passed as arguments along with your Python/PyTorch versions.
     send_example_telemetry("run_glue_no_trainer", args)
 
-    laplace_output_dir = args.laplace_output_dir + f'step_{args.load_step}'
-    os.makedirs(laplace_output_dir, exist_ok=True)
-
-    subfolder_name = f"step_{args.load_step}"
-    step_dir = os.path.join(args.cache_dir, subfolder_name)
-    os.makedirs(step_dir, exist_ok=True)
-
     # Initialize the accelerator once, if its configuration does not change
     accelerator = Accelerator(log_with=args.report_to, project_dir=args.output_dir) if args.with_tracking else Accelerator()
 
@@ -371,12 +378,7 @@ def main(load_step):
 
     padding = "max_length" if args.pad_to_max_length else False
 
-    processed_datasets = raw_datasets.map(
-    lambda examples: preprocess_function(examples,tokenizer,args,padding),
-    batched=True,
-    remove_columns=raw_datasets["train"].column_names,
-    desc="Running tokenizer on dataset",
-    )
+    processed_datasets = tokenize_datasets(raw_datasets, tokenizer, args, padding)
     train_dataset = processed_datasets["train"]
     processed_dataset = processed_datasets["validation_matched" if args.task_name == "mnli" else "validation"]
 
@@ -489,6 +491,48 @@ def main(load_step):
         )
     model.eval()
 
+    return SimpleNamespace(accelerator=accelerator, model=model, adapter_name=adapter_name,
+                           train_dataloader=train_dataloader,
+                           val_dataloader=val_dataloader if args.testing_set != 'val' else None,
+                           eval_dataloader=eval_dataloader)
+
+
+def load_adapter(args, run):
+    """Copy the adapter and the head of the checkpoint of `args.load_step` into the model of
+    `run` in place, such that the base model, the datasets, and the loaders are reused.
+
+    `AutoAdapterModel.load_adapter` would instead replace the adapter modules, which drops the
+    `requires_grad` selection of `setup` and the parameters that `accelerator` prepared."""
+    output_dir = args.output_dir + f'/step_{args.load_step}'
+    with open(os.path.join(output_dir, 'adapter_config.json')) as f:
+        adapter_name = json.load(f)['name']
+    if adapter_name != run.adapter_name:
+        raise ValueError(f'The adapter {adapter_name} in {output_dir} does not match the loaded adapter {run.adapter_name}.')
+
+    model = run.accelerator.unwrap_model(run.model).model
+    state_dict = {**load_adapter_file(output_dir, 'pytorch_adapter'), **load_adapter_file(output_dir, 'pytorch_model_head')}
+    load_result = model.load_state_dict(state_dict, strict=False)
+    if load_result.unexpected_keys:
+        raise ValueError(f'Unexpected weights in {output_dir}: {load_result.unexpected_keys}')
+    # the state dict is loaded non-strictly, so the weights of the base model are always missing
+    missing_keys = [k for k in load_result.missing_keys if f'.{adapter_name}.' in k]
+    if missing_keys:
+        raise ValueError(f'Missing adapter weights in {output_dir}: {missing_keys}')
+    print(f'----loaded adapter of step {args.load_step}-----')
+
+
+def evaluate_checkpoint(args, run):
+    """Fit and evaluate the Laplace approximation at the adapter of `args.load_step`."""
+    accelerator, model = run.accelerator, run.model
+    train_dataloader, val_dataloader, eval_dataloader = run.train_dataloader, run.val_dataloader, run.eval_dataloader
+    output_dir = args.output_dir + f'/step_{args.load_step}'
+    laplace_output_dir = args.laplace_output_dir + f'step_{args.load_step}'
+    os.makedirs(laplace_output_dir, exist_ok=True)
+    step_dir = os.path.join(args.cache_dir, f"step_{args.load_step}")
+    os.makedirs(step_dir, exist_ok=True)
+    if args.seed is not None:
+        set_seed(args.seed)
+
     # Get the metric function
     if args.task_name is not None:
         if args.task_name in ['wnli', 'rte', 'mrpc', 'cola', 'sst2', 'qnli', 'qqp', 'mnli']:
@@ -500,7 +544,6 @@ def main(load_step):
     else:
         metric = evaluate.load("accuracy", experiment_id=f"{laplace_output_dir}/prior_precision_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}")
 
-
     la = Laplace(model, 'classification', prior_precision=1.,
                     subset_of_weights=args.laplace_sub,
                     hessian_structure=args.laplace_hessian)
@@ -620,16 +663,24 @@ def main(load_step):
     with open(all_results_path, "w") as f:
         json.dump(all_results, f)
 
-    del model, train_dataloader, la, f_mu, f_var, f_mu_list, f_var_list, metric, eval_metric, output_dicts, eval_dataloader
+    la.close()
+    del la, f_mu, f_var, f_mu_list, f_var_list, metric, eval_metric, output_dicts
     torch.cuda.empty_cache()
 
 
 
 
-if __name__ == "__main__":
+def main():
     args = parse_args()
+    run = None
+    for load_step in args.load_steps:
+        args.load_step = load_step
+        if run is None:
+            run = setup(args)
+        else:
+            load_adapter(args, run)
+        evaluate_checkpoint(args, run)
+
 
-    #step_list = args.step_list
-    step_list = [0,*list(range(1999, 10999, 2000))]
-    for load_step in step_list:
-        main(load_step)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import math
 import os
 import random
 from pathlib import Path
+from types import SimpleNamespace
 import numpy as np
 import datasets
 import evaluate
@@ -17,7 +18,7 @@ from huggingface_hub import Repository, create_repo
 from torch.utils.data import DataLoader
 from tqdm.auto import tqdm
 
-from preprocessing import convert_choices_to_alpha,preprocess_function,download_data
+from preprocessing import convert_choices_to_alpha,download_data,tokenize_datasets
 from memory import save_gpu_stats 
 
 import transformers
@@ -184,6 +185,9 @@ def parse_args():
     )
     parser.add_argument("--save", action="store_true", default=False)
     parser.add_argument("--load_step", type=int, default=999)
+    parser.add_argument("--load_steps", type=int, nargs='+', default=None,
+                        help='checkpoints to evaluate in one sweep that loads the base model and the data once, '
+                             'defaults to the steps listed in the steps.json of the output directory')
     parser.add_argument("--lora_r", type=int, default=8)
     parser.add_argument("--lora_alpha", type=int, default=16)
     parser.add_argument("--lora_dropout", type=float, default=0.1)
@@ -259,21 +263,23 @@ def parse_args():
     return args
 
 
-def main(load_step):
-    #args = parse_args()
-    args.load_step = load_step
+def load_adapter_state_dict(adapter_dir):
+    # checkpoints are saved as safetensors by recent versions of peft
+    path = os.path.join(adapter_dir, 'adapter_model.safetensors')
+    if os.path.exists(path):
+        from safetensors.torch import load_file
+        return load_file(path)
+    return torch.load(os.path.join(adapter_dir, 'adapter_model.bin'), map_location='cpu')
+
+
+def setup(args):
+    """Set up everything that the checkpoints of a sweep share once: the accelerator, the
+    tokenized datasets, the loaders, and the base model with the adapter of `args.load_step`,
+    which `load_adapter` later replaces in place."""
     # Sending telemetry. Tracking the example usage helps us better allocate resources to maintain them. The
     # information sent is the one passed as arguments along with your Python/PyTorch versions.
     send_example_telemetry("run_glue_no_trainer", args)
 
-    laplace_output_dir = args.laplace_output_dir + f'step_{args.load_step}'
-    os.makedirs(laplace_output_dir, exist_ok=True)
-
-    subfolder_name = f"step_{args.load_step}"
-    step_dir = os.path.join(args.cache_dir, subfolder_name)
-    os.makedirs(step_dir, exist_ok=True)
-
-
     # Initialize the accelerator. We will let the accelerator handle device placement for us in this example.
     # If we're using tracking, we also need to initialize it here and it will by default pick up all supported trackers
     # in the environment
@@ -377,12 +383,7 @@ def main(load_step):
     padding = "max_length" if args.pad_to_max_length else False
 
     with accelerator.main_process_first():
-        processed_datasets = raw_datasets.map(
-        lambda examples: preprocess_function(examples,tokenizer,args,padding),
-        batched=True,
-        remove_columns=raw_datasets["train"].column_names,
-        desc="Running tokenizer on dataset",
-        )
+        processed_datasets = tokenize_datasets(raw_datasets, tokenizer, args, padding)
 
     train_dataset = processed_datasets["train"]
     processed_dataset = processed_datasets["validation_matched" if args.task_name == "mnli" else "validation"]
@@ -566,6 +567,42 @@ def main(load_step):
         )
     model.eval()
 
+    return SimpleNamespace(accelerator=accelerator, model=model, train_dataloader=train_dataloader,
+                           val_dataloader=val_dataloader if args.testing_set != 'val' else None,
+                           eval_dataloader=eval_dataloader)
+
+
+def load_adapter(args, run):
+    """Copy the LoRA weights and the classifier of the checkpoint of `args.load_step` into the
+    model of `run` in place, such that the base model, the datasets, and the loaders are reused."""
+    output_dir = args.output_dir + f'/step_{args.load_step}'
+    peft_model = run.accelerator.unwrap_model(run.model).model
+    peft_config, loaded_config = LoraConfig.from_pretrained(output_dir), peft_model.peft_config['default']
+    if (peft_config.base_model_name_or_path, peft_config.r, set(peft_config.target_modules)) != \
+            (loaded_config.base_model_name_or_path, loaded_config.r, set(loaded_config.target_modules)):
+        raise ValueError(f'The adapter in {output_dir} does not match the adapters of the loaded model.')
+
+    load_result = set_peft_model_state_dict(peft_model, load_adapter_state_dict(output_dir))
+    if load_result.unexpected_keys:
+        raise ValueError(f'Unexpected weights in {output_dir}: {load_result.unexpected_keys}')
+    # the state dict is loaded non-strictly, so the weights of the base model are always missing
+    missing_keys = [k for k in load_result.missing_keys if 'lora_' in k or 'modules_to_save' in k]
+    if missing_keys:
+        raise ValueError(f'Missing adapter weights in {output_dir}: {missing_keys}')
+    print(f'----loaded adapter of step {args.load_step}-----')
+
+
+def evaluate_checkpoint(args, run):
+    """Fit and evaluate the Laplace approximation at the adapter of `args.load_step`."""
+    accelerator, model = run.accelerator, run.model
+    train_dataloader, val_dataloader, eval_dataloader = run.train_dataloader, run.val_dataloader, run.eval_dataloader
+    output_dir = args.output_dir + f'/step_{args.load_step}'
+    laplace_output_dir = args.laplace_output_dir + f'step_{args.load_step}'
+    os.makedirs(laplace_output_dir, exist_ok=True)
+    step_dir = os.path.join(args.cache_dir, f"step_{args.load_step}")
+    os.makedirs(step_dir, exist_ok=True)
+    set_seed(args.seed)
+
     # Get the metric function
     if args.task_name is not None:
         if args.task_name in ['wnli', 'rte', 'mrpc', 'cola', 'sst2', 'qnli', 'qqp', 'mnli']:
@@ -577,7 +614,6 @@ def main(load_step):
     else:
         metric = evaluate.load("accuracy", experiment_id=f"{laplace_output_dir}/prior_precision_{args.laplace_hessian}_{args.laplace_sub}_{args.laplace_prior}_{args.laplace_optim_step}")
 
-
     la = Laplace(model, 'classification', prior_precision=1.,
                     subset_of_weights=args.laplace_sub,
                     hessian_structure=args.laplace_hessian)
@@ -691,15 +727,24 @@ def main(load_step):
     with open(all_results_path, "w") as f:
         json.dump(all_results, f)
 
-    del model, train_dataloader, la, f_mu, f_var, f_mu_list, f_var_list, metric, eval_metric, output_dicts, eval_dataloader
+    la.close()
+    del la, f_mu, f_var, f_mu_list, f_var_list, metric, eval_metric, output_dicts
     torch.cuda.empty_cache()
 
 
 
 
-if __name__ == "__main__":
+def main():
     args = parse_args()
-    #step_list = [0,*list(range(999, 4000 , 1000))]
-    step_list = args.step_list #[0,560,1121,1682,2243,2804]
-    for load_step in step_list:
-        main(load_step)
\ No newline at end of file
+    run = None
+    for load_step in args.load_steps or args.step_list:
+        args.load_step = load_step
+        if run is None:
+            run = setup(args)
+        else:
+            load_adapter(args, run)
+        evaluate_checkpoint(args, run)
+
+
+if __name__ == "__main__":
+    main()
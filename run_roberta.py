@@ -355,12 +355,7 @@ def main():
 
     padding = "max_length" if args.pad_to_max_length else False
 
-    processed_datasets = raw_datasets.map(
-    lambda examples: preprocessing.preprocess_function(examples,tokenizer,args,padding),
-    batched=True,
-    remove_columns=raw_datasets["train"].column_names,
-    desc="Running tokenizer on dataset",
-    )
+    processed_datasets = preprocessing.tokenize_datasets(raw_datasets, tokenizer, args, padding)
 
     # print('====train data====')
     train_dataset = processed_datasets["train"]